@@ -1,48 +1,101 @@
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form, Body
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form, Body, Query
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import os
+import re
+import time
 import uuid
 import cv2
 import numpy as np
 import face_recognition
-from sqlalchemy import create_engine, Column, String, LargeBinary, Boolean, DateTime
+from sqlalchemy import (
+    create_engine, Column, String, LargeBinary, Boolean, DateTime, Integer, Float, Index, UniqueConstraint, cast, func,
+)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from datetime import datetime, timedelta
 import jwt
-import secrets
 from passlib.context import CryptContext
 import json
+import heapq
+from settings import (
+    SQLALCHEMY_DATABASE_URL, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES,
+    UPLOADS_DIR, KNOWN_FACES_DIR, GALLERY_DIR, HOST, PORT, WORKERS,
+    GALLERY_SNAPSHOT_INTERVAL, GALLERY_SNAPSHOT_MAX_DELTA, GALLERY_SEARCH_MODE, GALLERY_RERANK_K,
+    GALLERY_SHARDS, GALLERY_SHARD_TIMEOUT, GALLERY_SHARD_CHECK_INTERVAL,
+    ROSTER_CACHE_TTL, DEFAULT_TENANT, TENANT_GALLERY_IDLE,
+    RESULT_CACHE_TTL, RESULT_CACHE_SIZE, FACE_MAX_IN_FLIGHT, LATENCY_BUDGETS, MATCH_THRESHOLD,
+    DEGRADE_MAX_LEVEL, DEGRADE_QUEUE_HIGH, DEGRADE_QUEUE_LOW, DEGRADE_WAIT_HIGH, DEGRADE_WAIT_LOW,
+    DEGRADE_STEP_INTERVAL, DEGRADE_DETECT_SIDE,
+    MONITOR_IMAGE_TARGET_SIDE, ENCODING_VERSION, FACE_WORKERS, FACE_WORKER_MAX_TASKS, FACE_WORKER_MAX_RSS_MB,
+    VERIFY_GATE_MAX_DIFF, VERIFY_GATE_MAX_AGE, VERIFY_GATE_SESSIONS,
+    TRACE_SAMPLE_RATE, TRACE_DIR, TRACE_MAX_BYTES, TRACE_BACKUPS,
+    DATA_DIR, SWEEP_INTERVAL, SWEEP_BATCH_SIZE, SESSION_MAX_DURATION, UPLOAD_RETENTION, UPLOAD_DELETE_RATE,
+    IMAGE_STORE_DIR, FACE_IMAGE_QUALITY, FACE_IMAGE_MAX_SIDE, FRAME_IMAGE_QUALITY, FRAME_IMAGE_MAX_SIDE, IMAGE_WRITE_QUEUE,
+)
+from gallery import FaceGallery, TenantGallery, TenantGalleries, FileLock, notify_gallery
+from shards import GalleryShards
+from face_pipeline import FaceError, LEGACY_ENCODING_VERSION, ENCODING_PROFILES, FULL_FIDELITY, analyze_frame, check_image_size
+from singleflight import SingleFlight, content_key
+from scheduler import FaceWorkScheduler, Overloaded
+from degradation import DegradationController
+from facepool import FacePool
+from sweeper import Sweeper, delete_old_files
+from framegate import FrameGate
+from sessions import ActiveSession, SessionRegistry
+from imagestore import LocalImageStore, ImageWriter, writer_metrics
+import tracing
+from tracing import root_span, span
+from metrics import format_metrics
+from migrations import upgrade_schema
 
 # Database setup
-SQLALCHEMY_DATABASE_URL = "sqlite:///./trustface.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Request tracing, including every SQL statement
+tracing.configure(TRACE_DIR, TRACE_SAMPLE_RATE, TRACE_MAX_BYTES, TRACE_BACKUPS)
+tracing.instrument_engine(engine)
+
 # Security setup
-SECRET_KEY = secrets.token_urlsafe(32)
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # Create directories if they don't exist
-os.makedirs("backend/uploads", exist_ok=True)
-os.makedirs("backend/known_faces", exist_ok=True)
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+os.makedirs(KNOWN_FACES_DIR, exist_ok=True)
+
+# Tenant ids name gallery directories, so they are kept to safe characters
+TENANT_ID_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
 
 # Database Models
+class Tenant(Base):
+    __tablename__ = "tenants"
+
+    # An institution sharing the deployment; its users, faces and exam
+    # sessions carry its id
+    id = Column(String, primary_key=True)
+    name = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # A tenant's users in username order, for keyset pages
+        Index("ix_users_tenant_username", "tenant_id", "username"),
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
-    username = Column(String, unique=True, index=True)
+    tenant_id = Column(String)
+    username = Column(String, unique=True, index=True)  # Unique across tenants
     hashed_password = Column(String)
     full_name = Column(String)
     is_active = Column(Boolean, default=True)
@@ -52,37 +105,600 @@ class User(Base):
 
 class FaceData(Base):
     __tablename__ = "face_data"
+    __table_args__ = (
+        # Changes to one tenant's gallery of one encoding version
+        Index("ix_face_data_tenant_version_seq", "tenant_id", "encoding_version", "seq"),
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = Column(String)
     user_id = Column(String, index=True)
     face_encoding = Column(LargeBinary)  # Stored as binary
+    encoding_version = Column(String, index=True)  # Encoder profile, see ENCODING_PROFILES
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    seq = Column(Integer, index=True)  # Gallery sequence number of the last change
+    image_key = Column(String, index=True)  # Enrolment crop in face_images, if kept
+
+class FaceDataTombstone(Base):
+    __tablename__ = "face_data_tombstones"
+    __table_args__ = (
+        Index("ix_face_data_tombstones_tenant_version_seq", "tenant_id", "encoding_version", "seq"),
+    )
+
+    # Records deleted face data so that workers can replay the deletion
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tenant_id = Column(String)
+    user_id = Column(String)
+    encoding_version = Column(String)
+    seq = Column(Integer, index=True)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+class GallerySequence(Base):
+    __tablename__ = "gallery_sequence"
+
+    # Single row counter ordering every change to the face gallery
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, default=0)
 
 class ExamSession(Base):
     __tablename__ = "exam_sessions"
+    __table_args__ = (
+        # Sessions of an exam by state, e.g. active and not yet verified
+        Index("ix_exam_sessions_exam_state", "exam_id", "is_active", "verified"),
+        # Active sessions by age
+        Index("ix_exam_sessions_active_start", "is_active", "start_time"),
+        # A tenant's sessions in id order, for keyset pages
+        Index("ix_exam_sessions_tenant", "tenant_id", "id"),
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = Column(String)
     user_id = Column(String, index=True)
     exam_id = Column(String)
     start_time = Column(DateTime, default=datetime.utcnow)
     end_time = Column(DateTime)
     is_active = Column(Boolean, default=True)
     verified = Column(Boolean, default=False)
+    verified_at = Column(DateTime)  # First successful verification
+
+class ExamSummary(Base):
+    __tablename__ = "exam_summaries"
+
+    # Per-exam session counters, updated in the same transaction as the
+    # session changes so reports do not have to scan exam_sessions
+    __table_args__ = (Index("ix_exam_summaries_tenant_exam", "tenant_id", "exam_id"),)
+
+    exam_id = Column(String, primary_key=True)  # Unique across tenants, owned by the first to use it
+    tenant_id = Column(String)
+    started = Column(Integer, default=0)
+    active = Column(Integer, default=0)
+    verified = Column(Integer, default=0)
+    ended = Column(Integer, default=0)
+    timed_verifications = Column(Integer, default=0)  # verified sessions with a verified_at
+    verification_seconds = Column(Float, default=0.0)  # total time from start to verification
+
+class ExamRoster(Base):
+    __tablename__ = "exam_rosters"
+    __table_args__ = (UniqueConstraint("exam_id", "user_id", name="uq_exam_rosters_exam_user"),)
+
+    # Candidates registered for an exam sitting
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tenant_id = Column(String)
+    exam_id = Column(String, index=True)
+    user_id = Column(String, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class VerificationFrame(Base):
+    __tablename__ = "verification_frames"
+
+    # Frames that went through face verification, kept for audit for
+    # UPLOAD_RETENTION; identical frames share one stored image
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String, index=True)
+    image_key = Column(String, index=True)  # in frame_images
+    distance = Column(Float)  # to the enrolled face, None if no face could be compared
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine, Base.metadata)
+
+def init_tenants():
+    """Create the default tenant and give it every row that predates tenants"""
+    db = SessionLocal()
+    try:
+        if db.query(Tenant.id).filter(Tenant.id == DEFAULT_TENANT).first() is None:
+            db.add(Tenant(id=DEFAULT_TENANT, name=DEFAULT_TENANT))
+            db.flush()
+        for model in (User, FaceData, FaceDataTombstone, ExamSession, ExamSummary, ExamRoster):
+            db.query(model).filter(model.tenant_id.is_(None)).update(
+                {model.tenant_id: DEFAULT_TENANT}, synchronize_session=False
+            )
+        db.commit()
+    except IntegrityError:
+        # Another worker created the tenant at the same time
+        db.rollback()
+    finally:
+        db.close()
+
+init_tenants()
+
+def init_gallery_sequence():
+    """Create the gallery sequence and number face data rows that predate it"""
+    db = SessionLocal()
+    try:
+        sequence = db.query(GallerySequence).filter(GallerySequence.id == 1).first()
+        if not sequence:
+            current = max(
+                db.query(func.max(FaceData.seq)).scalar() or 0,
+                db.query(func.max(FaceDataTombstone.seq)).scalar() or 0,
+            )
+            sequence = GallerySequence(id=1, value=current)
+            db.add(sequence)
+            db.flush()
+
+        missing = [row.id for row in db.query(FaceData.id).filter(FaceData.seq.is_(None))]
+        if missing:
+            start = sequence.value
+            db.bulk_update_mappings(FaceData, [
+                {"id": row_id, "seq": start + offset + 1} for offset, row_id in enumerate(missing)
+            ])
+            sequence.value = start + len(missing)
+
+        # Rows written before encodings were versioned
+        for model in (FaceData, FaceDataTombstone):
+            db.query(model).filter(model.encoding_version.is_(None)).update(
+                {model.encoding_version: LEGACY_ENCODING_VERSION}, synchronize_session=False
+            )
+        db.commit()
+    except IntegrityError:
+        # Another worker created the sequence at the same time
+        db.rollback()
+    finally:
+        db.close()
+
+init_gallery_sequence()
+
+def next_gallery_seq(db: Session):
+    """Reserve the next gallery sequence number in the current transaction.
+
+    The UPDATE takes the write lock, so numbers are committed in order.
+    """
+    db.query(GallerySequence).filter(GallerySequence.id == 1).update(
+        {GallerySequence.value: GallerySequence.value + 1}, synchronize_session=False
+    )
+    return db.query(GallerySequence.value).filter(GallerySequence.id == 1).scalar()
+
+def current_gallery_seq():
+    """Return the latest gallery sequence number handed out"""
+    db = SessionLocal()
+    try:
+        return db.query(GallerySequence.value).filter(GallerySequence.id == 1).scalar() or 0
+    finally:
+        db.close()
+
+def gallery_changes_since(tenant_id, version, seq):
+    """Yield (seq, user_id, encoding bytes or None) for changes after seq to
+    a tenant's encodings of one version"""
+    db = SessionLocal()
+    try:
+        deletions = [
+            (row.seq, row.user_id, None)
+            for row in db.query(FaceDataTombstone.seq, FaceDataTombstone.user_id).filter(
+                FaceDataTombstone.tenant_id == tenant_id, FaceDataTombstone.encoding_version == version,
+                FaceDataTombstone.seq > seq,
+            )
+        ]
+        updates = (
+            db.query(FaceData.seq, FaceData.user_id, FaceData.face_encoding)
+            .filter(FaceData.tenant_id == tenant_id, FaceData.encoding_version == version, FaceData.seq > seq)
+            .order_by(FaceData.seq)
+            .yield_per(1000)
+        )
+        yield from heapq.merge(updates, sorted(deletions), key=lambda change: change[0])
+    finally:
+        db.close()
+
+def prune_gallery_changes(tenant_id, version, seq):
+    """Delete tombstones already folded into a tenant's gallery snapshot of a version"""
+    db = SessionLocal()
+    try:
+        db.query(FaceDataTombstone).filter(
+            FaceDataTombstone.tenant_id == tenant_id, FaceDataTombstone.encoding_version == version,
+            FaceDataTombstone.seq <= seq,
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def load_encoding_versions(tenant_id):
+    """Return the current encoding version followed by every older version
+    that still has stored encodings of a tenant"""
+    db = SessionLocal()
+    try:
+        stored = {
+            row.encoding_version for row in
+            db.query(FaceData.encoding_version).filter(FaceData.tenant_id == tenant_id).distinct()
+        }
+    finally:
+        db.close()
+    return [ENCODING_VERSION] + sorted(stored - {ENCODING_VERSION, None})
+
+def gallery_directory(version, tenant_id=DEFAULT_TENANT):
+    # The default tenant keeps the layout from before tenants, so its
+    # existing snapshots stay valid
+    if tenant_id == DEFAULT_TENANT:
+        return os.path.join(GALLERY_DIR, version)
+    return os.path.join(GALLERY_DIR, "tenants", tenant_id, version)
+
+def seconds_between(start, end):
+    """SQL expression for the number of seconds between two timestamp columns"""
+    if engine.dialect.name == "sqlite":
+        return (func.julianday(end) - func.julianday(start)) * 86400
+    return func.extract("epoch", end - start)
+
+def exam_session_aggregates(db: Session):
+    """Query per-exam session counts and verification time, computed in SQL.
+
+    Rows have the same fields as ExamSummary.
+    """
+    return db.query(
+        ExamSession.exam_id,
+        ExamSession.tenant_id,
+        func.count(ExamSession.id).label("started"),
+        func.coalesce(func.sum(cast(ExamSession.is_active, Integer)), 0).label("active"),
+        func.coalesce(func.sum(cast(ExamSession.verified, Integer)), 0).label("verified"),
+        func.count(ExamSession.end_time).label("ended"),
+        func.count(ExamSession.verified_at).label("timed_verifications"),
+        func.coalesce(func.sum(seconds_between(ExamSession.start_time, ExamSession.verified_at)), 0).label("verification_seconds"),
+    ).group_by(ExamSession.exam_id, ExamSession.tenant_id)
+
+def init_exam_summaries():
+    """Fill the summary table from sessions recorded before it existed"""
+    db = SessionLocal()
+    try:
+        if db.query(ExamSummary.exam_id).first() is None and db.query(ExamSession.id).first() is not None:
+            db.add_all([ExamSummary(**row._mapping) for row in exam_session_aggregates(db)])
+            db.commit()
+    except IntegrityError:
+        # Another worker filled it at the same time
+        db.rollback()
+    finally:
+        db.close()
+
+init_exam_summaries()
+
+def ensure_exam_summary(exam_id, tenant_id):
+    """Create the summary row of an exam, committed on its own so that
+    concurrent first sessions of an exam do not conflict.
+
+    Returns the tenant the exam belongs to: the first tenant to use an exam
+    id keeps it.
+    """
+    db = SessionLocal()
+    try:
+        owner = db.query(ExamSummary.tenant_id).filter(ExamSummary.exam_id == exam_id).first()
+        if owner is None:
+            db.add(ExamSummary(
+                exam_id=exam_id, tenant_id=tenant_id, started=0, active=0, verified=0, ended=0,
+                timed_verifications=0, verification_seconds=0.0,
+            ))
+            db.commit()
+            return tenant_id
+        return owner.tenant_id
+    except IntegrityError:
+        db.rollback()
+        return db.query(ExamSummary.tenant_id).filter(ExamSummary.exam_id == exam_id).scalar()
+    finally:
+        db.close()
+
+def update_exam_summary(db: Session, exam_id, **deltas):
+    """Add to the counters of an exam's summary row in the current transaction"""
+    db.query(ExamSummary).filter(ExamSummary.exam_id == exam_id).update(
+        {getattr(ExamSummary, name): getattr(ExamSummary, name) + value for name, value in deltas.items()},
+        synchronize_session=False,
+    )
+
+def exam_report(row):
+    """Report fields of an ExamSummary or exam_session_aggregates row"""
+    return {
+        "exam_id": row.exam_id,
+        "started": row.started,
+        "active": row.active,
+        "verified": row.verified,
+        "ended": row.ended,
+        "avg_verification_seconds": row.verification_seconds / row.timed_verifications if row.timed_verifications else None,
+    }
+
+def load_exam_roster(tenant_id, exam_id):
+    """Return the user ids registered for an exam"""
+    db = SessionLocal()
+    try:
+        return [
+            row.user_id for row in
+            db.query(ExamRoster.user_id).filter(ExamRoster.exam_id == exam_id, ExamRoster.tenant_id == tenant_id)
+        ]
+    finally:
+        db.close()
+
+# Shard processes splitting up searches of whole galleries, if configured
+gallery_shards = (
+    GalleryShards(GALLERY_SHARDS, SECRET_KEY.encode(), GALLERY_SHARD_TIMEOUT, GALLERY_SHARD_CHECK_INTERVAL)
+    if GALLERY_SHARDS else None
+)
+
+def open_tenant_gallery(tenant_id):
+    """Open the face galleries of a tenant, shared by all worker processes,
+    and the cache of its exam roster galleries"""
+    galleries = {
+        version: FaceGallery(
+            gallery_directory(version, tenant_id),
+            lambda seq, version=version: gallery_changes_since(tenant_id, version, seq),
+            lambda seq, version=version: prune_gallery_changes(tenant_id, version, seq),
+            max_delta=GALLERY_SNAPSHOT_MAX_DELTA, search_mode=GALLERY_SEARCH_MODE, rerank_k=GALLERY_RERANK_K,
+            current_seq=current_gallery_seq,
+        )
+        for version in load_encoding_versions(tenant_id)
+    }
+    searchers = None
+    if gallery_shards is not None:
+        searchers = {
+            version: gallery_shards.gallery(f"{tenant_id}/{version}", version_gallery)
+            for version, version_gallery in galleries.items()
+        }
+    tenant_gallery = TenantGallery(
+        galleries,
+        ENCODING_VERSION,
+        lambda exam_id: load_exam_roster(tenant_id, exam_id),
+        ROSTER_CACHE_TTL,
+        searchers,
+    )
+    tenant_gallery.open(GALLERY_SNAPSHOT_INTERVAL)
+    return tenant_gallery
+
+# Each tenant's galleries, open only while the tenant is in use, so search
+# cost and memory follow the tenant rather than the whole deployment
+tenant_galleries = TenantGalleries(open_tenant_gallery, TENANT_GALLERY_IDLE)
+
+def notify_galleries(tenant_id, versions, seq):
+    """Tell every worker about committed changes to a tenant's encodings of these versions"""
+    tenant_gallery = tenant_galleries.loaded(tenant_id)
+    if tenant_gallery is not None:
+        versions = tenant_gallery.notify(versions, seq)
+    # Workers that have the tenant open still need to hear about it
+    for version in versions:
+        notify_gallery(gallery_directory(version, tenant_id), seq)
+
+def invalidate_rosters(tenant_id, exam_id):
+    tenant_gallery = tenant_galleries.loaded(tenant_id)
+    if tenant_gallery is not None:
+        tenant_gallery.invalidate_roster(exam_id)
+
+# Institutions known to exist, so requests only look a tenant up once
+known_tenants = set()
+
+def resolve_tenant(tenant_id):
+    """Return the tenant a request names, or the default tenant.
+
+    Unknown tenants are rejected before anything is opened for them.
+    """
+    tenant_id = tenant_id or DEFAULT_TENANT
+    if tenant_id not in known_tenants:
+        db = SessionLocal()
+        try:
+            exists = db.query(Tenant.id).filter(Tenant.id == tenant_id).first() is not None
+        finally:
+            db.close()
+        if not exists:
+            raise HTTPException(status_code=404, detail="Unknown institution")
+        known_tenants.add(tenant_id)
+    return tenant_id
+
+SESSION_COLUMNS = (
+    ExamSession.id, ExamSession.user_id, ExamSession.exam_id, ExamSession.start_time,
+    ExamSession.verified, ExamSession.verified_at, ExamSession.is_active,
+)
+
+def active_session(row):
+    return ActiveSession(row.user_id, row.exam_id, row.start_time, bool(row.verified), row.verified_at)
+
+def load_exam_session(session_id):
+    """Return (ActiveSession, is active) for a session id, or None"""
+    db = SessionLocal()
+    try:
+        row = db.query(*SESSION_COLUMNS).filter(ExamSession.id == session_id).first()
+    finally:
+        db.close()
+    return (active_session(row), bool(row.is_active)) if row else None
+
+# Active exam sessions, so verification does not read the session back
+exam_sessions = SessionRegistry(load_exam_session, SESSION_MAX_DURATION)
+
+def has_enrolled_face(tenant_id, user_id):
+    return any(version_gallery.get(user_id) is not None for _, version_gallery in tenant_galleries.get(tenant_id).active())
+
+def match_faces(tenant_gallery, faces, exam_id=None):
+    """Match the faces of a frame against every encoding version in use in
+    a tenant, or against the candidates registered for an exam.
+
+    ``faces`` comes from ``analyze_frame`` with the faces encoded once per
+    version. Returns the closest (user_id, distance) for each face.
+    """
+    matches = [(None, None)] * len(faces.locations)
+    for version, version_gallery in tenant_gallery.active():
+        if version not in faces.encodings:
+            continue
+        candidates = tenant_gallery.rosters[version].get(exam_id)[0] if exam_id else tenant_gallery.searchers[version]
+        for face, (user_id, distance) in enumerate(candidates.match_many(faces.encodings[version])):
+            if user_id is not None and (matches[face][0] is None or distance < matches[face][1]):
+                matches[face] = (user_id, distance)
+    return matches
+
+def rank_candidates(tenant_gallery, faces, k, exam_id=None):
+    """Return up to ``k`` (user_id, distance) of the enrolled users closest
+    to the only face of a frame, nearest first, over every encoding version
+    in use in a tenant or over the candidates registered for an exam"""
+    best = {}
+    for version, version_gallery in tenant_gallery.active():
+        if version not in faces.encodings:
+            continue
+        candidates = tenant_gallery.rosters[version].get(exam_id)[0] if exam_id else tenant_gallery.searchers[version]
+        for user_id, distance in candidates.nearest(faces.encodings[version][0], k):
+            if user_id not in best or distance < best[user_id]:
+                best[user_id] = distance
+    return heapq.nsmallest(k, best.items(), key=lambda candidate: candidate[1])
+
+# Shared results for duplicate frame submissions
+face_results = SingleFlight(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_SIZE)
+
+# Reuse of verification results for near-identical frames of a session
+frame_gate = FrameGate(VERIFY_GATE_MAX_DIFF, VERIFY_GATE_MAX_AGE, VERIFY_GATE_SESSIONS)
+
+# Cheaper face pipeline settings used under load, least loss of accuracy
+# first: the enrolment crop is only kept for reference, jitter capping only
+# changes profiles that jitter, and detecting on a smaller image, then
+# without upsampling, misses progressively larger faces
+DEGRADATION_LEVELS = [("no_crop", {"write_crop": False})]
+if any(profile["num_jitters"] > 1 for profile in ENCODING_PROFILES.values()):
+    DEGRADATION_LEVELS.append(("no_jitter", {"max_jitters": 1}))
+DEGRADATION_LEVELS += [
+    ("small_detection", {"detect_side": DEGRADE_DETECT_SIDE}),
+    ("no_upsample", {"upsample": 0}),
+]
+degradation = DegradationController(
+    FULL_FIDELITY, DEGRADATION_LEVELS[:DEGRADE_MAX_LEVEL],
+    DEGRADE_QUEUE_HIGH, DEGRADE_QUEUE_LOW, DEGRADE_WAIT_HIGH, DEGRADE_WAIT_LOW, DEGRADE_STEP_INTERVAL,
+)
+
+# Bounded, prioritized execution of face detection and encoding
+face_scheduler = FaceWorkScheduler(FACE_MAX_IN_FLIGHT, LATENCY_BUDGETS, controller=degradation)
+
+# Optional worker processes sharing one copy of the face models
+face_workers = None
+if FACE_WORKERS:
+    if FacePool.supported():
+        face_workers = FacePool(FACE_WORKERS, FACE_WORKER_MAX_TASKS, FACE_WORKER_MAX_RSS_MB * 1024 * 1024)
+    else:
+        print("Face worker processes need fork(), running the face pipeline in threads")
+
+def run_face_job(fn, *args):
+    """Run the CPU-heavy part of a face request in a worker process if there
+    are any, otherwise in the calling thread"""
+    if face_workers is None:
+        return fn(*args)
+    with span("face.worker"):
+        return face_workers.run(fn, *args)
+
+# Enrolment crops and verification frames, written off the request path
+face_images = ImageWriter(
+    LocalImageStore(os.path.join(IMAGE_STORE_DIR, "faces")), FACE_IMAGE_QUALITY, FACE_IMAGE_MAX_SIDE, IMAGE_WRITE_QUEUE
+)
+frame_images = ImageWriter(
+    LocalImageStore(os.path.join(IMAGE_STORE_DIR, "frames")), FRAME_IMAGE_QUALITY, FRAME_IMAGE_MAX_SIDE, IMAGE_WRITE_QUEUE
+)
+
+def delete_unreferenced_face_images(db: Session, keys):
+    """Delete the stored crops that no face data points to any more"""
+    keys = {key for key in keys if key}
+    if keys:
+        referenced = {row.image_key for row in db.query(FaceData.image_key).filter(FaceData.image_key.in_(keys))}
+        for key in keys - referenced:
+            face_images.store.delete(key)
+
+def close_stale_sessions():
+    """End exam sessions active for longer than SESSION_MAX_DURATION, a
+    batch of rows per transaction"""
+    cutoff = datetime.utcnow() - timedelta(seconds=SESSION_MAX_DURATION)
+    closed = 0
+    db = SessionLocal()
+    try:
+        while True:
+            # Uses the (is_active, start_time) index
+            ids = [
+                row.id for row in db.query(ExamSession.id)
+                .filter(ExamSession.is_active == True, ExamSession.start_time < cutoff)
+                .limit(SWEEP_BATCH_SIZE)
+            ]
+            if not ids:
+                break
+
+            # The end time marks the rows this batch closed, so the summary
+            # skips sessions that ended on their own in the meantime
+            end_time = datetime.utcnow()
+            db.query(ExamSession).filter(ExamSession.id.in_(ids), ExamSession.is_active == True).update(
+                {ExamSession.end_time: end_time, ExamSession.is_active: False}, synchronize_session=False
+            )
+            for exam_id, count in (
+                db.query(ExamSession.exam_id, func.count(ExamSession.id))
+                .filter(ExamSession.id.in_(ids), ExamSession.end_time == end_time)
+                .group_by(ExamSession.exam_id)
+            ):
+                update_exam_summary(db, exam_id, active=-count, ended=count)
+                closed += count
+            db.commit()
+            exam_sessions.remove(ids)
+    finally:
+        db.close()
+    return {"rows": closed}
+
+def delete_old_uploads():
+    """Delete uploaded photos and verification frames past UPLOAD_RETENTION"""
+    files, reclaimed = delete_old_files(UPLOADS_DIR, UPLOAD_RETENTION, SWEEP_BATCH_SIZE, UPLOAD_DELETE_RATE)
+    return {"files": files, "bytes": reclaimed}
+
+def delete_old_frames():
+    """Delete verification frames and their records past UPLOAD_RETENTION"""
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_RETENTION)
+    rows = 0
+    db = SessionLocal()
+    try:
+        while True:
+            ids = [
+                row.id for row in db.query(VerificationFrame.id)
+                .filter(VerificationFrame.created_at < cutoff)
+                .limit(SWEEP_BATCH_SIZE)
+            ]
+            if not ids:
+                break
+            db.query(VerificationFrame).filter(VerificationFrame.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            rows += len(ids)
+    finally:
+        db.close()
+
+    # Storing a frame again refreshes its age, so images still referenced
+    # by a recent record are never older than the cutoff
+    files, reclaimed = frame_images.store.delete_older_than(UPLOAD_RETENTION, SWEEP_BATCH_SIZE, UPLOAD_DELETE_RATE)
+    return {"rows": rows, "files": files, "bytes": reclaimed}
+
+sweep_tasks = []
+if SESSION_MAX_DURATION:
+    sweep_tasks.append(("stale_sessions", close_stale_sessions))
+if UPLOAD_RETENTION:
+    sweep_tasks.append(("uploads", delete_old_uploads))
+    sweep_tasks.append(("frames", delete_old_frames))
+
+# Periodic cleanup, one worker at a time
+sweeper = Sweeper(sweep_tasks, SWEEP_INTERVAL, FileLock(os.path.join(DATA_DIR, "sweeper.lock")))
+
+# Roles a user can have; self-registered users are students, other roles
+# are given by an admin
+ROLES = ("student", "admin", "proctor")
 
 # Pydantic models
 class UserBase(BaseModel):
     username: str
     full_name: str
-    role: str = "student"
 
 class UserCreate(UserBase):
     password: str
+    tenant: Optional[str] = None  # institution, the default one if not given
 
 class UserResponse(UserBase):
     id: str
+    role: str
+    tenant_id: Optional[str] = None
     is_active: bool
     face_registered: bool
     created_at: datetime
@@ -100,6 +716,14 @@ class TokenData(BaseModel):
 
 class FaceLoginRequest(BaseModel):
     image_data: str  # base64 encoded image
+    tenant: Optional[str] = None  # institution whose faces to search, the default one if not given
+    exam_id: Optional[str] = None  # only match candidates on this exam's roster
+
+class RosterUpdate(BaseModel):
+    usernames: List[str]
+
+class RoleUpdate(BaseModel):
+    role: str
 
 class FaceLoginResponse(BaseModel):
     success: bool
@@ -121,6 +745,86 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_requests(request, call_next):
+    # Root span of the request; spans started while handling it become its children
+    with root_span(f"{request.method} {request.url.path}", "SERVER", **{
+        "http.method": request.method, "http.target": request.url.path,
+    }) as request_span:
+        response = await call_next(request)
+        request_span.set_attribute("http.status_code", response.status_code)
+        return response
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.on_event("startup")
+def start_face_workers():
+    # Runs first, so the workers are forked before any other thread starts
+    if face_workers is not None:
+        face_workers.start()
+
+@app.on_event("shutdown")
+def stop_face_workers():
+    if face_workers is not None:
+        face_workers.stop()
+
+@app.on_event("startup")
+def start_image_writers():
+    face_images.start("face-image-writer")
+    frame_images.start("frame-image-writer")
+
+@app.on_event("shutdown")
+def stop_image_writers():
+    # Writes out the images still queued
+    face_images.stop()
+    frame_images.stop()
+
+@app.on_event("startup")
+def open_gallery():
+    # Maps the last snapshot and only reads face data changed since then.
+    # Other tenants are opened on their first face request
+    tenant_galleries.get(DEFAULT_TENANT)
+
+@app.on_event("shutdown")
+def close_gallery():
+    tenant_galleries.close()
+
+@app.on_event("startup")
+def start_gallery_shards():
+    # Shards count as down until the first health check reaches them
+    if gallery_shards is not None:
+        gallery_shards.start()
+
+@app.on_event("shutdown")
+def stop_gallery_shards():
+    if gallery_shards is not None:
+        gallery_shards.stop()
+
+@app.on_event("startup")
+def load_exam_sessions():
+    # Uses the (is_active, start_time) index
+    db = SessionLocal()
+    try:
+        rows = db.query(*SESSION_COLUMNS).filter(ExamSession.is_active == True).all()
+    finally:
+        db.close()
+    exam_sessions.load((row.id, active_session(row)) for row in rows)
+
+@app.on_event("startup")
+def start_sweeper():
+    if sweep_tasks:
+        sweeper.start()
+
+@app.on_event("shutdown")
+def stop_sweeper():
+    sweeper.stop()
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
@@ -149,9 +853,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 def get_user(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
-def authenticate_user(db: Session, username: str, password: str):
+def authenticate_user(db: Session, username: str, password: str, tenant_id: str):
     user = get_user(db, username)
-    if not user:
+    if not user or user.tenant_id != tenant_id:
         return False
     if not verify_password(password, user.hashed_password):
         return False
@@ -163,22 +867,50 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    with span("auth"):
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except jwt.PyJWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except jwt.PyJWTError:
-        raise credentials_exception
-    user = get_user(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
+        user = get_user(db, username=token_data.username)
+        # A token only works for the tenant it was issued in; tokens from
+        # before tenants belong to the default one
+        if user is None or user.tenant_id != payload.get("tenant", DEFAULT_TENANT):
+            raise credentials_exception
+        return user
+
+async def get_current_staff(current_user: User = Depends(get_current_user)):
+    if current_user.role not in ("admin", "proctor"):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return current_user
+
+async def get_current_admin(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return current_user
+
+def keyset_page(query, key_column, after, limit):
+    """Return one page of ``query`` ordered by a unique indexed column.
+
+    Pages start after the last key of the previous page instead of using
+    OFFSET, so every page costs the same however deep it is. Returns the
+    rows and the key to pass as ``after`` for the next page (None at the end).
+    """
+    if after is not None:
+        query = query.filter(key_column > after)
+    rows = query.order_by(key_column).limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], getattr(rows[limit - 1], key_column.key)
+    return rows, None
 
 # API Routes
 @app.post("/register", response_model=UserResponse)
 def register_user(user: UserCreate, db: Session = Depends(get_db)):
+    tenant_id = resolve_tenant(user.tenant)
     db_user = db.query(User).filter(User.username == user.username).first()
     if db_user:
         raise HTTPException(
@@ -188,10 +920,11 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
 
     hashed_password = get_password_hash(user.password)
     db_user = User(
+        tenant_id=tenant_id,
         username=user.username,
         hashed_password=hashed_password,
         full_name=user.full_name,
-        role=user.role,
+        role="student",
         face_registered=False  # Face not registered yet
     )
     db.add(db_user)
@@ -200,8 +933,12 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+def login_for_access_token(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    tenant: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    user = authenticate_user(db, form_data.username, form_data.password, resolve_tenant(tenant))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -213,43 +950,67 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     # But include face registration status in the response
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "tenant": user.tenant_id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer", "face_registered": user.face_registered}
 
+def load_enrolment_face(data):
+    """Return the crop (None when skipped under load) and encoding of the
+    only face in an enrolment photo"""
+    fidelity = degradation.fidelity
+    faces = run_face_job(
+        analyze_frame, data, [ENCODING_VERSION], None,
+        "Multiple faces detected. Please upload an image with only one face", fidelity["write_crop"], fidelity,
+    )
+    return faces.crops[0] if faces.crops else None, faces.encodings[ENCODING_VERSION][0]
+
 @app.post("/upload-face")
 async def upload_face(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Save uploaded file
-    file_location = f"backend/uploads/{current_user.id}_{file.filename}"
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
-
     # Process the image to extract face encoding
-    image = face_recognition.load_image_file(file_location)
-    face_locations = face_recognition.face_locations(image)
-
-    if not face_locations:
-        raise HTTPException(status_code=400, detail="No face detected in the image")
-
-    if len(face_locations) > 1:
-        raise HTTPException(status_code=400, detail="Multiple faces detected. Please upload an image with only one face")
+    data = await file.read()
+    try:
+        face_image, face_encoding = await face_scheduler.run("enrolment", load_enrolment_face, data)
+    except FaceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    face_encoding = face_recognition.face_encodings(image, face_locations)[0]
+    # Keep the face crop for reference
+    image_key = face_images.save(face_image) if face_image is not None else None
 
     # Check if user already has face data
-    existing_face_data = db.query(FaceData).filter(FaceData.user_id == current_user.id).first()
+    seq = next_gallery_seq(db)
+    existing_face_data = None
+    changed_versions = {ENCODING_VERSION}
+    replaced_images = set()
+    for data in db.query(FaceData).filter(FaceData.user_id == current_user.id):
+        replaced_images.add(data.image_key)
+        if data.encoding_version == ENCODING_VERSION and existing_face_data is None:
+            existing_face_data = data
+        else:
+            # The new photo supersedes encodings made with older profiles
+            db.delete(data)
+            db.add(FaceDataTombstone(
+                tenant_id=current_user.tenant_id, user_id=current_user.id, encoding_version=data.encoding_version, seq=seq
+            ))
+            changed_versions.add(data.encoding_version)
+
     if existing_face_data:
         # Update existing face data
         existing_face_data.face_encoding = face_encoding.tobytes()
+        existing_face_data.seq = seq
+        existing_face_data.image_key = image_key
     else:
         # Save new face encoding to database
         face_data = FaceData(
+            tenant_id=current_user.tenant_id,
             user_id=current_user.id,
-            face_encoding=face_encoding.tobytes()
+            face_encoding=face_encoding.tobytes(),
+            encoding_version=ENCODING_VERSION,
+            seq=seq,
+            image_key=image_key
         )
         db.add(face_data)
 
@@ -258,77 +1019,79 @@ async def upload_face(
 
     db.commit()
 
-    # Save the face image for reference
-    face_image_path = f"backend/known_faces/{current_user.id}.jpg"
-    top, right, bottom, left = face_locations[0]
-    face_image = image[top:bottom, left:right]
-    face_image_rgb = cv2.cvtColor(face_image, cv2.COLOR_RGB2BGR)
-    cv2.imwrite(face_image_path, face_image_rgb)
+    # Let every worker pick up the new encoding
+    notify_galleries(current_user.tenant_id, changed_versions, seq)
+
+    # Do not leave the previous photo's crop behind
+    delete_unreferenced_face_images(db, replaced_images - {image_key})
+    legacy_image_path = os.path.join(KNOWN_FACES_DIR, f"{current_user.id}.jpg")
+    if os.path.exists(legacy_image_path):
+        os.remove(legacy_image_path)
 
     return {"message": "Face data uploaded successfully", "face_registered": True}
 
+def identify_login_face(image_data, tenant_id, exam_id=None):
+    """Find the tenant's enrolled face closest to the face in a login frame.
+
+    Returns (user_id, distance, message); message explains why there is no
+    candidate when user_id is None.
+    """
+    tenant_gallery = tenant_galleries.get(tenant_id)
+    versions = [version for version, _ in tenant_gallery.active()]
+    try:
+        faces = run_face_job(
+            analyze_frame, image_data, versions, None,
+            "Multiple faces detected. Please ensure only one person is in the frame", False, degradation.fidelity,
+        )
+    except FaceError as e:
+        return None, None, str(e)
+
+    if exam_id:
+        roster_galleries = [tenant_gallery.rosters[version].get(exam_id) for version, _ in tenant_gallery.active()]
+        if not roster_galleries[0][1]:
+            return None, None, "No candidates are registered for this exam"
+        if not any(len(roster_gallery) for roster_gallery, _ in roster_galleries):
+            return None, None, "No candidate registered for this exam has registered their face"
+
+    # Compare with all known faces in one vectorized pass, or only with
+    # the candidates registered for the exam
+    best_match_user_id, best_match_distance = match_faces(tenant_gallery, faces, exam_id)[0]
+
+    if best_match_user_id is None:
+        return None, None, "No face data available in the system"
+
+    return best_match_user_id, best_match_distance, None
+
 @app.post("/face-login", response_model=FaceLoginResponse)
 async def face_login(request: FaceLoginRequest, db: Session = Depends(get_db)):
+    tenant_id = resolve_tenant(request.tenant)
     try:
         # Decode base64 image
         import base64
         header, encoded = request.image_data.split(",", 1)
         image_data = base64.b64decode(encoded)
 
-        # Convert to numpy array
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        # Convert to RGB for face_recognition
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        # Find faces in the image
-        face_locations = face_recognition.face_locations(rgb_img)
-
-        if not face_locations:
-            return FaceLoginResponse(
-                success=False,
-                message="No face detected in the image"
-            )
-
-        if len(face_locations) > 1:
-            return FaceLoginResponse(
-                success=False,
-                message="Multiple faces detected. Please ensure only one person is in the frame"
-            )
-
-        # Get face encoding
-        face_encoding = face_recognition.face_encodings(rgb_img, face_locations)[0]
-
-        # Get all face encodings from database
-        all_face_data = db.query(FaceData).all()
+        # Retried or double-clicked submissions of the same frame share one
+        # result, until any of the tenant's enrolled faces changes
+        best_match_user_id, best_match_distance, message = await face_results.run(
+            content_key(image_data, "face-login", tenant_id, request.exam_id, tenant_galleries.get(tenant_id).latest_seq),
+            lambda: face_scheduler.run("login", identify_login_face, image_data, tenant_id, request.exam_id),
+        )
 
-        if not all_face_data:
+        if best_match_user_id is None:
             return FaceLoginResponse(
                 success=False,
-                message="No face data available in the system"
+                message=message
             )
 
-        # Compare with known faces
-        best_match_user_id = None
-        best_match_distance = float('inf')
-
-        for face_data in all_face_data:
-            known_encoding = np.frombuffer(face_data.face_encoding, dtype=np.float64)
-            distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
-
-            if distance < best_match_distance:
-                best_match_distance = distance
-                best_match_user_id = face_data.user_id
-
         # Check if match is good enough (threshold can be adjusted)
-        if best_match_distance < 0.6:  # Lower is more strict
+        if best_match_distance < MATCH_THRESHOLD:  # Lower is more strict
             user = db.query(User).filter(User.id == best_match_user_id).first()
             if user:
                 # Create access token
                 access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
                 access_token = create_access_token(
-                    data={"sub": user.username}, expires_delta=access_token_expires
+                    data={"sub": user.username, "tenant": user.tenant_id}, expires_delta=access_token_expires
                 )
 
                 return FaceLoginResponse(
@@ -345,6 +1108,8 @@ async def face_login(request: FaceLoginRequest, db: Session = Depends(get_db)):
             message="Face not recognized. Please try again or register your face."
         )
 
+    except Overloaded:
+        raise
     except Exception as e:
         return FaceLoginResponse(
             success=False,
@@ -357,24 +1122,65 @@ async def start_exam_session(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Check if user has face data
-    face_data = db.query(FaceData).filter(FaceData.user_id == current_user.id).first()
-    if not face_data:
+    # Check if user has face data, in the gallery rather than the database
+    if not has_enrolled_face(current_user.tenant_id, current_user.id):
         raise HTTPException(
             status_code=400,
             detail="No face data found. Please register your face before starting an exam."
         )
 
     # Create exam session
-    exam_session = ExamSession(
+    if ensure_exam_summary(exam_id, current_user.tenant_id) != current_user.tenant_id:
+        raise HTTPException(status_code=409, detail="This exam id is in use by another institution")
+    session_id = str(uuid.uuid4())
+    start_time = datetime.utcnow()
+    db.add(ExamSession(
+        id=session_id,
+        tenant_id=current_user.tenant_id,
         user_id=current_user.id,
-        exam_id=exam_id
-    )
-    db.add(exam_session)
+        exam_id=exam_id,
+        start_time=start_time
+    ))
+    update_exam_summary(db, exam_id, started=1, active=1)
     db.commit()
-    db.refresh(exam_session)
+    exam_sessions.add(session_id, ActiveSession(current_user.id, exam_id, start_time))
 
-    return {"message": "Exam session started successfully", "session_id": exam_session.id}
+    return {"message": "Exam session started successfully", "session_id": session_id}
+
+def verify_session_face(frame, tenant_id, user_id):
+    """Compare the face in a verification frame with the user's enrolled face.
+
+    Returns (distance, error message).
+    """
+    # Get user's face encoding from the gallery, and encode the frame with
+    # the same profile as the stored encoding
+    for version, version_gallery in tenant_galleries.get(tenant_id).active():
+        known_encoding = version_gallery.get(user_id)
+        if known_encoding is not None:
+            break
+    else:
+        return None, "No face data found for this user"
+
+    try:
+        faces = run_face_job(analyze_frame, frame, [version], None, "Multiple faces detected", False, degradation.fidelity)
+    except FaceError as e:
+        return None, str(e)
+    face_encoding = faces.encodings[version][0]
+    return float(np.linalg.norm(known_encoding - face_encoding)), None
+
+def frame_thumbnail(frame):
+    """Frame gate thumbnail of an uploaded frame, checked against the pixel
+    budget before anything is decoded"""
+    check_image_size(frame)
+    return frame_gate.thumbnail(frame)
+
+def within_pixel_budget(frame):
+    """Whether a frame is an image within the pixel budget, read from its header"""
+    try:
+        check_image_size(frame)
+    except FaceError:
+        return False
+    return True
 
 @app.post("/verify-exam-session")
 async def verify_exam_session(
@@ -384,46 +1190,170 @@ async def verify_exam_session(
     db: Session = Depends(get_db)
 ):
     # Get exam session
-    exam_session = db.query(ExamSession).filter(ExamSession.id == session_id).first()
+    exam_session = exam_sessions.get(session_id)
     if not exam_session:
         raise HTTPException(status_code=404, detail="Exam session not found")
 
     if exam_session.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to verify this session")
 
-    # Save uploaded file
-    file_location = f"backend/uploads/verify_{session_id}_{file.filename}"
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
-
-    # Process the image to extract face encoding
-    image = face_recognition.load_image_file(file_location)
-    face_locations = face_recognition.face_locations(image)
-
-    if not face_locations:
-        raise HTTPException(status_code=400, detail="No face detected in the image")
-
-    if len(face_locations) > 1:
-        raise HTTPException(status_code=400, detail="Multiple faces detected")
-
-    face_encoding = face_recognition.face_encodings(image, face_locations)[0]
-
-    # Get user's face encoding from database
-    user_face_data = db.query(FaceData).filter(FaceData.user_id == current_user.id).first()
-    if not user_face_data:
-        raise HTTPException(status_code=400, detail="No face data found for this user")
+    frame = await file.read()
+
+    # A still candidate sends nearly identical frames, which reuse the
+    # result of the session's last verified frame
+    seq = tenant_galleries.get(current_user.tenant_id).latest_seq
+    thumbnail = None
+    if frame_gate.enabled:
+        # Decoding even a reduced frame is CPU work, so it waits for a slot
+        # off the event loop like the rest of the pipeline
+        try:
+            thumbnail = await face_scheduler.run("verification", frame_thumbnail, frame)
+        except FaceError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    distance = frame_gate.check(session_id, thumbnail, seq) if thumbnail is not None else None
+
+    if distance is None:
+        # Retried submissions of the same frame for this user and session
+        # share one result, until any enrolled face changes
+        with span("face.verify"):
+            distance, error = await face_results.run(
+                content_key(frame, "verify", current_user.id, session_id, seq),
+                lambda: face_scheduler.run("verification", verify_session_face, frame, current_user.tenant_id, current_user.id),
+            )
 
-    known_encoding = np.frombuffer(user_face_data.face_encoding, dtype=np.float64)
-    distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
+        # Keep the frame for audit. Frames that could not be read or are over
+        # the pixel budget are not stored: re-encoding them would decode them
+        # in full in the writer thread
+        image_key = frame_images.save(frame) if thumbnail is not None or within_pixel_budget(frame) else None
+        db.add(VerificationFrame(session_id=session_id, image_key=image_key, distance=distance))
+        if error:
+            db.commit()
+            raise HTTPException(status_code=400, detail=error)
+        if thumbnail is not None and distance < MATCH_THRESHOLD:
+            frame_gate.store(session_id, thumbnail, seq, distance)
 
     # Check if match is good enough
-    if distance < 0.6:  # Lower is more strict
-        exam_session.verified = True
-        db.commit()
+    if distance < MATCH_THRESHOLD:  # Lower is more strict
+        # Only the first successful verification counts towards the report;
+        # the update stays conditional for sessions verified by another worker
+        verified_at = datetime.utcnow()
+        if not exam_session.verified:
+            first = (
+                db.query(ExamSession)
+                .filter(ExamSession.id == session_id, ExamSession.verified == False)
+                .update({ExamSession.verified: True, ExamSession.verified_at: verified_at}, synchronize_session=False)
+            )
+            if first:
+                update_exam_summary(
+                    db, exam_session.exam_id, verified=1, timed_verifications=1,
+                    verification_seconds=(verified_at - exam_session.start_time).total_seconds(),
+                )
+        with span("db.commit"):
+            db.commit()
+        exam_sessions.mark_verified(session_id, verified_at)
         return {"message": "Face verified successfully", "verified": True}
     else:
+        db.commit()
         return {"message": "Face verification failed", "verified": False}
 
+def identify_frame_faces(frame, tenant_id, exam_id=None):
+    """Identify every face in a frame against a tenant's gallery or an exam roster.
+
+    All faces are encoded together and matched with one matrix-matrix
+    distance computation. Returns one (location, user_id, distance) per face.
+    """
+    tenant_gallery = tenant_galleries.get(tenant_id)
+    versions = [version for version, _ in tenant_gallery.active()]
+    faces = run_face_job(analyze_frame, frame, versions, MONITOR_IMAGE_TARGET_SIDE, None, False, degradation.fidelity)
+    if not faces.locations:
+        return []
+
+    matches = match_faces(tenant_gallery, faces, exam_id)
+    return [(location, user_id, distance) for location, (user_id, distance) in zip(faces.locations, matches)]
+
+def identify_candidates(image_data, tenant_id, k, exam_id=None):
+    """Encode the face of a frame and rank the tenant's ``k`` closest enrolled users.
+
+    Returns (candidates, seconds spent searching the galleries).
+    """
+    tenant_gallery = tenant_galleries.get(tenant_id)
+    versions = [version for version, _ in tenant_gallery.active()]
+    faces = run_face_job(
+        analyze_frame, image_data, versions, None,
+        "Multiple faces detected. Please use an image of one person", False, degradation.fidelity,
+    )
+    started = time.perf_counter()
+    candidates = rank_candidates(tenant_gallery, faces, k, exam_id)
+    return candidates, time.perf_counter() - started
+
+@app.post("/admin/identify")
+async def identify_face(
+    file: UploadFile = File(...),
+    k: int = Form(5, ge=1, le=50),
+    exam_id: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_staff),
+    db: Session = Depends(get_db)
+):
+    # Proctor review of a failed or borderline face login: the closest
+    # enrolled users, not only the best match
+    image_data = await file.read()
+    try:
+        candidates, search_seconds = await face_scheduler.run(
+            "login", identify_candidates, image_data, current_user.tenant_id, k, exam_id
+        )
+    except FaceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    user_ids = [user_id for user_id, _ in candidates]
+    users = {
+        row.id: row for row in
+        db.query(User.id, User.username, User.full_name).filter(User.id.in_(user_ids))
+    } if user_ids else {}
+    return {
+        "threshold": MATCH_THRESHOLD,
+        "search_ms": round(search_seconds * 1000, 3),
+        "candidates": [
+            {
+                "rank": rank,
+                "user_id": user_id,
+                "username": users[user_id].username if user_id in users else None,
+                "full_name": users[user_id].full_name if user_id in users else None,
+                "distance": distance,
+                "match": distance < MATCH_THRESHOLD,
+            }
+            for rank, (user_id, distance) in enumerate(candidates, 1)
+        ],
+    }
+
+@app.post("/monitor-frame")
+async def monitor_frame(
+    file: UploadFile = File(...),
+    exam_id: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_staff),
+    db: Session = Depends(get_db)
+):
+    # Proctor camera covering a room: identify everyone in the frame at once
+    frame = await file.read()
+    try:
+        faces = await face_scheduler.run("verification", identify_frame_faces, frame, current_user.tenant_id, exam_id)
+    except FaceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    recognized_ids = {user_id for _, user_id, distance in faces if user_id and distance < MATCH_THRESHOLD}  # Lower is more strict
+    usernames = dict(db.query(User.id, User.username).filter(User.id.in_(recognized_ids)).all()) if recognized_ids else {}
+
+    results = []
+    for (top, right, bottom, left), user_id, distance in faces:
+        recognized = user_id is not None and distance < MATCH_THRESHOLD
+        results.append({
+            "box": {"top": top, "right": right, "bottom": bottom, "left": left},
+            "recognized": recognized,
+            "user_id": user_id if recognized else None,
+            "username": usernames.get(user_id) if recognized else None,
+            "distance": distance,
+        })
+    return {"face_count": len(results), "faces": results}
+
 @app.post("/end-exam-session")
 async def end_exam_session(
     session_id: str,
@@ -431,16 +1361,23 @@ async def end_exam_session(
     db: Session = Depends(get_db)
 ):
     # Get exam session
-    exam_session = db.query(ExamSession).filter(ExamSession.id == session_id).first()
+    exam_session = exam_sessions.get(session_id)
     if not exam_session:
         raise HTTPException(status_code=404, detail="Exam session not found")
 
     if exam_session.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to end this session")
 
-    exam_session.end_time = datetime.utcnow()
-    exam_session.is_active = False
+    ended = (
+        db.query(ExamSession)
+        .filter(ExamSession.id == session_id, ExamSession.is_active == True)
+        .update({ExamSession.end_time: datetime.utcnow(), ExamSession.is_active: False}, synchronize_session=False)
+    )
+    if ended:
+        update_exam_summary(db, exam_session.exam_id, active=-1, ended=1)
     db.commit()
+    exam_sessions.remove([session_id])
+    frame_gate.forget(session_id)
 
     return {"message": "Exam session ended successfully"}
 
@@ -462,24 +1399,285 @@ async def clear_face_data(
 ):
     # Delete user's face data
     face_data = db.query(FaceData).filter(FaceData.user_id == current_user.id).all()
+    image_keys = {data.image_key for data in face_data}
     for data in face_data:
         db.delete(data)
 
+    # Record the deletion so that every worker's gallery drops the face
+    seq = next_gallery_seq(db)
+    deleted_versions = {data.encoding_version for data in face_data} or {ENCODING_VERSION}
+    for version in deleted_versions:
+        db.add(FaceDataTombstone(tenant_id=current_user.tenant_id, user_id=current_user.id, encoding_version=version, seq=seq))
+
     # Update user's face_registered flag
     current_user.face_registered = False
 
-    # Delete face image file
-    face_image_path = f"backend/known_faces/{current_user.id}.jpg"
+    # Delete a face image saved before the image store
+    face_image_path = os.path.join(KNOWN_FACES_DIR, f"{current_user.id}.jpg")
     if os.path.exists(face_image_path):
         os.remove(face_image_path)
 
     db.commit()
+
+    notify_galleries(current_user.tenant_id, deleted_versions, seq)
+    delete_unreferenced_face_images(db, image_keys)
+
     return {"message": "Face data cleared successfully", "face_registered": False}
 
+@app.get("/exams/{exam_id}/roster")
+async def get_exam_roster(
+    exam_id: str,
+    current_user: User = Depends(get_current_staff),
+    db: Session = Depends(get_db)
+):
+    roster = (
+        db.query(User.id, User.username, User.full_name, User.face_registered)
+        .join(ExamRoster, ExamRoster.user_id == User.id)
+        .filter(ExamRoster.exam_id == exam_id, ExamRoster.tenant_id == current_user.tenant_id)
+        .order_by(User.username)
+        .all()
+    )
+    return [
+        {"user_id": row.id, "username": row.username, "full_name": row.full_name, "face_registered": row.face_registered}
+        for row in roster
+    ]
+
+@app.post("/exams/{exam_id}/roster")
+async def add_to_exam_roster(
+    exam_id: str,
+    update: RosterUpdate,
+    current_user: User = Depends(get_current_staff),
+    db: Session = Depends(get_db)
+):
+    users = (
+        db.query(User.id, User.username)
+        .filter(User.username.in_(update.usernames), User.tenant_id == current_user.tenant_id)
+        .all()
+    )
+    unknown = sorted(set(update.usernames) - {user.username for user in users})
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown users: {', '.join(unknown)}")
+
+    # Skip candidates that are already on the roster
+    existing = {
+        row.user_id for row in db.query(ExamRoster.user_id)
+        .filter(ExamRoster.exam_id == exam_id, ExamRoster.user_id.in_([user.id for user in users]))
+    }
+    added = [
+        ExamRoster(tenant_id=current_user.tenant_id, exam_id=exam_id, user_id=user.id)
+        for user in users if user.id not in existing
+    ]
+    db.add_all(added)
+    db.commit()
+
+    invalidate_rosters(current_user.tenant_id, exam_id)
+    return {"message": f"Added {len(added)} candidates to the roster", "added": len(added)}
+
+@app.delete("/exams/{exam_id}/roster/{username}")
+async def remove_from_exam_roster(
+    exam_id: str,
+    username: str,
+    current_user: User = Depends(get_current_staff),
+    db: Session = Depends(get_db)
+):
+    user = get_user(db, username)
+    if not user or user.tenant_id != current_user.tenant_id:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    removed = (
+        db.query(ExamRoster)
+        .filter(ExamRoster.exam_id == exam_id, ExamRoster.user_id == user.id)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    if not removed:
+        raise HTTPException(status_code=404, detail="User is not on the roster")
+
+    invalidate_rosters(current_user.tenant_id, exam_id)
+    return {"message": "Candidate removed from the roster"}
+
+@app.post("/exams/{exam_id}/open-sitting")
+async def open_exam_sitting(
+    exam_id: str,
+    current_user: User = Depends(get_current_staff)
+):
+    # Prebuild the roster galleries so the first face logins do not pay for them
+    tenant_gallery = tenant_galleries.get(current_user.tenant_id)
+    roster_galleries = [tenant_gallery.rosters[version].open(exam_id) for version, _ in tenant_gallery.active()]
+    return {
+        "message": "Exam sitting opened",
+        "roster_size": roster_galleries[0][1],
+        "faces_loaded": sum(len(roster_gallery) for roster_gallery, _ in roster_galleries),
+    }
+
+@app.get("/admin/users")
+async def list_users(
+    role: Optional[str] = None,
+    after: Optional[str] = Query(None, description="Username to continue after, from next_after"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    query = (
+        db.query(User.id, User.username, User.full_name, User.role, User.is_active, User.face_registered, User.created_at)
+        .filter(User.tenant_id == current_user.tenant_id)
+    )
+    if role:
+        query = query.filter(User.role == role)
+    users, next_after = keyset_page(query, User.username, after, limit)
+    return {"users": [dict(user._mapping) for user in users], "next_after": next_after}
+
+@app.put("/admin/users/{username}/role")
+async def set_user_role(
+    username: str,
+    update: RoleUpdate,
+    current_user: User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    if update.role not in ROLES:
+        raise HTTPException(status_code=400, detail=f"Role must be one of: {', '.join(ROLES)}")
+    if username == current_user.username:
+        # Keeps the last admin from locking everyone out
+        raise HTTPException(status_code=400, detail="Admins cannot change their own role")
+
+    updated = (
+        db.query(User)
+        .filter(User.username == username, User.tenant_id == current_user.tenant_id)
+        .update({User.role: update.role}, synchronize_session=False)
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="User not found")
+    db.commit()
+    return {"message": f"{username} is now {update.role}", "role": update.role}
+
+@app.get("/admin/face-enrolment")
+async def list_face_enrolment(
+    registered: Optional[bool] = None,
+    role: Optional[str] = None,
+    after: Optional[str] = Query(None, description="Username to continue after, from next_after"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    query = db.query(User.id, User.username, User.face_registered).filter(User.tenant_id == current_user.tenant_id)
+    if registered is not None:
+        query = query.filter(User.face_registered == registered)
+    if role:
+        query = query.filter(User.role == role)
+    users, next_after = keyset_page(query, User.username, after, limit)
+
+    # Face data of the whole page in one query
+    face_data = {}
+    if users:
+        for row in (
+            db.query(FaceData.user_id, FaceData.encoding_version, FaceData.updated_at)
+            .filter(FaceData.user_id.in_([user.id for user in users]))
+        ):
+            face_data.setdefault(row.user_id, []).append(
+                {"encoding_version": row.encoding_version, "updated_at": row.updated_at}
+            )
+
+    return {
+        "users": [
+            {
+                "user_id": user.id,
+                "username": user.username,
+                "face_registered": user.face_registered,
+                "encodings": face_data.get(user.id, []),
+            }
+            for user in users
+        ],
+        "next_after": next_after,
+    }
+
+@app.get("/admin/exam-sessions")
+async def list_exam_sessions(
+    exam_id: Optional[str] = None,
+    active: Optional[bool] = None,
+    verified: Optional[bool] = None,
+    after: Optional[str] = Query(None, description="Session id to continue after, from next_after"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    query = db.query(
+        ExamSession.id, ExamSession.user_id, ExamSession.exam_id, ExamSession.start_time,
+        ExamSession.end_time, ExamSession.is_active, ExamSession.verified,
+    ).filter(ExamSession.tenant_id == current_user.tenant_id)
+    if exam_id:
+        query = query.filter(ExamSession.exam_id == exam_id)
+    if active is not None:
+        query = query.filter(ExamSession.is_active == active)
+    if verified is not None:
+        query = query.filter(ExamSession.verified == verified)
+    sessions, next_after = keyset_page(query, ExamSession.id, after, limit)
+    return {"sessions": [dict(session._mapping) for session in sessions], "next_after": next_after}
+
+@app.get("/exams/{exam_id}/report")
+async def get_exam_report(
+    exam_id: str,
+    live: bool = Query(False, description="Aggregate the sessions directly instead of reading the summary"),
+    current_user: User = Depends(get_current_staff),
+    db: Session = Depends(get_db)
+):
+    tenant_id = current_user.tenant_id
+    if live:
+        row = exam_session_aggregates(db).filter(ExamSession.exam_id == exam_id, ExamSession.tenant_id == tenant_id).first()
+    else:
+        row = db.query(ExamSummary).filter(ExamSummary.exam_id == exam_id, ExamSummary.tenant_id == tenant_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="No sessions recorded for this exam")
+
+    report = exam_report(row)
+    # Candidates still waiting for verification, counted from the exam state index
+    report["active_unverified"] = (
+        db.query(func.count(ExamSession.id))
+        .filter(
+            ExamSession.exam_id == exam_id, ExamSession.tenant_id == tenant_id,
+            ExamSession.is_active == True, ExamSession.verified == False,
+        )
+        .scalar()
+    )
+    return report
+
+@app.get("/admin/exam-reports")
+async def list_exam_reports(
+    after: Optional[str] = Query(None, description="Exam id to continue after, from next_after"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    summaries, next_after = keyset_page(
+        db.query(ExamSummary).filter(ExamSummary.tenant_id == current_user.tenant_id), ExamSummary.exam_id, after, limit
+    )
+    return {"exams": [exam_report(summary) for summary in summaries], "next_after": next_after}
+
+@app.post("/admin/sweep")
+def run_sweep(current_user: User = Depends(get_current_admin)):
+    # Run the cleanup now instead of waiting for the next interval
+    return sweeper.run_once()
+
 @app.get("/users/me", response_model=UserResponse)
 async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format
+    families = (
+        face_scheduler.metrics() + degradation.metrics() + face_results.metrics() + frame_gate.metrics()
+        + exam_sessions.metrics() + tenant_galleries.metrics() + writer_metrics({"faces": face_images, "frames": frame_images}) + sweeper.metrics()
+    )
+    if face_workers is not None:
+        families += face_workers.metrics()
+    if gallery_shards is not None:
+        families += gallery_shards.metrics()
+    return format_metrics(families)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WORKERS > 1:
+        # Workers re-import the app, so it has to be passed by name
+        uvicorn.run("app:app", host=HOST, port=PORT, workers=WORKERS)
+    else:
+        uvicorn.run(app, host=HOST, port=PORT)
@@ -0,0 +1,83 @@
+
+import argparse
+import shutil
+import tempfile
+import time
+import uuid
+import numpy as np
+
+from settings import MATCH_THRESHOLD
+from gallery import FaceGallery, ENCODING_SIZE
+from quantize import SEARCH_MODES
+
+def synthetic_gallery(size, seed=0):
+    """Random encodings spread like dlib face encodings of different people
+    (typical distance between two people around 0.9)"""
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0, 0.055, (size, ENCODING_SIZE))
+    user_ids = [str(uuid.uuid4()) for _ in range(size)]
+    return user_ids, encodings
+
+def synthetic_probes(encodings, count, seed=1):
+    """Probes close to enrolled faces (distance around 0.3) plus strangers"""
+    rng = np.random.default_rng(seed)
+    members = rng.integers(0, len(encodings), count)
+    probes = encodings[members] + rng.normal(0, 0.025, (count, ENCODING_SIZE))
+    strangers = rng.normal(0, 0.055, (count // 4, ENCODING_SIZE))
+    return np.vstack([probes, strangers])
+
+def build_snapshot(directory, user_ids, encodings):
+    rows = [(seq + 1, user_id, encoding.tobytes()) for seq, (user_id, encoding) in enumerate(zip(user_ids, encodings))]
+    gallery = FaceGallery(directory, lambda seq: [row for row in rows if row[0] > seq], max_delta=0)
+    gallery.open()
+
+def run_mode(directory, mode, probes, rerank_k):
+    gallery = FaceGallery(directory, lambda seq: [], search_mode=mode, rerank_k=rerank_k)
+    gallery.open()
+    # Warm up the page cache and the compact matrix
+    gallery.match(probes[0])
+
+    start = time.perf_counter()
+    results = [gallery.match(probe) for probe in probes]
+    elapsed = time.perf_counter() - start
+    return results, elapsed / len(probes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact and quantized face gallery search")
+    parser.add_argument("--size", type=int, default=100000, help="number of enrolled faces")
+    parser.add_argument("--probes", type=int, default=200, help="number of searches per mode")
+    parser.add_argument("--rerank-k", type=int, default=32, help="candidates re-ranked with exact distances")
+    args = parser.parse_args()
+
+    print("TrustFace 2.0 Gallery Search Benchmark")
+    print("=" * 40)
+    print(f"Gallery size: {args.size}, probes: {args.probes}, rerank k: {args.rerank_k}")
+
+    directory = tempfile.mkdtemp(prefix="trustface-bench-")
+    try:
+        user_ids, encodings = synthetic_gallery(args.size)
+        build_snapshot(directory, user_ids, encodings)
+        probes = synthetic_probes(encodings, args.probes)
+
+        exact, exact_time = run_mode(directory, "exact", probes, args.rerank_k)
+        exact_ids = [user_id for user_id, _ in exact]
+        exact_accepts = [distance < MATCH_THRESHOLD for _, distance in exact]
+
+        print("-" * 72)
+        print(f"{'Mode':<10} {'ms/search':>10} {'Speedup':>8} {'Recall@1':>9} {'Same decision':>14} {'Max dist err':>13}")
+        print("-" * 72)
+        for mode in SEARCH_MODES:
+            if mode == "exact":
+                results, elapsed = exact, exact_time
+            else:
+                results, elapsed = run_mode(directory, mode, probes, args.rerank_k)
+            recall = np.mean([user_id == expected for (user_id, _), expected in zip(results, exact_ids)])
+            decisions = np.mean([(distance < MATCH_THRESHOLD) == accepted for (_, distance), accepted in zip(results, exact_accepts)])
+            error = max(abs(distance - expected) for (_, distance), (_, expected) in zip(results, exact))
+            print(f"{mode:<10} {elapsed * 1000:>10.2f} {exact_time / elapsed:>7.1f}x {recall:>9.3f} {decisions:>14.3f} {error:>13.2e}")
+        print("-" * 72)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
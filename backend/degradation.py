@@ -0,0 +1,75 @@
+
+import time
+
+class DegradationController:
+    """Trades face pipeline fidelity for throughput while the face queue is
+    backed up.
+
+    ``levels`` is a list of (name, settings) steps, cheapest quality loss
+    first; level N applies the settings of the first N steps on top of
+    ``base``. The controller is fed the queue depth and queueing delay of
+    every face job (see FaceWorkScheduler). It steps one level down when
+    either passes its high mark, and one level back up once both are at or
+    below their low marks. Steps are at least ``step_interval`` seconds
+    apart, so each one gets time to show its effect.
+    """
+
+    def __init__(self, base, levels, queue_high, queue_low, wait_high, wait_low, step_interval=5.0):
+        self.base = base
+        self.levels = levels
+        self.queue_high = queue_high
+        self.queue_low = queue_low
+        self.wait_high = wait_high
+        self.wait_low = wait_low
+        self.step_interval = step_interval
+        self.level = 0
+        self.wait = 0.0  # seconds, exponentially weighted average
+        self.fidelity = dict(base)
+        self.steps = {"down": 0, "up": 0}
+        self.seconds_at_level = [0.0] * (len(levels) + 1)
+        self._changed_at = time.monotonic()
+
+    def observe(self, queue_depth, wait):
+        """Record one face job's queueing delay and step if needed"""
+        self.wait = 0.8 * self.wait + 0.2 * wait
+        now = time.monotonic()
+        if now - self._changed_at < self.step_interval:
+            return
+
+        if self.level < len(self.levels) and (queue_depth >= self.queue_high or self.wait >= self.wait_high):
+            self._step(self.level + 1, "down", queue_depth, now)
+        elif self.level > 0 and queue_depth <= self.queue_low and self.wait <= self.wait_low:
+            self._step(self.level - 1, "up", queue_depth, now)
+
+    def _step(self, level, direction, queue_depth, now):
+        self.seconds_at_level[self.level] += now - self._changed_at
+        self._changed_at = now
+        self.level = level
+        self.steps[direction] += 1
+
+        fidelity = dict(self.base)
+        for _, settings in self.levels[:level]:
+            fidelity.update(settings)
+        # Swapped in whole, so jobs in other threads see one level or the other
+        self.fidelity = fidelity
+        print(
+            f"Face pipeline stepped {direction} to level {level} ({self.level_name}): "
+            f"queue depth {queue_depth}, average wait {self.wait:.2f}s"
+        )
+
+    @property
+    def level_name(self):
+        return self.levels[self.level - 1][0] if self.level else "full"
+
+    def metrics(self):
+        seconds = list(self.seconds_at_level)
+        seconds[self.level] += time.monotonic() - self._changed_at
+        names = ["full"] + [name for name, _ in self.levels]
+        return [
+            ("trustface_face_fidelity_level", "gauge", "Face pipeline degradation level, 0 is full fidelity", [({}, self.level)]),
+            ("trustface_face_fidelity_steps_total", "counter", "Face pipeline degradation level changes",
+             [({"direction": direction}, count) for direction, count in self.steps.items()]),
+            ("trustface_face_fidelity_seconds_total", "counter", "Time spent at each degradation level",
+             [({"level": str(level), "name": name}, value) for level, (name, value) in enumerate(zip(names, seconds))]),
+            ("trustface_face_queue_wait_average_seconds", "gauge", "Recent average wait for a face job slot", [({}, self.wait)]),
+        ]
@@ -0,0 +1,181 @@
+
+import os
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from settings import MATCH_THRESHOLD, DEGRADE_DETECT_SIDE
+from face_pipeline import FaceError, FULL_FIDELITY, decode_image, locate_faces, encode_faces
+
+# Pipeline configurations to compare: (encoding version, fidelity overrides)
+CONFIGS = {
+    "v1": ("v1", {}),
+    "v1-small": ("v1-small", {}),
+    "v1-small-detection": ("v1", {"detect_side": DEGRADE_DETECT_SIDE}),
+    "v1-no-upsample": ("v1", {"upsample": 0}),
+    "v1-small-detection-no-upsample": ("v1", {"detect_side": DEGRADE_DETECT_SIDE, "upsample": 0}),
+}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Distance histogram resolution for the ROC; dlib distances stay below 1.6
+HISTOGRAM_BINS = np.linspace(0.0, 1.6, 1601)
+
+def load_dataset(root, max_per_person=0):
+    """Return (paths, labels) for a directory with one subdirectory of
+    photos per person, the layout of LFW and most face datasets"""
+    paths, labels = [], []
+    for person in sorted(os.listdir(root)):
+        directory = os.path.join(root, person)
+        if not os.path.isdir(directory):
+            continue
+        photos = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+        if max_per_person:
+            photos = photos[:max_per_person]
+        for name in photos:
+            paths.append(os.path.join(directory, name))
+            labels.append(person)
+    return paths, np.array(labels)
+
+def encode_photo(path, version, fidelity):
+    """Encode the largest face of a photo the way the app would.
+
+    Returns (encoding or None, seconds spent in the pipeline).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    started = time.perf_counter()
+    try:
+        image = decode_image(data)
+        locations = locate_faces(image, fidelity["upsample"], fidelity["detect_side"])
+    except FaceError:
+        return None, time.perf_counter() - started
+    if not locations:
+        return None, time.perf_counter() - started
+
+    largest = max(locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+    encoding = encode_faces(image, [largest], version, fidelity["max_jitters"])[0]
+    return encoding, time.perf_counter() - started
+
+def pair_histograms(encodings, labels, block_rows=1024):
+    """Histogram the distances of every genuine (same person) and impostor
+    pair, one block of rows against all later rows at a time so memory
+    stays bounded. Returns (genuine counts, impostor counts)."""
+    norms = np.einsum("ij,ij->i", encodings, encodings)
+    genuine = np.zeros(len(HISTOGRAM_BINS) - 1, np.int64)
+    impostor = np.zeros(len(HISTOGRAM_BINS) - 1, np.int64)
+    for start in range(0, len(encodings), block_rows):
+        block = encodings[start:start + block_rows]
+        squared = norms[start:start + block_rows, None] + norms[None, :] - 2 * block @ encodings.T
+        distances = np.sqrt(np.maximum(squared, 0))
+
+        # Each pair once: only columns after the row
+        later = np.arange(len(encodings))[None, :] > np.arange(start, start + len(block))[:, None]
+        same = labels[start:start + block_rows, None] == labels[None, :]
+        genuine += np.histogram(distances[later & same], HISTOGRAM_BINS)[0]
+        impostor += np.histogram(distances[later & ~same], HISTOGRAM_BINS)[0]
+    return genuine, impostor
+
+def roc(genuine, impostor):
+    """FAR and FRR at every histogram threshold (a pair matches when its
+    distance is below the threshold). Returns (thresholds, far, frr)."""
+    thresholds = HISTOGRAM_BINS[1:]
+    far = np.cumsum(impostor) / max(impostor.sum(), 1)
+    frr = 1 - np.cumsum(genuine) / max(genuine.sum(), 1)
+    return thresholds, far, frr
+
+def summarize(thresholds, far, frr, target_far):
+    """Error rates at the app's threshold, the equal error rate, and the
+    loosest threshold that keeps FAR at or under ``target_far``"""
+    at_current = min(np.searchsorted(thresholds, MATCH_THRESHOLD), len(thresholds) - 1)
+    eer_index = int(np.argmin(np.abs(far - frr)))
+    within_target = np.nonzero(far <= target_far)[0]
+    target_index = int(within_target[-1]) if len(within_target) else 0
+    return {
+        "far": far[at_current],
+        "frr": frr[at_current],
+        "eer": (far[eer_index] + frr[eer_index]) / 2,
+        "eer_threshold": thresholds[eer_index],
+        "target_threshold": thresholds[target_index],
+        "target_frr": frr[target_index],
+    }
+
+def evaluate(name, paths, labels, pool):
+    """Encode every photo with one configuration and score all pairs"""
+    version, overrides = CONFIGS[name]
+    fidelity = {**FULL_FIDELITY, **overrides}
+
+    started = time.perf_counter()
+    results = list(pool.map(encode_photo, paths, [version] * len(paths), [fidelity] * len(paths), chunksize=4))
+    wall = time.perf_counter() - started
+
+    latencies = np.array([seconds for _, seconds in results])
+    found = np.array([encoding is not None for encoding, _ in results])
+    encodings = np.array([encoding for encoding, _ in results if encoding is not None]).reshape(-1, 128)
+    genuine, impostor = pair_histograms(encodings, labels[found])
+    return {
+        "latencies": latencies,
+        "throughput": len(paths) / wall,
+        "no_face": 1 - found.mean(),
+        "genuine": genuine,
+        "impostor": impostor,
+    }
+
+def write_roc(path, curves):
+    """Write threshold, FAR and FRR of every configuration to a CSV file"""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["config", "threshold", "far", "frr"])
+        for name, (thresholds, far, frr) in curves.items():
+            for row in zip(thresholds, far, frr):
+                writer.writerow([name, f"{row[0]:.3f}", f"{row[1]:.6f}", f"{row[2]:.6f}"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure face matching accuracy and speed of pipeline configurations on a labelled photo set")
+    parser.add_argument("dataset", help="directory with one subdirectory of photos per person")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS), help="configurations to compare (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="encoding processes (default: all cores)")
+    parser.add_argument("--max-per-person", type=int, default=0, help="photos used per person (default: all)")
+    parser.add_argument("--target-far", type=float, default=0.001, help="false accept rate to find a threshold for")
+    parser.add_argument("--roc", help="write the ROC curves of every configuration to this CSV file")
+    args = parser.parse_args()
+
+    paths, labels = load_dataset(args.dataset, args.max_per_person)
+    print("TrustFace 2.0 Pipeline Evaluation")
+    print("=" * 40)
+    print(f"{len(paths)} photos of {len(set(labels))} people, {args.workers} workers, current threshold {MATCH_THRESHOLD}")
+
+    curves = {}
+    rows = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for name in args.configs:
+            result = evaluate(name, paths, labels, pool)
+            curves[name] = roc(result["genuine"], result["impostor"])
+            rows.append((name, result, summarize(*curves[name], args.target_far)))
+            print(f"{name}: {result['genuine'].sum()} genuine and {result['impostor'].sum()} impostor pairs")
+
+    far_label = f"FRR@FAR{args.target_far:g}"
+    print("-" * 118)
+    print(
+        f"{'Config':<32} {'ms mean':>8} {'ms p95':>8} {'img/s':>7} {'No face':>8} "
+        f"{'FAR':>8} {'FRR':>8} {'EER':>7} {'@thr':>6} {'Thr for FAR':>11} {far_label:>12}"
+    )
+    print("-" * 118)
+    for name, result, summary in rows:
+        latencies = result["latencies"] * 1000
+        print(
+            f"{name:<32} {latencies.mean():>8.1f} {np.percentile(latencies, 95):>8.1f} {result['throughput']:>7.1f} "
+            f"{result['no_face']:>8.2%} {summary['far']:>8.4f} {summary['frr']:>8.4f} {summary['eer']:>7.4f} "
+            f"{summary['eer_threshold']:>6.3f} {summary['target_threshold']:>11.3f} {summary['target_frr']:>12.4f}"
+        )
+    print("-" * 118)
+    print(f"FAR and FRR are at the current threshold ({MATCH_THRESHOLD}); set TRUSTFACE_MATCH_THRESHOLD to change it.")
+
+    if args.roc:
+        write_roc(args.roc, curves)
+        print(f"ROC curves written to {args.roc}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+
+import io
+import cv2
+import numpy as np
+import face_recognition
+from PIL import Image
+from settings import IMAGE_TARGET_SIDE, IMAGE_MAX_PIXELS, ENCODING_VERSION
+from tracing import traced
+
+# Encoder settings behind each encoding version. Encodings made with
+# different settings are not comparable, so changing any of them needs a new
+# version (and a re-encoding run, see reencode.py); never edit one in place.
+ENCODING_PROFILES = {
+    # 68-point landmarks, no jittering - the face_recognition defaults
+    "v1": {"landmark_model": "large", "num_jitters": 1},
+    # 5-point landmarks, faster alignment
+    "v1-small": {"landmark_model": "small", "num_jitters": 1},
+}
+
+# Version of encodings stored before versions were tracked
+LEGACY_ENCODING_VERSION = "v1"
+
+# Pipeline settings that can be relaxed under load without changing the
+# encoding space (see DegradationController)
+FULL_FIDELITY = {
+    "detect_side": None,  # longest side the detector sees, None = whole image
+    "upsample": 1,  # detector upsampling passes, finds faces down to ~40px
+    "max_jitters": None,  # cap on the profile's num_jitters
+    "write_crop": True,  # keep a reference crop of enrolment photos
+}
+
+if ENCODING_VERSION not in ENCODING_PROFILES:
+    raise ValueError(f"Unknown encoding version {ENCODING_VERSION!r}, expected one of {sorted(ENCODING_PROFILES)}")
+
+# JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding (in the DCT
+# domain), so the full-resolution bitmap is never allocated
+REDUCED_JPEG_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+class FaceError(Exception):
+    """Raised when a frame cannot be used for recognition.
+
+    The message is meant to be shown to the user.
+    """
+
+def read_image_size(data):
+    """Return (width, height, format) from the image header without decoding it"""
+    try:
+        with Image.open(io.BytesIO(data)) as header:
+            return header.width, header.height, header.format
+    except Exception:
+        raise FaceError("Could not read the image")
+
+def check_image_size(data):
+    """Return (width, height, format) of an image, rejecting images over the
+    pixel budget from their header alone"""
+    width, height, image_format = read_image_size(data)
+    if width * height > IMAGE_MAX_PIXELS:
+        raise FaceError(f"Image is too large ({width}x{height}). Please upload a smaller image")
+    return width, height, image_format
+
+@traced("face.decode")
+def decode_image(data, target_side=None):
+    """Decode encoded image bytes (JPEG, PNG, ...) into an RGB array whose
+    longest side is at most ``target_side`` pixels.
+
+    Images over the pixel budget are rejected from their header alone, and
+    large JPEGs are decoded directly at a reduced scale.
+    """
+    target_side = target_side or IMAGE_TARGET_SIDE
+    width, height, image_format = check_image_size(data)
+
+    flags = cv2.IMREAD_COLOR
+    if image_format == "JPEG":
+        for factor, reduced_flag in REDUCED_JPEG_FLAGS:
+            if max(width, height) // factor >= target_side:
+                flags = reduced_flag
+                break
+
+    nparr = np.frombuffer(data, np.uint8)
+    img = cv2.imdecode(nparr, flags)
+    if img is None:
+        raise FaceError("Could not read the image")
+
+    # Finish the reduction the decoder could not do by itself
+    longest = max(img.shape[:2])
+    if longest > target_side:
+        scale = target_side / longest
+        img = cv2.resize(img, (round(img.shape[1] * scale), round(img.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+
+    # Convert to RGB for face_recognition
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+@traced("face.detect")
+def locate_faces(image, upsample=1, max_side=None):
+    """Return the (top, right, bottom, left) box of every face in an RGB image.
+
+    With ``max_side`` the detector runs on a copy scaled down to at most
+    that many pixels, and the boxes are scaled back to the full image.
+    """
+    height, width = image.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return face_recognition.face_locations(image, number_of_times_to_upsample=upsample)
+
+    scale = max_side / max(height, width)
+    small = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    return [
+        (max(0, round(top / scale)), min(width, round(right / scale)), min(height, round(bottom / scale)), max(0, round(left / scale)))
+        for top, right, bottom, left in face_recognition.face_locations(small, number_of_times_to_upsample=upsample)
+    ]
+
+def locate_single_face(image, multiple_faces_message="Multiple faces detected", upsample=1, max_side=None):
+    """Return the location of the only face in an RGB image"""
+    face_locations = locate_faces(image, upsample, max_side)
+
+    if not face_locations:
+        raise FaceError("No face detected in the image")
+
+    if len(face_locations) > 1:
+        raise FaceError(multiple_faces_message)
+
+    return face_locations[0]
+
+@traced("face.encode")
+def encode_faces(image, face_locations, version=None, max_jitters=None):
+    """Encode the faces at the given locations with the profile of an
+    encoding version (the current one by default), one row per face"""
+    if not face_locations:
+        return np.empty((0, 128))
+
+    profile = ENCODING_PROFILES[version or ENCODING_VERSION]
+    num_jitters = min(profile["num_jitters"], max_jitters) if max_jitters else profile["num_jitters"]
+    # One call encodes every face, sharing the image preprocessing
+    return np.array(face_recognition.face_encodings(
+        image, face_locations, num_jitters=num_jitters, model=profile["landmark_model"]
+    ))
+
+class FrameFaces:
+    """Faces found in one frame by ``analyze_frame``"""
+
+    def __init__(self, locations, encodings, crops=None):
+        self.locations = locations
+        # version -> encodings, one row per location
+        self.encodings = encodings
+        self.crops = crops
+
+def analyze_frame(data, versions=None, target_side=None, single_face_message=None, crops=False, fidelity=None):
+    """Decode an image, find its faces and encode them with the profile of
+    each encoding version (the current one by default).
+
+    With ``single_face_message`` the frame must contain exactly one face.
+    ``fidelity`` overrides FULL_FIDELITY settings. This is the CPU-heavy
+    part of every face request, self-contained so that it can run in a
+    FacePool worker process.
+    """
+    fidelity = {**FULL_FIDELITY, **(fidelity or {})}
+    image = decode_image(data, target_side)
+    if single_face_message:
+        locations = [locate_single_face(image, single_face_message, fidelity["upsample"], fidelity["detect_side"])]
+    else:
+        locations = locate_faces(image, fidelity["upsample"], fidelity["detect_side"])
+
+    encodings = {
+        version: encode_faces(image, locations, version, fidelity["max_jitters"])
+        for version in versions or [ENCODING_VERSION]
+    }
+    face_crops = [image[top:bottom, left:right].copy() for top, right, bottom, left in locations] if crops else None
+    return FrameFaces(locations, encodings, face_crops)
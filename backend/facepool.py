@@ -0,0 +1,205 @@
+
+import gc
+import os
+import queue
+import signal
+import threading
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.connection import Listener, Client
+
+def memory_usage(pid):
+    """Return the memory of a process in bytes: ``rss``, plus ``pss`` (shared
+    pages split between the processes sharing them) and ``private`` where
+    the platform reports them"""
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line and not line.startswith(" "))
+        kilobytes = {name: int(value.split()[0]) for name, value in fields.items() if value.strip().endswith("kB")}
+        usage["rss"] = kilobytes.get("Rss", 0) * 1024
+        usage["pss"] = kilobytes.get("Pss", 0) * 1024
+        usage["private"] = (kilobytes.get("Private_Clean", 0) + kilobytes.get("Private_Dirty", 0)) * 1024
+    except (OSError, ValueError):
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                usage["rss"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            pass
+    return usage
+
+class WorkerCrashed(Exception):
+    """Raised for a job whose worker process died before returning a result"""
+
+def _worker_main(conn, max_tasks, max_rss):
+    tasks = 0
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        fn, args = message
+        try:
+            outcome = (True, fn(*args))
+        except Exception as e:
+            outcome = (False, e)
+        tasks += 1
+
+        rss = memory_usage(os.getpid()).get("rss", 0)
+        retire = tasks >= max_tasks or bool(max_rss and rss > max_rss)
+        try:
+            conn.send((outcome, retire))
+        except Exception as e:
+            # The result or exception could not be pickled
+            conn.send(((False, RuntimeError(f"Face worker could not return its result: {e}")), retire))
+        if retire:
+            break
+    os._exit(0)
+
+def _zygote_main(conn, address, authkey, max_tasks, max_rss):
+    # Ctrl+C reaches the whole process group; the parent shuts the workers
+    # down by closing their connections instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.set_wakeup_fd(-1)
+    # Exited workers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    # Keep the garbage collector from writing to (and so copying) the
+    # shared pages of objects inherited from the parent
+    gc.freeze()
+
+    while True:
+        try:
+            conn.recv()
+        except EOFError:
+            break
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            _worker_main(Client(address, authkey=authkey), max_tasks, max_rss)
+        conn.send(pid)
+
+class FacePool:
+    """Process pool for the CPU-bound face pipeline, sharing one copy of the
+    face models between all workers.
+
+    ``start`` forks a zygote process while the app is still single
+    threaded, after the dlib detector, landmark predictor and ResNet weights
+    have been loaded. Workers are forked from the zygote, so the model pages
+    are shared copy-on-write instead of loaded once per worker. A worker
+    retires after ``max_tasks`` jobs or once its RSS passes ``max_rss``
+    bytes; it only does so after returning its current result, and a fresh
+    worker is forked in its place, so no job is dropped.
+
+    Jobs must be module-level functions whose arguments and results can be
+    pickled. POSIX only.
+    """
+
+    def __init__(self, workers, max_tasks=1000, max_rss=0):
+        self.workers = workers
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self.recycled = {"tasks": 0, "memory": 0, "crash": 0}
+        # slot -> (pid, jobs done)
+        self.slots = {}
+        self._jobs = queue.Queue()
+        self._spawn_lock = threading.Lock()
+        self._threads = []
+        self._zygote = None
+
+    @staticmethod
+    def supported():
+        return hasattr(os, "fork")
+
+    def start(self):
+        authkey = os.urandom(32)
+        self._listener = Listener(family="AF_UNIX", authkey=authkey)
+        self._zygote_conn, zygote_end = get_context("fork").Pipe()
+        self._zygote = get_context("fork").Process(
+            target=_zygote_main, name="face-zygote", daemon=True,
+            args=(zygote_end, self._listener.address, authkey, self.max_tasks, self.max_rss),
+        )
+        self._zygote.start()
+        zygote_end.close()
+
+        for slot in range(self.workers):
+            thread = threading.Thread(target=self._run_slot, args=(slot,), name=f"face-worker-{slot}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _spawn(self):
+        with self._spawn_lock:
+            self._zygote_conn.send("spawn")
+            pid = self._zygote_conn.recv()
+            return pid, self._listener.accept()
+
+    def _run_slot(self, slot):
+        pid, conn = self._spawn()
+        done = 0
+        self.slots[slot] = (pid, done)
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                conn.close()
+                return
+            future, fn, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                conn.send((fn, args))
+                (ok, value), retire = conn.recv()
+            except (EOFError, OSError) as e:
+                future.set_exception(WorkerCrashed(f"Face worker {pid} exited: {e}"))
+                self.recycled["crash"] += 1
+                retire = True
+            else:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+                done += 1
+                if retire:
+                    self.recycled["tasks" if done >= self.max_tasks else "memory"] += 1
+
+            if retire:
+                conn.close()
+                pid, conn = self._spawn()
+                done = 0
+            self.slots[slot] = (pid, done)
+
+    def submit(self, fn, *args):
+        future = Future()
+        self._jobs.put((future, fn, args))
+        return future
+
+    def run(self, fn, *args):
+        """Run ``fn(*args)`` in a worker and wait for the result"""
+        return self.submit(fn, *args).result()
+
+    def stop(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._zygote:
+            self._zygote_conn.close()
+            self._zygote.join(5)
+            self._listener.close()
+
+    def metrics(self):
+        workers = [(slot, pid, done, memory_usage(pid)) for slot, (pid, done) in sorted(self.slots.items())]
+        families = [
+            ("trustface_face_worker_jobs", "gauge", "Jobs done by the current process of each worker slot",
+             [({"slot": str(slot)}, done) for slot, _, done, _ in workers]),
+            ("trustface_face_worker_recycled_total", "counter", "Face workers replaced, by reason",
+             [({"reason": reason}, count) for reason, count in self.recycled.items()]),
+        ]
+        for kind, help_text in (
+            ("rss", "Resident memory of each face worker, shared pages included"),
+            ("pss", "Proportional memory of each face worker, shared pages split between sharers"),
+            ("private", "Memory used by each face worker alone"),
+        ):
+            samples = [({"slot": str(slot)}, usage[kind]) for slot, _, _, usage in workers if kind in usage]
+            if samples:
+                families.append((f"trustface_face_worker_{kind}_bytes", "gauge", help_text, samples))
+        return families
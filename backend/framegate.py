@@ -0,0 +1,83 @@
+
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+class FrameGate:
+    """Skips the face pipeline for frames that barely differ from the last
+    verified frame of the same exam session.
+
+    Each session keeps a small grayscale thumbnail of its last verified
+    frame. A new frame whose thumbnail is within ``max_diff`` grey levels
+    (mean absolute difference) reuses the stored result, as long as that
+    result is less than ``max_age`` seconds old and no enrolled face has
+    changed since. Older results force a full verification, so a photo held
+    still in front of the camera is re-checked at least that often.
+    ``max_age`` of 0 disables the gate.
+    """
+
+    def __init__(self, max_diff=4.0, max_age=30.0, max_entries=10000, thumbnail_side=32):
+        self.max_diff = max_diff
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.thumbnail_side = thumbnail_side
+        # key -> (verified_at, gallery seq, thumbnail, result)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = {"new": 0, "expired": 0, "gallery_changed": 0, "frame_changed": 0}
+
+    @property
+    def enabled(self):
+        return self.max_age > 0
+
+    def thumbnail(self, data):
+        """Return the frame as a tiny grayscale image, or None if it cannot be decoded.
+
+        JPEGs are decoded at 1/8 scale, which costs a fraction of a full decode.
+        """
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if image is None:
+            return None
+        side = self.thumbnail_side
+        return cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def check(self, key, thumbnail, seq):
+        """Return the stored result if the frame can reuse it, else None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses["new"] += 1
+            return None
+
+        verified_at, entry_seq, entry_thumbnail, result = entry
+        if time.monotonic() - verified_at > self.max_age:
+            reason = "expired"
+        elif entry_seq != seq:
+            reason = "gallery_changed"
+        elif float(np.mean(np.abs(entry_thumbnail - thumbnail))) > self.max_diff:
+            reason = "frame_changed"
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+        self.misses[reason] += 1
+        return None
+
+    def store(self, key, thumbnail, seq, result):
+        """Remember a verified frame and its result"""
+        self._entries[key] = (time.monotonic(), seq, thumbnail, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, key):
+        self._entries.pop(key, None)
+
+    def metrics(self):
+        return [
+            ("trustface_frame_gate_hits_total", "counter", "Verification frames answered from the previous frame's result", [({}, self.hits)]),
+            ("trustface_frame_gate_misses_total", "counter", "Verification frames that ran the face pipeline",
+             [({"reason": reason}, count) for reason, count in self.misses.items()]),
+            ("trustface_frame_gate_sessions", "gauge", "Sessions with a stored verified frame", [({}, len(self._entries))]),
+        ]
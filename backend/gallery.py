@@ -0,0 +1,796 @@
+
+import os
+import re
+import threading
+import time
+import numpy as np
+from quantize import SEARCH_MODES, QuantizedMatrix
+from tracing import traced
+
+ENCODING_SIZE = 128
+
+def nearest_rows(encodings, probes, masked=None, chunk_rows=8192):
+    """Find the row of ``encodings`` closest to each row of ``probes``.
+
+    Distances come from one matrix-matrix product per block of rows, using
+    ``|x - q|^2 = |x|^2 - 2 x.q + |q|^2``, so memory stays bounded by the
+    block size. ``masked`` is a sorted array of rows to skip. Returns the
+    best row (-1 if none) and its distance for every probe.
+    """
+    probes = np.atleast_2d(probes)
+    best_rows = np.full(len(probes), -1)
+    best_squared = np.full(len(probes), np.inf)
+    probe_norms = np.einsum("ij,ij->i", probes, probes)
+    columns = np.arange(len(probes))
+
+    for start in range(0, len(encodings), chunk_rows):
+        block = np.asarray(encodings[start:start + chunk_rows], dtype=np.float64)
+        squared = np.einsum("ij,ij->i", block, block)[:, None] - 2 * (block @ probes.T) + probe_norms
+        if masked is not None and len(masked):
+            skip = masked[np.searchsorted(masked, start):np.searchsorted(masked, start + len(block))]
+            squared[skip - start] = np.inf
+        rows = np.argmin(squared, axis=0)
+        values = squared[rows, columns]
+        better = values < best_squared
+        best_squared[better] = values[better]
+        best_rows[better] = rows[better] + start
+
+    return best_rows, np.sqrt(np.maximum(best_squared, 0))
+
+def nearest_k_rows(encodings, probe, k, masked=None, chunk_rows=8192):
+    """Find the ``k`` rows of ``encodings`` closest to one ``probe``.
+
+    Each block keeps only its ``k`` smallest distances, selected with
+    ``argpartition`` instead of a full sort, and only the final candidates
+    are sorted. ``masked`` is a sorted array of rows to skip. Returns the
+    rows and their distances, nearest first.
+    """
+    probe = np.asarray(probe, dtype=np.float64).ravel()
+    probe_norm = probe @ probe
+    best_rows = np.empty(0, dtype=int)
+    best_squared = np.empty(0)
+
+    for start in range(0, len(encodings), chunk_rows):
+        block = np.asarray(encodings[start:start + chunk_rows], dtype=np.float64)
+        squared = np.einsum("ij,ij->i", block, block) - 2 * (block @ probe) + probe_norm
+        if masked is not None and len(masked):
+            skip = masked[np.searchsorted(masked, start):np.searchsorted(masked, start + len(block))]
+            squared[skip - start] = np.inf
+        rows = np.arange(start, start + len(block))
+        if len(squared) > k:
+            keep = np.argpartition(squared, k - 1)[:k]
+            rows, squared = rows[keep], squared[keep]
+        best_rows = np.concatenate([best_rows, rows])
+        best_squared = np.concatenate([best_squared, squared])
+        if len(best_squared) > k:
+            keep = np.argpartition(best_squared, k - 1)[:k]
+            best_rows, best_squared = best_rows[keep], best_squared[keep]
+
+    order = np.argsort(best_squared)
+    order = order[np.isfinite(best_squared[order])]
+    return best_rows[order], np.sqrt(np.maximum(best_squared[order], 0))
+
+def nearest_candidates(candidates, k):
+    """The ``k`` nearest of ``(user_id, distance)`` pairs from several matrices"""
+    return sorted(((str(user_id), float(distance)) for user_id, distance in candidates), key=lambda c: c[1])[:k]
+
+def merge_matches(user_ids, rows, distances, matches):
+    """Fold per-probe best rows of one matrix into the running ``matches`` list"""
+    for probe, (row, distance) in enumerate(zip(rows, distances)):
+        if row >= 0 and np.isfinite(distance) and (matches[probe][0] is None or distance < matches[probe][1]):
+            matches[probe] = (str(user_ids[row]), float(distance))
+    return matches
+
+class FileLock:
+    """Exclusive lock shared by every process that opens the same lock file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 seconds, keep waiting
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if os.name == "nt":
+                import msvcrt
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self._thread_lock.release()
+
+def open_counters(directory, file_lock):
+    """Map the [latest seq, snapshot high-water mark] counters of a gallery directory"""
+    path = os.path.join(directory, "counters")
+    with file_lock:
+        if not os.path.exists(path) or os.path.getsize(path) != 16:
+            np.zeros(2, dtype=np.uint64).tofile(path)
+    return np.memmap(path, dtype=np.uint64, mode="r+", shape=(2,))
+
+def bump_latest_seq(counters, file_lock, seq):
+    with file_lock:
+        if seq > counters[0]:
+            counters[0] = seq
+            counters.flush()
+
+def notify_gallery(directory, seq):
+    """Tell the workers serving a gallery directory that changes up to ``seq``
+    have been committed, from a process that does not hold the gallery itself"""
+    os.makedirs(directory, exist_ok=True)
+    file_lock = FileLock(os.path.join(directory, "gallery.lock"))
+    bump_latest_seq(open_counters(directory, file_lock), file_lock, seq)
+
+class GallerySnapshot:
+    """Encodings of every enrolled user as of one gallery sequence number.
+
+    Rows are sorted by user id so a user's row can be found with a binary
+    search on the memory-mapped id array, without building an index first.
+    """
+
+    def __init__(self, hwm, encodings, user_ids, quantized=None):
+        self.hwm = hwm
+        self.encodings = encodings
+        self.user_ids = user_ids
+        self.quantized = quantized
+
+    @classmethod
+    def empty(cls):
+        return cls(0, np.empty((0, ENCODING_SIZE)), np.empty(0, dtype="U1"))
+
+    @staticmethod
+    def paths(directory, hwm):
+        return (
+            os.path.join(directory, f"encodings-{hwm}.npy"),
+            os.path.join(directory, f"user_ids-{hwm}.npy"),
+        )
+
+    @classmethod
+    def open(cls, directory, hwm, search_mode="exact"):
+        """Map a snapshot written by ``write``; cost does not depend on its size"""
+        encodings_path, ids_path = cls.paths(directory, hwm)
+        user_ids = np.load(ids_path, mmap_mode="r")
+        if not len(user_ids):
+            return cls(hwm, np.empty((0, ENCODING_SIZE)), user_ids)
+
+        encodings = np.load(encodings_path, mmap_mode="r")
+        quantized = None
+        if search_mode != "exact":
+            quantized = QuantizedMatrix.load(os.path.join(directory, f"quantized-{hwm}"), search_mode)
+            if quantized is None:
+                # Snapshot written before the search mode was enabled
+                quantized = QuantizedMatrix.build(search_mode, encodings)
+        return cls(hwm, encodings, user_ids, quantized)
+
+    def write(self, directory, search_mode="exact"):
+        order = np.argsort(self.user_ids, kind="stable")
+        encodings_path, ids_path = self.paths(directory, self.hwm)
+        encodings = self.encodings[order]
+        self._save(encodings_path, encodings)
+        if search_mode != "exact":
+            QuantizedMatrix.build(search_mode, encodings).save(os.path.join(directory, f"quantized-{self.hwm}"))
+        # The id file is written last, its presence marks a complete snapshot
+        self._save(ids_path, self.user_ids[order])
+
+    @staticmethod
+    def _save(path, array):
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(path + ".tmp", path)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def rows(self, user_ids):
+        """Return the row of each given user id, or -1 if it is not in the snapshot"""
+        user_ids = np.asarray(user_ids, dtype=str)
+        if not len(self.user_ids) or not len(user_ids):
+            return np.full(len(user_ids), -1)
+        rows = np.searchsorted(self.user_ids, user_ids)
+        rows[rows == len(self.user_ids)] = 0
+        return np.where(self.user_ids[rows] == user_ids, rows, -1)
+
+class GalleryState:
+    """One consistent view of the gallery: a snapshot plus the changes
+    replayed on top of it"""
+
+    def __init__(self, snapshot, changes, applied):
+        self.snapshot = snapshot
+        # user_id -> (seq, encoding or None when the face data was deleted)
+        self.changes = changes
+        self.applied = applied
+
+        changed_ids = list(changes)
+        rows = snapshot.rows(changed_ids) if changed_ids else np.empty(0, dtype=int)
+        # Snapshot rows superseded by a later change
+        self.masked = np.sort(rows[rows >= 0])
+
+        self.delta_ids = [user_id for user_id in changed_ids if changes[user_id][1] is not None]
+        if self.delta_ids:
+            self.delta = np.vstack([changes[user_id][1] for user_id in self.delta_ids])
+        else:
+            self.delta = np.empty((0, ENCODING_SIZE))
+
+    def __len__(self):
+        return len(self.snapshot) - len(self.masked) + len(self.delta_ids)
+
+    def merged(self):
+        """Return ``(user_ids, encodings)`` of every enrolled face, with the
+        changes folded into the snapshot rows"""
+        snapshot = self.snapshot
+        keep = np.ones(len(snapshot), dtype=bool)
+        keep[self.masked] = False
+        encodings = np.concatenate([np.asarray(snapshot.encodings)[keep], self.delta])
+        user_ids = np.concatenate([
+            np.asarray(snapshot.user_ids)[keep].astype(str),
+            np.array(self.delta_ids, dtype=str),
+        ])
+        if not len(user_ids):
+            user_ids = np.empty(0, dtype="U1")
+        return user_ids, encodings
+
+    def match_many(self, probes, rerank_k=32):
+        """Return ``(user_id, distance)`` of the closest face for each row of ``probes``"""
+        matches = [(None, None)] * len(probes)
+
+        snapshot = self.snapshot
+        if len(snapshot):
+            if snapshot.quantized is not None:
+                for probe, (rows, distances) in enumerate(self._quantized_candidates(probes, rerank_k)):
+                    if len(rows):
+                        best = int(np.argmin(distances))
+                        matches[probe] = (str(snapshot.user_ids[rows[best]]), float(distances[best]))
+            else:
+                rows, distances = nearest_rows(snapshot.encodings, probes, self.masked)
+                merge_matches(snapshot.user_ids, rows, distances, matches)
+
+        if self.delta_ids:
+            rows, distances = nearest_rows(self.delta, probes)
+            merge_matches(self.delta_ids, rows, distances, matches)
+
+        return matches
+
+    def nearest(self, probe, k, rerank_k=32):
+        """Return up to ``k`` ``(user_id, distance)`` closest to one probe, nearest first"""
+        probe = np.asarray(probe, dtype=np.float64).reshape(1, ENCODING_SIZE)
+        candidates = []
+
+        snapshot = self.snapshot
+        if len(snapshot):
+            if snapshot.quantized is not None:
+                rows, distances = next(self._quantized_candidates(probe, rerank_k, k))
+            else:
+                rows, distances = nearest_k_rows(snapshot.encodings, probe, k, self.masked)
+            candidates += zip(snapshot.user_ids[rows], distances)
+
+        if self.delta_ids:
+            rows, distances = nearest_k_rows(self.delta, probe, k)
+            candidates += ((self.delta_ids[row], distance) for row, distance in zip(rows, distances))
+
+        return nearest_candidates(candidates, k)
+
+    def _quantized_candidates(self, probes, rerank_k, k=0):
+        """Scan the compact matrix for the ``rerank_k`` (or ``k``, if larger)
+        nearest rows of each probe and yield them with their exact float
+        distances"""
+        approximate = self.snapshot.quantized.squared_distances(probes)
+        approximate[self.masked] = np.inf
+        k = min(max(rerank_k, k), len(approximate))
+        candidates = np.argpartition(approximate, k - 1, axis=0)[:k]
+        for probe in range(len(probes)):
+            rows = candidates[:, probe]
+            # Sorted rows keep the reads from the mapped float matrix sequential
+            rows = np.sort(rows[np.isfinite(approximate[rows, probe])])
+            exact = np.linalg.norm(self.snapshot.encodings[rows] - probes[probe], axis=1)
+            yield rows, exact
+
+class FaceGallery:
+    """Face encodings of all enrolled users, shared by every worker process.
+
+    The bulk of the gallery is a snapshot on disk that each worker
+    memory-maps, so startup costs the same for any gallery size and the page
+    cache holds a single copy however many workers are running. Every
+    ``FaceData`` change carries a gallery sequence number; workers replay the
+    changes made after the snapshot's high-water mark from the database into
+    a small in-memory delta. Snapshots are rewritten periodically and on
+    shutdown so the delta stays small.
+
+    Two memory-mapped counters are shared by all workers: the latest
+    committed sequence number, bumped by ``notify`` after each change, and
+    the high-water mark of the newest snapshot. ``current_seq`` returns the
+    database's latest sequence number; counters ahead of it were left by a
+    database that has since been reset, so ``open`` drops them together
+    with the snapshot and rebuilds the gallery from the database.
+    """
+
+    def __init__(self, directory, changes_since, prune_changes=None, max_delta=1000,
+                 search_mode="exact", rerank_k=32, current_seq=None):
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown gallery search mode {search_mode!r}, expected one of {SEARCH_MODES}")
+        self.directory = directory
+        self.search_mode = search_mode
+        self.rerank_k = rerank_k
+        self._changes_since = changes_since
+        self._prune_changes = prune_changes
+        self._current_seq = current_seq
+        os.makedirs(directory, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(directory, "gallery.lock"))
+        self._lock = threading.Lock()
+        self._counter = self._open_counter()
+        self._state = GalleryState(GallerySnapshot.empty(), {}, 0)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._writer = None
+        self.max_delta = max_delta
+
+    def _open_counter(self):
+        return open_counters(self.directory, self._file_lock)
+
+    @property
+    def latest_seq(self):
+        return int(self._counter[0])
+
+    @property
+    def snapshot_hwm(self):
+        return int(self._counter[1])
+
+    def __len__(self):
+        self.refresh()
+        return len(self._state)
+
+    def open(self):
+        """Map the newest snapshot and replay the changes made since it was written"""
+        with self._file_lock:
+            if self._current_seq is not None and max(self.latest_seq, self.snapshot_hwm) > self._current_seq():
+                print(f"Gallery {self.directory} is ahead of the database, rebuilding it")
+                self._counter[:] = 0
+                self._counter.flush()
+                self._remove_old_snapshots(keep=0)
+            hwm = self.snapshot_hwm
+            if hwm and os.path.exists(GallerySnapshot.paths(self.directory, hwm)[1]):
+                snapshot = GallerySnapshot.open(self.directory, hwm, self.search_mode)
+            else:
+                # No usable snapshot, rebuild everything from the database
+                snapshot = GallerySnapshot.empty()
+                self._counter[1] = 0
+                self._counter.flush()
+            with self._lock:
+                self._state = self._replay(GalleryState(snapshot, {}, snapshot.hwm))
+            if self._state.applied > self.latest_seq:
+                self._counter[0] = self._state.applied
+                self._counter.flush()
+            # Write the snapshot before releasing the lock so that workers
+            # starting after a long replay map it instead of replaying too
+            written = len(self._state.changes) > self.max_delta and self._write_snapshot()
+        if written:
+            self._after_snapshot()
+
+    def notify(self, seq):
+        """Tell every worker that changes up to ``seq`` have been committed"""
+        bump_latest_seq(self._counter, self._file_lock, seq)
+        self.refresh()
+        if len(self._state.changes) > self.max_delta:
+            self._wake.set()
+
+    def refresh(self):
+        """Pick up a newer snapshot and replay changes committed by other workers"""
+        state = self._state
+        if self.latest_seq <= state.applied and self.snapshot_hwm <= state.snapshot.hwm:
+            return
+        with self._lock:
+            state = self._state
+            hwm = self.snapshot_hwm
+            if hwm > state.snapshot.hwm:
+                snapshot = GallerySnapshot.open(self.directory, hwm, self.search_mode)
+                changes = {user_id: change for user_id, change in state.changes.items() if change[0] > hwm}
+                state = GalleryState(snapshot, changes, max(state.applied, hwm))
+            self._state = self._replay(state)
+
+    def _replay(self, state):
+        latest = self.latest_seq
+        changes = dict(state.changes)
+        applied = state.applied
+        for seq, user_id, face_encoding in self._changes_since(applied):
+            if face_encoding is None:
+                changes[user_id] = (seq, None)
+            else:
+                changes[user_id] = (seq, np.frombuffer(face_encoding, dtype=np.float64))
+            applied = max(applied, seq)
+        return GalleryState(state.snapshot, changes, max(applied, latest))
+
+    def write_snapshot(self):
+        """Fold the replayed changes into a new snapshot file"""
+        self.refresh()
+        with self._file_lock:
+            written = self._write_snapshot()
+        if written:
+            self._after_snapshot()
+        return written
+
+    def _write_snapshot(self):
+        # Must be called with the file lock held
+        state = self._state
+        if not state.changes or self.snapshot_hwm >= state.applied:
+            return False
+
+        user_ids, encodings = state.merged()
+        GallerySnapshot(state.applied, encodings, user_ids).write(self.directory, self.search_mode)
+
+        self._counter[1] = state.applied
+        self._counter.flush()
+        self._remove_old_snapshots()
+        return True
+
+    def _after_snapshot(self):
+        self.refresh()
+        if self._prune_changes:
+            # Deletions folded into the snapshot no longer need replaying
+            self._prune_changes(self.snapshot_hwm)
+
+    def _remove_old_snapshots(self, keep=2):
+        # Keep the previous snapshot for workers that have not switched yet
+        pattern = re.compile(r"^(?:encodings|user_ids|quantized)-(\d+)[.-]")
+        files = {}
+        for name in os.listdir(self.directory):
+            found = pattern.match(name)
+            if found and not name.endswith(".tmp"):
+                files.setdefault(int(found.group(1)), []).append(name)
+        for old in sorted(files)[:len(files) - keep]:
+            for name in files[old]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # Still mapped by a worker on Windows, retry next time
+                    pass
+
+    def start_snapshot_writer(self, interval):
+        """Write snapshots every ``interval`` seconds, or sooner if the delta grows large"""
+        def run():
+            while not self._stop.is_set():
+                self._wake.wait(interval)
+                self._wake.clear()
+                if self._stop.is_set():
+                    break
+                try:
+                    self.write_snapshot()
+                except Exception as e:
+                    print(f"Error writing gallery snapshot: {e}")
+
+        self._writer = threading.Thread(target=run, name="gallery-snapshot-writer", daemon=True)
+        self._writer.start()
+
+    def stop_snapshot_writer(self):
+        """Stop the background writer and write a final snapshot"""
+        self._stop.set()
+        self._wake.set()
+        if self._writer:
+            self._writer.join()
+        self.write_snapshot()
+
+    @traced("gallery.get")
+    def get(self, user_id):
+        """Return the stored encoding of a user, or None"""
+        self.refresh()
+        state = self._state
+        if user_id in state.changes:
+            encoding = state.changes[user_id][1]
+            return None if encoding is None else encoding.copy()
+        row = state.snapshot.rows([user_id])[0]
+        return None if row < 0 else np.array(state.snapshot.encodings[row])
+
+    def match(self, encoding):
+        """Return ``(user_id, distance)`` of the closest enrolled face.
+
+        Both values are None when the gallery is empty.
+        """
+        return self.match_many(np.atleast_2d(encoding))[0]
+
+    @traced("gallery.match")
+    def match_many(self, encodings):
+        """Return ``(user_id, distance)`` of the closest enrolled face for each
+        row of ``encodings``, scanning the gallery once for all of them"""
+        self.refresh()
+        return self._state.match_many(np.atleast_2d(encodings), self.rerank_k)
+
+    @traced("gallery.nearest")
+    def nearest(self, encoding, k):
+        """Return up to ``k`` ``(user_id, distance)`` of the enrolled faces
+        closest to ``encoding``, nearest first"""
+        self.refresh()
+        return self._state.nearest(encoding, k, self.rerank_k)
+
+    def changes_after(self, seq):
+        """Return the latest applied sequence number and the
+        ``(user_id, seq, encoding or None)`` changes made after ``seq``, or
+        None for the changes if ones that old are no longer tracked"""
+        self.refresh()
+        state = self._state
+        if seq < state.snapshot.hwm:
+            return state.applied, None
+        return state.applied, [
+            (user_id, change_seq, encoding) for user_id, (change_seq, encoding) in state.changes.items()
+            if change_seq > seq
+        ]
+
+    def entries(self, chunk_rows=20000):
+        """Return the latest applied sequence number and an iterator over
+        ``(user_ids, encodings)`` chunks of every enrolled face as of it"""
+        self.refresh()
+        state = self._state
+
+        def chunks():
+            snapshot = state.snapshot
+            keep = np.ones(len(snapshot), dtype=bool)
+            keep[state.masked] = False
+            for start in range(0, len(snapshot), chunk_rows):
+                rows = np.nonzero(keep[start:start + chunk_rows])[0] + start
+                yield np.asarray(snapshot.user_ids[rows]).astype(str), np.asarray(snapshot.encodings[rows])
+            if state.delta_ids:
+                yield np.array(state.delta_ids, dtype=str), state.delta
+
+        return state.applied, chunks()
+
+    def changed_since(self, seq):
+        """Return the ids of users whose face changed after ``seq``, or None
+        if changes that old are no longer tracked individually"""
+        self.refresh()
+        state = self._state
+        if seq < state.snapshot.hwm:
+            return None
+        return {user_id for user_id, change in state.changes.items() if change[0] > seq}
+
+    def subset(self, user_ids):
+        """Copy the encodings of the given users into one contiguous SubGallery.
+
+        Users without face data are left out.
+        """
+        self.refresh()
+        state = self._state
+        user_ids = list(dict.fromkeys(user_ids))
+        changed = [user_id for user_id in user_ids if user_id in state.changes]
+        unchanged = [user_id for user_id in user_ids if user_id not in state.changes]
+
+        # Sorted rows keep the reads from the mapped snapshot sequential
+        rows = state.snapshot.rows(unchanged)
+        rows = np.sort(rows[rows >= 0])
+        ids = [str(user_id) for user_id in state.snapshot.user_ids[rows]]
+        parts = [np.asarray(state.snapshot.encodings[rows])] if len(rows) else []
+
+        for user_id in changed:
+            encoding = state.changes[user_id][1]
+            if encoding is not None:
+                ids.append(user_id)
+                parts.append(encoding.reshape(1, ENCODING_SIZE))
+
+        encodings = np.concatenate(parts) if parts else np.empty((0, ENCODING_SIZE))
+        return SubGallery(state.applied, ids, np.ascontiguousarray(encodings))
+
+class SubGallery:
+    """Encodings of a fixed group of users, such as an exam roster, copied out
+    of the main gallery so that a search scans only that group"""
+
+    def __init__(self, seq, user_ids, encodings):
+        self.seq = seq
+        self.user_ids = user_ids
+        self.members = set(user_ids)
+        self.encodings = encodings
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def match(self, encoding):
+        """Return ``(user_id, distance)`` of the closest face in the group"""
+        return self.match_many(np.atleast_2d(encoding))[0]
+
+    @traced("gallery.match")
+    def match_many(self, encodings):
+        """Return ``(user_id, distance)`` of the closest face in the group for
+        each row of ``encodings``"""
+        probes = np.atleast_2d(encodings)
+        rows, distances = nearest_rows(self.encodings, probes)
+        return merge_matches(self.user_ids, rows, distances, [(None, None)] * len(probes))
+
+    @traced("gallery.nearest")
+    def nearest(self, encoding, k):
+        """Return up to ``k`` ``(user_id, distance)`` of the faces in the group
+        closest to ``encoding``, nearest first"""
+        rows, distances = nearest_k_rows(self.encodings, encoding, k)
+        return nearest_candidates(((self.user_ids[row], distance) for row, distance in zip(rows, distances)), k)
+
+class RosterGalleries:
+    """Per-exam SubGallery cache.
+
+    An entry is rebuilt when a roster member's face changes or after ``ttl``
+    seconds, which is how roster edits made through another worker reach
+    this one.
+    """
+
+    def __init__(self, gallery, load_roster, ttl=60):
+        self.gallery = gallery
+        self._load_roster = load_roster
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # exam_id -> (loaded_at, roster user ids, SubGallery)
+        self._entries = {}
+
+    def open(self, exam_id):
+        """Build the roster gallery of an exam ahead of its first login"""
+        return self._build(exam_id)
+
+    def _build(self, exam_id):
+        roster = self._load_roster(exam_id)
+        sub_gallery = self.gallery.subset(roster)
+        with self._lock:
+            self._entries[exam_id] = (time.monotonic(), roster, sub_gallery)
+        return sub_gallery, len(roster)
+
+    def get(self, exam_id):
+        """Return ``(SubGallery, roster size)`` for an exam"""
+        entry = self._entries.get(exam_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return self._build(exam_id)
+
+        loaded_at, roster, sub_gallery = entry
+        changed = self.gallery.changed_since(sub_gallery.seq)
+        if changed is None or not changed.isdisjoint(roster):
+            sub_gallery = self.gallery.subset(roster)
+            with self._lock:
+                self._entries[exam_id] = (loaded_at, roster, sub_gallery)
+        return sub_gallery, len(roster)
+
+    def invalidate(self, exam_id):
+        with self._lock:
+            self._entries.pop(exam_id, None)
+
+class TenantGallery:
+    """Face galleries of one tenant, one per encoding version so that faces
+    not yet re-encoded keep matching during a migration, with the roster
+    caches built from them.
+
+    ``searchers`` maps versions to what searches of the whole gallery go
+    to, such as a ShardedGallery; by default the galleries themselves.
+    """
+
+    def __init__(self, galleries, current_version, load_roster, roster_ttl=60, searchers=None):
+        self.galleries = galleries
+        self.searchers = searchers or dict(galleries)
+        self.current_version = current_version
+        self.rosters = {
+            version: RosterGalleries(version_gallery, load_roster, ttl=roster_ttl)
+            for version, version_gallery in galleries.items()
+        }
+
+    def open(self, snapshot_interval):
+        for version_gallery in self.galleries.values():
+            version_gallery.open()
+            version_gallery.start_snapshot_writer(snapshot_interval)
+
+    def close(self):
+        """Stop the snapshot writers, writing a final snapshot of each gallery"""
+        for version, searcher in self.searchers.items():
+            if searcher is not self.galleries[version]:
+                searcher.close()
+        for version_gallery in self.galleries.values():
+            version_gallery.stop_snapshot_writer()
+
+    def active(self):
+        """Return (version, gallery) for the current version and every older
+        version that still holds faces"""
+        return [
+            (version, version_gallery) for version, version_gallery in self.galleries.items()
+            if version == self.current_version or len(version_gallery)
+        ]
+
+    @property
+    def latest_seq(self):
+        """Latest change to any gallery, for keying cached match results"""
+        return max(version_gallery.latest_seq for version_gallery in self.galleries.values())
+
+    def notify(self, versions, seq):
+        """Tell every worker about committed changes to the encodings of these
+        versions; returns the versions this tenant has no gallery for"""
+        missing = []
+        for version in versions:
+            if version in self.galleries:
+                self.galleries[version].notify(seq)
+            else:
+                missing.append(version)
+        return missing
+
+    def invalidate_roster(self, exam_id):
+        for roster_galleries in self.rosters.values():
+            roster_galleries.invalidate(exam_id)
+
+    def __len__(self):
+        return sum(len(version_gallery) for version_gallery in self.galleries.values())
+
+class TenantGalleries:
+    """The TenantGallery of each tenant, opened by ``open_tenant(tenant_id)``
+    on first use and closed once it has gone ``idle_timeout`` seconds
+    without being used, so that memory and snapshot upkeep follow the
+    tenants that are active rather than every tenant on the deployment.
+
+    A request still holding a gallery that is being evicted can finish
+    with it: closing only stops the snapshot writer.
+    """
+
+    def __init__(self, open_tenant, idle_timeout, check_interval=60):
+        self._open_tenant = open_tenant
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # tenant_id -> [last used, TenantGallery]
+        self._entries = {}
+        self._checked_at = time.monotonic()
+        self.opened = 0
+        self.evicted = 0
+
+    def get(self, tenant_id):
+        """Return the TenantGallery of a tenant, opening it if needed"""
+        now = time.monotonic()
+        entry = self._entries.get(tenant_id)
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(tenant_id)
+                if entry is None:
+                    entry = [now, self._open_tenant(tenant_id)]
+                    self._entries[tenant_id] = entry
+                    self.opened += 1
+        entry[0] = now
+        if self.idle_timeout and now - self._checked_at > self.check_interval:
+            self._evict_idle(now)
+        return entry[1]
+
+    def loaded(self, tenant_id):
+        """Return the TenantGallery of a tenant if it is open, without opening it"""
+        entry = self._entries.get(tenant_id)
+        return entry[1] if entry else None
+
+    def _evict_idle(self, now):
+        with self._lock:
+            self._checked_at = now
+            idle = [tenant_id for tenant_id, (used, _) in self._entries.items() if now - used > self.idle_timeout]
+            closing = [(tenant_id, self._entries.pop(tenant_id)[1]) for tenant_id in idle]
+        for tenant_id, tenant_gallery in closing:
+            try:
+                tenant_gallery.close()
+            except Exception as e:
+                print(f"Error closing the galleries of tenant {tenant_id}: {e}")
+            self.evicted += 1
+            print(f"Closed the galleries of tenant {tenant_id}, idle for more than {self.idle_timeout}s")
+
+    def close(self):
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        for _, tenant_gallery in entries.values():
+            tenant_gallery.close()
+
+    def metrics(self):
+        entries = list(self._entries.items())
+        return [
+            ("trustface_tenant_galleries_open", "gauge", "Tenants whose galleries are open in this worker", [({}, len(entries))]),
+            ("trustface_tenant_galleries_opened_total", "counter", "Tenant galleries opened on first use", [({}, self.opened)]),
+            ("trustface_tenant_galleries_evicted_total", "counter", "Tenant galleries closed after going idle", [({}, self.evicted)]),
+            ("trustface_tenant_gallery_faces", "gauge", "Enrolled faces in each open tenant gallery",
+             [({"tenant": tenant_id}, len(tenant_gallery)) for tenant_id, (_, tenant_gallery) in entries]),
+        ]
@@ -0,0 +1,205 @@
+
+import os
+import queue
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+from sweeper import delete_old_files
+
+def image_key(image):
+    """Content address of an image: the SHA-256 of its encoded bytes, or of
+    the shape and pixels of a decoded array"""
+    digest = hashlib.sha256()
+    if isinstance(image, np.ndarray):
+        digest.update(repr(image.shape).encode())
+        image = np.ascontiguousarray(image)
+    digest.update(image)
+    return digest.hexdigest()
+
+class ImageStore(ABC):
+    """Images addressed by ``image_key``.
+
+    Keys name content, so storing a key again never changes what it holds;
+    it only refreshes the object's age for ``delete_older_than``. That is
+    all a backend has to support, which a local directory and an object
+    storage bucket both can.
+    """
+
+    @abstractmethod
+    def put(self, key, data):
+        """Store encoded image bytes under a key"""
+
+    @abstractmethod
+    def touch(self, key):
+        """Refresh the age of a stored image; returns False if there is none"""
+
+    @abstractmethod
+    def get(self, key):
+        """Return the stored bytes, or None"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Delete a stored image; returns its size in bytes, or None if there was none"""
+
+    @abstractmethod
+    def delete_older_than(self, max_age, batch_size=500, rate=200):
+        """Delete images not stored or touched for ``max_age`` seconds.
+
+        Returns ``(images deleted, bytes reclaimed)``.
+        """
+
+class LocalImageStore(ImageStore):
+    """Image store in a local directory.
+
+    Files are sharded by the first two bytes of their key (``ab/cd/abcd...``),
+    so no directory holds more than a 65536th of the images.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.jpg")
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed, so readers never see a partial image
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def touch(self, key):
+        try:
+            os.utime(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        path = self.path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return None
+
+    def delete_older_than(self, max_age, batch_size=500, rate=200):
+        return delete_old_files(self.root, max_age, batch_size, rate, recursive=True)
+
+class ImageWriter:
+    """Re-encodes images and puts them in a store from a background thread,
+    so requests do not wait for the disk.
+
+    ``save`` returns the image's key straight away. Images are scaled down
+    to at most ``max_side`` pixels (0 keeps their size) and stored as JPEG
+    at ``quality``. Images already in the store are only touched. When
+    ``max_pending`` images are waiting, or the writer is not running, the
+    image is written in the calling thread instead, so none are dropped.
+    """
+
+    def __init__(self, store, quality=90, max_side=0, max_pending=1000):
+        self.store = store
+        self.quality = quality
+        self.max_side = max_side
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self.written = 0
+        self.deduplicated = 0
+        self.inline = 0
+        self.failed = 0
+        self.bytes_written = 0
+
+    def save(self, image):
+        """Store encoded image bytes, or an RGB array, and return its key"""
+        key = image_key(image)
+        if self._thread is None:
+            self._write(key, image)
+            return key
+        try:
+            self._queue.put_nowait((key, image))
+        except queue.Full:
+            self.inline += 1
+            self._write(key, image)
+        return key
+
+    def encode(self, image):
+        """Return the JPEG bytes to store for an image"""
+        if isinstance(image, np.ndarray):
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        else:
+            decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+            if decoded is None:
+                # Not an image we can read; keep it as it was sent
+                return bytes(image)
+            image = decoded
+
+        longest = max(image.shape[:2])
+        if self.max_side and longest > self.max_side:
+            scale = self.max_side / longest
+            image = cv2.resize(image, (round(image.shape[1] * scale), round(image.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return encoded.tobytes()
+
+    def _write(self, key, image):
+        try:
+            if self.store.touch(key):
+                self.deduplicated += 1
+                return
+            data = self.encode(image)
+            self.store.put(key, data)
+        except Exception as e:
+            self.failed += 1
+            print(f"Error storing image {key}: {e}")
+            return
+        self.written += 1
+        self.bytes_written += len(data)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._write(*item)
+
+    def start(self, name="image-writer"):
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write every pending image, then stop"""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+def writer_metrics(writers):
+    """Metric families for a dict of name -> ImageWriter"""
+    def per_store(value):
+        return [({"store": name}, value(writer)) for name, writer in writers.items()]
+
+    return [
+        ("trustface_images_written_total", "counter", "Images re-encoded and stored", per_store(lambda w: w.written)),
+        ("trustface_images_written_bytes_total", "counter", "Bytes of stored images", per_store(lambda w: w.bytes_written)),
+        ("trustface_images_deduplicated_total", "counter", "Images already in the store", per_store(lambda w: w.deduplicated)),
+        ("trustface_images_inline_total", "counter", "Images written in the request because the queue was full", per_store(lambda w: w.inline)),
+        ("trustface_images_failed_total", "counter", "Images that could not be stored", per_store(lambda w: w.failed)),
+        ("trustface_images_pending", "gauge", "Images waiting to be stored", per_store(lambda w: w.pending)),
+    ]
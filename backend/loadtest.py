@@ -0,0 +1,329 @@
+
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.parse
+from collections import defaultdict
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+class HttpError(Exception):
+    pass
+
+async def http_request(host, port, method, path, body=b"", headers=None, timeout=120):
+    """Send one HTTP/1.1 request on a new connection; return (status, body bytes)"""
+    async def exchange():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            lines = [f"{method} {path} HTTP/1.1", f"Host: {host}:{port}", "Connection: close", f"Content-Length: {len(body)}"]
+            lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            if not status_line:
+                raise HttpError("Connection closed without a response")
+            status = int(status_line.split()[1])
+            response_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+
+            if "content-length" in response_headers:
+                data = await reader.readexactly(int(response_headers["content-length"]))
+            elif response_headers.get("transfer-encoding") == "chunked":
+                data = b""
+                while True:
+                    size = int((await reader.readline()).strip(), 16)
+                    if not size:
+                        break
+                    data += await reader.readexactly(size)
+                    await reader.readline()
+            else:
+                data = await reader.read()
+            return status, data
+        finally:
+            writer.close()
+
+    return await asyncio.wait_for(exchange(), timeout)
+
+def multipart(fields, files):
+    """Encode form fields and (name, filename, bytes, content type) files"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data, content_type in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+def fresh_frame(image):
+    """Return a copy of an image with different bytes but the same pixels.
+
+    Decoders ignore data after the end of the image, so the padding defeats
+    the exact-duplicate result cache the way real webcam noise does.
+    """
+    return image + os.urandom(16)
+
+def arrival_times(curve, count, duration, rng):
+    """Start offsets in seconds of ``count`` candidates over ``duration`` seconds.
+
+    ``burst``: most candidates arrive right as the exam opens, with a tail
+    of late arrivals. ``ramp``: the arrival rate grows linearly. ``steady``:
+    Poisson arrivals at a constant rate.
+    """
+    if curve == "burst":
+        offsets = [min(duration, rng.expovariate(5 / duration)) for _ in range(count)]
+    elif curve == "ramp":
+        offsets = [duration * rng.random() ** 0.5 for _ in range(count)]
+    elif curve == "steady":
+        offsets, t = [], 0.0
+        for _ in range(count):
+            t += rng.expovariate(count / duration)
+            offsets.append(min(t, duration))
+    else:
+        raise ValueError(f"Unknown arrival curve: {curve}")
+    return sorted(offsets)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+class Stats:
+    """Latencies and outcomes per endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record(self, endpoint, latency, status, ok):
+        self.latencies[endpoint].append(latency)
+        self.statuses[endpoint][status] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, title):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        print(f"\n{title} ({elapsed:.1f}s)")
+        print("-" * 104)
+        print(f"{'Endpoint':<22} {'Requests':>8} {'Errors':>7} {'Err %':>6} {'Req/s':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'Max ms':>8}  Statuses")
+        print("-" * 104)
+        for endpoint, latencies in self.latencies.items():
+            errors = self.errors[endpoint]
+            statuses = " ".join(f"{status}:{count}" for status, count in sorted(self.statuses[endpoint].items()))
+            print(
+                f"{endpoint:<22} {len(latencies):>8} {errors:>7} {100 * errors / len(latencies):>6.1f} {len(latencies) / elapsed:>7.1f} "
+                f"{1000 * percentile(latencies, 0.5):>8.0f} {1000 * percentile(latencies, 0.9):>8.0f} "
+                f"{1000 * percentile(latencies, 0.99):>8.0f} {1000 * max(latencies):>8.0f}  {statuses}"
+            )
+        print("-" * 104)
+
+class Candidate:
+    """One simulated exam candidate with its own account and face image"""
+
+    def __init__(self, client, username, image, image_name):
+        self.client = client
+        self.username = username
+        self.password = uuid.uuid4().hex
+        self.image = image
+        self.image_name = image_name
+        self.token = None
+        self.session_id = None
+
+    @property
+    def auth(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def enrol(self):
+        await self.client.call("register", "POST", "/register", json_body={
+            "username": self.username, "full_name": self.username, "password": self.password,
+        })
+        status, body = await self.client.call("token", "POST", "/token", form={
+            "username": self.username, "password": self.password,
+        })
+        if status != 200:
+            return False
+        self.token = body["access_token"]
+        status, _ = await self.client.call("upload-face", "POST", "/upload-face", headers=self.auth, files=[
+            ("file", self.image_name, self.image, "image/jpeg"),
+        ])
+        return status == 200
+
+    async def sit_exam(self, exam_id, verifications, interval):
+        image_data = "data:image/jpeg;base64," + base64.b64encode(fresh_frame(self.image)).decode()
+        await self.client.call("face-login", "POST", "/face-login", json_body={"image_data": image_data},
+                               ok=lambda status, body: status == 200 and body.get("success"))
+
+        status, body = await self.client.call("start-exam-session", "POST", "/start-exam-session",
+                                              headers=self.auth, json_body={"exam_id": exam_id})
+        if status != 200:
+            return
+        self.session_id = body["session_id"]
+
+        for index in range(verifications):
+            if index:
+                await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+            await self.client.call(
+                "verify-exam-session", "POST", "/verify-exam-session", headers=self.auth,
+                fields={"session_id": self.session_id},
+                files=[("file", "frame.jpg", fresh_frame(self.image), "image/jpeg")],
+                ok=lambda status, body: status == 200 and body.get("verified"),
+            )
+
+        await self.client.call("end-exam-session", "POST",
+                               f"/end-exam-session?session_id={urllib.parse.quote(self.session_id)}", headers=self.auth)
+
+class Client:
+    """Calls the API and records every call in the current Stats"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.stats = Stats()
+
+    async def call(self, endpoint, method, path, headers=None, json_body=None, form=None, fields=None, files=None, ok=None):
+        headers = dict(headers or {})
+        body = b""
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            body = urllib.parse.urlencode(form).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif files is not None:
+            body, headers["Content-Type"] = multipart(fields or {}, files)
+
+        started = time.monotonic()
+        try:
+            status, data = await http_request(self.host, self.port, method, path, body, headers)
+        except (OSError, asyncio.TimeoutError, HttpError, asyncio.IncompleteReadError) as e:
+            self.stats.record(endpoint, time.monotonic() - started, type(e).__name__, False)
+            return None, None
+        latency = time.monotonic() - started
+
+        try:
+            parsed = json.loads(data) if data else None
+        except ValueError:
+            parsed = None
+        success = ok(status, parsed or {}) if ok else 200 <= status < 300
+        self.stats.record(endpoint, latency, status, bool(success))
+        return status, parsed
+
+def load_images(directory):
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not names:
+        raise SystemExit(f"No face images found in {directory}")
+    images = []
+    for name in names:
+        with open(os.path.join(directory, name), "rb") as f:
+            images.append((name, f.read()))
+    return images
+
+def launch_server(port, workers):
+    """Start the backend on a fresh database in a temporary data directory"""
+    data_dir = tempfile.mkdtemp(prefix="trustface-load-")
+    env = dict(os.environ)
+    env.update({
+        "TRUSTFACE_DATA_DIR": data_dir,
+        "TRUSTFACE_DATABASE_URL": f"sqlite:///{os.path.join(data_dir, 'trustface.db')}",
+        "TRUSTFACE_HOST": "127.0.0.1",
+        "TRUSTFACE_PORT": str(port),
+        "TRUSTFACE_WORKERS": str(workers),
+    })
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, "app.py"], cwd=backend_dir, env=env)
+    print(f"Started backend (pid {server.pid}) with data in {data_dir}")
+    return server
+
+async def wait_for_server(host, port, server=None, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server and server.poll() is not None:
+            raise SystemExit("The backend exited during startup")
+        try:
+            status, _ = await http_request(host, port, "GET", "/openapi.json", timeout=5)
+            if status == 200:
+                return
+        except (OSError, asyncio.TimeoutError, HttpError):
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"The backend did not answer on {host}:{port}")
+
+async def run(args):
+    rng = random.Random(args.seed)
+    images = load_images(args.images)
+    client = Client(args.host, args.port)
+    run_id = uuid.uuid4().hex[:8]
+    candidates = [
+        Candidate(client, f"load_{run_id}_{index}", images[index % len(images)][1], images[index % len(images)][0])
+        for index in range(args.candidates)
+    ]
+
+    # Registration and enrolment happen ahead of exam day
+    limit = asyncio.Semaphore(args.enrol_concurrency)
+    async def enrol(candidate):
+        async with limit:
+            return await candidate.enrol()
+    enrolled = await asyncio.gather(*(enrol(candidate) for candidate in candidates))
+    client.stats.finished = time.monotonic()
+    client.stats.report(f"Enrolment of {len(candidates)} candidates, {args.enrol_concurrency} at a time")
+    candidates = [candidate for candidate, ok in zip(candidates, enrolled) if ok]
+    if not candidates:
+        raise SystemExit("No candidate could enrol")
+
+    # Exam day: candidates arrive following the curve
+    client.stats = Stats()
+    offsets = arrival_times(args.curve, len(candidates), args.arrival_window, rng)
+    async def sit(candidate, offset):
+        await asyncio.sleep(offset)
+        await candidate.sit_exam(args.exam_id, args.verifications, args.verify_interval)
+    await asyncio.gather(*(sit(candidate, offset) for candidate, offset in zip(candidates, offsets)))
+    client.stats.finished = time.monotonic()
+    client.stats.report(f"Exam sitting: {len(candidates)} candidates, {args.curve} arrivals over {args.arrival_window:.0f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay exam-day traffic against a TrustFace backend")
+    parser.add_argument("--images", required=True, help="directory of face images, one per simulated candidate (reused round-robin)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--launch", action="store_true", help="start a backend on a fresh temporary database first")
+    parser.add_argument("--workers", type=int, default=1, help="backend workers when using --launch")
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--curve", choices=("burst", "ramp", "steady"), default="burst", help="how candidates arrive")
+    parser.add_argument("--arrival-window", type=float, default=60.0, help="seconds over which candidates arrive")
+    parser.add_argument("--verifications", type=int, default=5, help="verification frames per candidate")
+    parser.add_argument("--verify-interval", type=float, default=5.0, help="seconds between verification frames")
+    parser.add_argument("--enrol-concurrency", type=int, default=8)
+    parser.add_argument("--exam-id", default="LOADTEST")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    server = launch_server(args.port, args.workers) if args.launch else None
+    try:
+        asyncio.run(wait_for_server(args.host, args.port, server))
+        asyncio.run(run(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
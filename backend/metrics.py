@@ -0,0 +1,18 @@
+
+def format_metrics(families):
+    """Render metric families in the Prometheus text exposition format.
+
+    Each family is ``(name, type, help, samples)`` where samples is a list of
+    ``(labels dict, value)``.
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            if labels:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,30 @@
+
+from sqlalchemy import inspect, text
+
+def upgrade_schema(engine, metadata):
+    """Add columns and indexes that are missing from an existing database.
+
+    ``create_all`` only creates missing tables, so databases created by an
+    older version of the app would otherwise never get new columns.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                print(f"Adding column {table.name}.{column.name}")
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    print(f"Creating index {index.name}")
+                    index.create(connection, checkfirst=True)
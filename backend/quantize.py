@@ -0,0 +1,94 @@
+
+import os
+import numpy as np
+
+SEARCH_MODES = ("exact", "float16", "int8")
+
+class QuantizedMatrix:
+    """Compact copy of an encoding matrix for a fast, approximate first pass.
+
+    ``int8`` stores each dimension scaled to [-127, 127] (1 byte per value)
+    and is scanned straight from the memory-mapped file. ``float16`` stores
+    half precision floats (2 bytes), but numpy has no fast conversion from
+    them, so the rows are converted to float32 once on the first search and
+    kept in each process. The squared norm of every dequantized row is kept
+    so that squared distances can be computed with matrix-vector products:
+    ``|x - q|^2 = |x|^2 - 2 x.q + |q|^2``.
+    """
+
+    def __init__(self, mode, values, scale, norms):
+        self.mode = mode
+        self.values = values
+        self.scale = scale
+        self.norms = norms
+        self._float32_rows = None
+
+    @classmethod
+    def build(cls, mode, encodings, chunk_rows=65536):
+        encodings = np.asarray(encodings)
+        if mode == "int8":
+            scale = (np.abs(encodings).max(axis=0) / 127).astype(np.float32) if len(encodings) else np.ones(encodings.shape[1], np.float32)
+            scale[scale == 0] = 1
+            dtype = np.int8
+        elif mode == "float16":
+            scale = np.ones(encodings.shape[1], np.float32)
+            dtype = np.float16
+        else:
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        values = np.empty(encodings.shape, dtype=dtype)
+        norms = np.empty(len(encodings), dtype=np.float32)
+        for start in range(0, len(encodings), chunk_rows):
+            block = np.asarray(encodings[start:start + chunk_rows], dtype=np.float32) / scale
+            if dtype is np.int8:
+                block = np.clip(np.rint(block), -127, 127)
+            values[start:start + chunk_rows] = block
+            dequantized = values[start:start + chunk_rows].astype(np.float32) * scale
+            norms[start:start + chunk_rows] = np.einsum("ij,ij->i", dequantized, dequantized)
+        return cls(mode, values, scale, norms)
+
+    @staticmethod
+    def paths(prefix, mode):
+        return (f"{prefix}.{mode}.npy", f"{prefix}.{mode}-scale.npy", f"{prefix}.{mode}-norms.npy")
+
+    def save(self, prefix):
+        for path, array in zip(self.paths(prefix, self.mode), (self.values, self.scale, self.norms)):
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, prefix, mode):
+        """Map a saved matrix, or return None if it was never written"""
+        paths = cls.paths(prefix, mode)
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        values, scale, norms = (np.load(path, mmap_mode="r") for path in paths)
+        return cls(mode, values, np.asarray(scale), norms)
+
+    def __len__(self):
+        return len(self.values)
+
+    def squared_distances(self, probes, chunk_rows=4096):
+        """Approximate squared distances, shape (rows, probes), from every
+        row to every probe encoding.
+
+        int8 rows are converted to float32 a cache-sized block at a time, so
+        the scan reads only the compact matrix from memory.
+        """
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        # x.q with x = values * scale is values . (scale * q)
+        scaled_probes = (probes * self.scale).T
+        if self.mode == "float16":
+            if self._float32_rows is None:
+                self._float32_rows = np.asarray(self.values, dtype=np.float32)
+            distances = self.norms[:, None] - 2 * (self._float32_rows @ scaled_probes)
+            distances += np.einsum("ij,ij->i", probes, probes)
+            return distances
+
+        distances = np.empty((len(self.values), len(probes)), dtype=np.float32)
+        for start in range(0, len(self.values), chunk_rows):
+            block = self.values[start:start + chunk_rows].astype(np.float32)
+            distances[start:start + chunk_rows] = self.norms[start:start + chunk_rows, None] - 2 * (block @ scaled_probes)
+        distances += np.einsum("ij,ij->i", probes, probes)
+        return distances
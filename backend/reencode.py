@@ -0,0 +1,142 @@
+
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from settings import KNOWN_FACES_DIR, ENCODING_VERSION
+from face_pipeline import decode_image, encode_faces
+from gallery import notify_gallery
+
+def lower_priority():
+    """Run encoding workers below the API workers so live traffic comes first"""
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+def encode_crop(data):
+    """Encode a saved face crop with the current profile; the crop is the face box"""
+    image = decode_image(data)
+    height, width = image.shape[:2]
+    return encode_faces(image, [(0, width, height, 0)], ENCODING_VERSION)[0].tobytes()
+
+def load_crop(row):
+    """Return the saved face crop of a face data row, or None"""
+    from app import face_images
+
+    if row.image_key:
+        return face_images.store.get(row.image_key)
+    # Saved before the image store
+    path = os.path.join(KNOWN_FACES_DIR, f"{row.user_id}.jpg")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+def reencode_batch(db, pool, rows):
+    """Re-encode one batch of outdated rows and swap them in one transaction.
+
+    Returns (re-encoded, missing crop, (tenant, version) galleries changed, seq).
+    """
+    from app import FaceData, FaceDataTombstone, next_gallery_seq
+
+    crops = {row.user_id: load_crop(row) for row in rows}
+    todo = [row for row in rows if crops[row.user_id] is not None]
+    encodings = {}
+    for row, result in zip(todo, pool.map(encode_crop, [crops[row.user_id] for row in todo])):
+        encodings[row.user_id] = result
+
+    seq = next_gallery_seq(db)
+    changed_versions = set()
+    done = 0
+    for row in todo:
+        face_data = db.query(FaceData).filter(FaceData.id == row.id).first()
+        if face_data is None or face_data.encoding_version == ENCODING_VERSION:
+            # Re-enrolled or cleared while the batch was being encoded
+            continue
+
+        # Keep one encoding per user: a re-enrolment may have added a
+        # current-version row next to the old one
+        current = db.query(FaceData.id).filter(
+            FaceData.user_id == row.user_id, FaceData.encoding_version == ENCODING_VERSION
+        ).first()
+        if current is None:
+            db.add(FaceData(
+                tenant_id=row.tenant_id,
+                user_id=row.user_id,
+                face_encoding=encodings[row.user_id],
+                encoding_version=ENCODING_VERSION,
+                seq=seq,
+                image_key=row.image_key
+            ))
+            changed_versions.add((row.tenant_id, ENCODING_VERSION))
+
+        db.add(FaceDataTombstone(
+            tenant_id=row.tenant_id, user_id=row.user_id, encoding_version=face_data.encoding_version, seq=seq
+        ))
+        changed_versions.add((row.tenant_id, face_data.encoding_version))
+        db.delete(face_data)
+        done += 1
+    db.commit()
+
+    return done, len(rows) - len(todo), changed_versions, seq
+
+def reencode(workers, rate, batch_size):
+    """Move every stored encoding to the current encoding version.
+
+    Outdated rows are walked in user id order, so the job can be stopped and
+    started again at any time. Users without a saved crop keep their old
+    encoding (which still matches) until they upload a new photo.
+    """
+    # Imported here so that the encoding processes do not set up the app
+    from app import SessionLocal, FaceData, gallery_directory
+
+    print(f"Re-encoding faces to version {ENCODING_VERSION} with {workers} workers")
+    started = time.time()
+    total = missing = 0
+    last_user_id = ""
+    db = SessionLocal()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=lower_priority) as pool:
+            while True:
+                rows = (
+                    db.query(FaceData.id, FaceData.tenant_id, FaceData.user_id, FaceData.image_key)
+                    .filter(FaceData.encoding_version != ENCODING_VERSION, FaceData.user_id > last_user_id)
+                    .order_by(FaceData.user_id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                last_user_id = rows[-1].user_id
+
+                batch_started = time.time()
+                done, skipped, changed_versions, seq = reencode_batch(db, pool, rows)
+                total += done
+                missing += skipped
+
+                # Let the API workers pick up the batch
+                for tenant_id, version in changed_versions:
+                    notify_gallery(gallery_directory(version, tenant_id), seq)
+
+                print(f"Re-encoded {total} faces ({missing} without a saved crop), {total / max(time.time() - started, 1e-9):.1f} faces/s")
+
+                # Throttle to the requested rate
+                if rate:
+                    time.sleep(max(0, len(rows) / rate - (time.time() - batch_started)))
+    finally:
+        db.close()
+
+    print(f"Done: {total} faces re-encoded in {time.time() - started:.1f}s")
+    if missing:
+        print(f"{missing} faces have no saved crop and keep their old encoding until the user uploads a new photo")
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode stored face crops with the current encoding version")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="encoding processes (default: half the cores, leaving the rest to the API)")
+    parser.add_argument("--rate", type=float, default=0, help="maximum faces per second (default: no limit)")
+    parser.add_argument("--batch-size", type=int, default=200, help="faces per transaction")
+    args = parser.parse_args()
+    reencode(args.workers, args.rate, args.batch_size)
+
+if __name__ == "__main__":
+    main()
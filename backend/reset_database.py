@@ -8,14 +8,54 @@ from sqlalchemy.orm import sessionmaker
 # Add the parent directory to the path so we can import app modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import Base, User, FaceData, ExamSession
+from settings import SQLALCHEMY_DATABASE_URL, UPLOADS_DIR, KNOWN_FACES_DIR, GALLERY_DIR, IMAGE_STORE_DIR
+from app import (
+    Base, Tenant, User, FaceData, FaceDataTombstone, GallerySequence, ExamSession, ExamSummary, ExamRoster,
+    VerificationFrame,
+)
+
+# Every table holding app data, rows that point at others first
+DATA_TABLES = (
+    ("verification frame", VerificationFrame),
+    ("exam roster", ExamRoster),
+    ("exam session", ExamSession),
+    ("exam summary", ExamSummary),
+    ("face data", FaceData),
+    ("face data tombstone", FaceDataTombstone),
+    ("gallery sequence", GallerySequence),
+    ("user", User),
+    ("tenant", Tenant),
+)
+
+def delete_all_records(db):
+    """Delete the rows of every data table; the caller commits. The default
+    tenant is created again when the server starts."""
+    for label, model in DATA_TABLES:
+        print(f"Deleting {label} records...")
+        db.query(model).delete()
+
+def remove_data_directories():
+    """Remove the files the server keeps next to the database: uploads,
+    face crops and verification frames, and the face gallery snapshot,
+    which is rebuilt from the database"""
+    for directory, recreate in (
+        (UPLOADS_DIR, True),
+        (KNOWN_FACES_DIR, True),
+        (IMAGE_STORE_DIR, False),
+        (GALLERY_DIR, False),
+    ):
+        if os.path.exists(directory):
+            print(f"Removing {directory} directory...")
+            shutil.rmtree(directory)
+        if recreate:
+            os.makedirs(directory)
+            print(f"Recreated {directory} directory.")
 
 def reset_database():
     """Reset the database by removing all data but preserving the table structure"""
     print("Resetting TrustFace 2.0 database...")
 
     # Database setup (same as in app.py)
-    SQLALCHEMY_DATABASE_URL = "sqlite:///./trustface.db"
     engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -24,14 +64,7 @@ def reset_database():
 
     try:
         # Delete all records from each table
-        print("Deleting user records...")
-        db.query(User).delete()
-
-        print("Deleting face data records...")
-        db.query(FaceData).delete()
-
-        print("Deleting exam session records...")
-        db.query(ExamSession).delete()
+        delete_all_records(db)
 
         # Commit the changes
         db.commit()
@@ -43,21 +76,8 @@ def reset_database():
     finally:
         db.close()
 
-    # Remove uploaded files
-    uploads_dir = "uploads"
-    if os.path.exists(uploads_dir):
-        print(f"Removing {uploads_dir} directory...")
-        shutil.rmtree(uploads_dir)
-        os.makedirs(uploads_dir)
-        print(f"Recreated {uploads_dir} directory.")
-
-    # Remove known faces
-    known_faces_dir = "known_faces"
-    if os.path.exists(known_faces_dir):
-        print(f"Removing {known_faces_dir} directory...")
-        shutil.rmtree(known_faces_dir)
-        os.makedirs(known_faces_dir)
-        print(f"Recreated {known_faces_dir} directory.")
+    # Remove uploaded files, stored images and the gallery snapshot
+    remove_data_directories()
 
     print("Database reset completed successfully!")
     print("The application will start with a clean database.")
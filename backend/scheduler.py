@@ -0,0 +1,149 @@
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tracing import span
+
+# Lower value runs first
+PRIORITY_CLASSES = {
+    "verification": 0,  # candidates already in an exam
+    "login": 1,
+    "enrolment": 2,
+}
+
+class Overloaded(Exception):
+    """Raised when a request is shed because it would wait past its latency budget"""
+
+    def __init__(self, priority_class, retry_after):
+        super().__init__(f"Face processing is overloaded, retry in {retry_after} seconds")
+        self.priority_class = priority_class
+        self.retry_after = retry_after
+
+class ClassStats:
+    """Counters for one priority class"""
+
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.admitted = 0
+        self.shed = 0
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.recent_waits = deque(maxlen=1000)
+
+    def record_wait(self, wait):
+        self.wait_count += 1
+        self.wait_sum += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.recent_waits.append(wait)
+
+    def wait_percentile(self, q):
+        if not self.recent_waits:
+            return 0.0
+        waits = sorted(self.recent_waits)
+        return waits[min(len(waits) - 1, int(q * len(waits)))]
+
+class FaceWorkScheduler:
+    """Admission control in front of the CPU-bound face pipeline.
+
+    At most ``max_in_flight`` jobs run at once; the rest wait in a priority
+    queue (verification, then login, then enrolment, FIFO within a class).
+    A new job is shed with ``Overloaded`` straight away when the work ahead
+    of it, at the recent average service time, would make it wait longer
+    than the latency budget of its class.
+
+    An optional ``controller`` (see DegradationController) is told the
+    queue depth and queueing delay of every job as it starts.
+    """
+
+    def __init__(self, max_in_flight, latency_budgets, executor=None, controller=None):
+        self.max_in_flight = max_in_flight
+        self.latency_budgets = latency_budgets
+        self.controller = controller
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="face")
+        self.in_flight = 0
+        self.service_time = 0.5  # seconds, exponentially weighted average
+        self.stats = {name: ClassStats() for name in PRIORITY_CLASSES}
+        self._queue = []
+        self._order = itertools.count()
+
+    def estimated_wait(self, priority_class):
+        """Seconds a new job of this class would wait before starting"""
+        priority = PRIORITY_CLASSES[priority_class]
+        ahead = sum(1 for entry in self._queue if entry[0] <= priority and not entry[2].done())
+        excess = max(0, self.in_flight + ahead - self.max_in_flight + 1)
+        return excess / self.max_in_flight * self.service_time
+
+    async def run(self, priority_class, fn, *args):
+        """Run ``fn(*args)`` on the executor once a slot is free"""
+        stats = self.stats[priority_class]
+        wait = self.estimated_wait(priority_class)
+        if wait > self.latency_budgets[priority_class]:
+            stats.shed += 1
+            raise Overloaded(priority_class, max(1, math.ceil(wait)))
+
+        stats.admitted += 1
+        queued_at = time.monotonic()
+        if self.in_flight >= self.max_in_flight:
+            slot = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (PRIORITY_CLASSES[priority_class], next(self._order), slot, priority_class))
+            stats.queued += 1
+            try:
+                with span("face.queue", **{"face.class": priority_class}):
+                    await slot
+            except asyncio.CancelledError:
+                # The slot may have been handed over just before the cancellation
+                if slot.done() and not slot.cancelled():
+                    self._release()
+                raise
+            finally:
+                stats.queued -= 1
+        else:
+            self.in_flight += 1
+
+        wait = time.monotonic() - queued_at
+        stats.record_wait(wait)
+        if self.controller:
+            self.controller.observe(sum(s.queued for s in self.stats.values()), wait)
+        stats.running += 1
+        started_at = time.monotonic()
+        try:
+            # The copied context carries the current trace span into the worker thread
+            return await asyncio.wrap_future(self.executor.submit(contextvars.copy_context().run, fn, *args))
+        finally:
+            stats.running -= 1
+            self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - started_at)
+            self._release()
+
+    def _release(self):
+        # Hand the slot straight to the next live waiter, if any
+        while self._queue:
+            _, _, slot, _ = heapq.heappop(self._queue)
+            if not slot.done():
+                slot.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def metrics(self):
+        """Queue depth, wait times and shed counts per priority class"""
+        def per_class(value):
+            return [({"class": name}, value(stats)) for name, stats in self.stats.items()]
+
+        return [
+            ("trustface_face_queue_depth", "gauge", "Face jobs waiting for a slot", per_class(lambda s: s.queued)),
+            ("trustface_face_running", "gauge", "Face jobs running", per_class(lambda s: s.running)),
+            ("trustface_face_admitted_total", "counter", "Face jobs admitted", per_class(lambda s: s.admitted)),
+            ("trustface_face_shed_total", "counter", "Face jobs shed with 503", per_class(lambda s: s.shed)),
+            ("trustface_face_wait_seconds_count", "counter", "Face jobs that waited for a slot", per_class(lambda s: s.wait_count)),
+            ("trustface_face_wait_seconds_sum", "counter", "Total seconds spent waiting for a slot", per_class(lambda s: s.wait_sum)),
+            ("trustface_face_wait_seconds_max", "gauge", "Longest wait for a slot", per_class(lambda s: s.wait_max)),
+            ("trustface_face_wait_seconds_p95", "gauge", "95th percentile of recent waits", per_class(lambda s: s.wait_percentile(0.95))),
+            ("trustface_face_service_seconds", "gauge", "Average face job run time", [({}, self.service_time)]),
+            ("trustface_face_in_flight", "gauge", "Face job slots in use", [({}, self.in_flight)]),
+        ]
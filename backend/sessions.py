@@ -0,0 +1,105 @@
+
+import threading
+from datetime import datetime, timedelta
+
+class ActiveSession:
+    """What the exam endpoints need to know about one active session"""
+
+    __slots__ = ("user_id", "exam_id", "start_time", "verified", "last_verified_at")
+
+    def __init__(self, user_id, exam_id, start_time, verified=False, last_verified_at=None):
+        self.user_id = user_id
+        self.exam_id = exam_id
+        self.start_time = start_time
+        self.verified = verified
+        self.last_verified_at = last_verified_at
+
+class SessionRegistry:
+    """Active exam sessions of this process, keyed by session id.
+
+    The database stays the source of truth: every state change is written
+    there first and then mirrored here, so verifying or ending a session
+    does not read it back. Sessions started in another worker process, or
+    before a restart that ``load`` did not cover, are read with
+    ``load_session(session_id)`` on first use; that returns an
+    ActiveSession plus whether the session is still active, or None.
+    Sessions ended elsewhere (another worker, the stale session sweep) are
+    dropped here once they are older than ``max_age`` seconds, since their
+    end is recorded with a conditional update that a stale entry cannot undo.
+    A ``max_age`` of 0 turns the session limit off, and then nothing is pruned.
+    """
+
+    def __init__(self, load_session, max_age, prune_interval=60):
+        self._load_session = load_session
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pruned_at = datetime.utcnow()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def load(self, sessions):
+        """Replace the registry with ``(session_id, ActiveSession)`` pairs"""
+        with self._lock:
+            self._sessions = dict(sessions)
+
+    def get(self, session_id):
+        """Return the ActiveSession for an id, or None if there is no such session.
+
+        Sessions that have ended are returned but not kept.
+        """
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self.hits += 1
+            return session
+
+        self.misses += 1
+        loaded = self._load_session(session_id)
+        if loaded is None:
+            return None
+        session, active = loaded
+        if active:
+            with self._lock:
+                session = self._sessions.setdefault(session_id, session)
+        return session
+
+    def add(self, session_id, session):
+        with self._lock:
+            self._sessions[session_id] = session
+        self._prune()
+
+    def mark_verified(self, session_id, verified_at):
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.verified = True
+            session.last_verified_at = verified_at
+
+    def remove(self, session_ids):
+        with self._lock:
+            for session_id in session_ids:
+                self._sessions.pop(session_id, None)
+
+    def _prune(self):
+        if not self.max_age:
+            return
+        now = datetime.utcnow()
+        if (now - self._pruned_at).total_seconds() < self.prune_interval:
+            return
+        self._pruned_at = now
+        cutoff = now - timedelta(seconds=self.max_age)
+        with self._lock:
+            self._sessions = {
+                session_id: session for session_id, session in self._sessions.items()
+                if session.start_time >= cutoff
+            }
+
+    def metrics(self):
+        return [
+            ("trustface_active_sessions", "gauge", "Active exam sessions held by this worker", [({}, len(self))]),
+            ("trustface_session_lookups_total", "counter", "Exam session lookups, by whether the database was read",
+             [({"result": "hit"}, self.hits), ({"result": "miss"}, self.misses)]),
+        ]
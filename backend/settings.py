@@ -0,0 +1,185 @@
+
+import os
+import secrets
+import time
+from dotenv import load_dotenv
+
+# Load overrides from a .env file if one is present
+load_dotenv()
+
+def env_int(name, default):
+    """Read an integer setting from the environment"""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+def env_float(name, default):
+    """Read a float setting from the environment"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def env_bool(name, default):
+    """Read a boolean setting from the environment"""
+    value = os.getenv(name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def load_secret_key(path):
+    """Return the shared JWT secret, creating it on first use.
+
+    The file is created with O_EXCL so that when several workers start at
+    the same time exactly one of them writes the key and the rest read it.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return key
+            # Another worker created the file but has not written it yet
+            time.sleep(0.1)
+        raise RuntimeError(f"Secret key file {path} is empty")
+
+    key = secrets.token_urlsafe(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+    return key
+
+# Database
+SQLALCHEMY_DATABASE_URL = os.getenv("TRUSTFACE_DATABASE_URL", "sqlite:///./trustface.db")
+
+# Storage directories
+DATA_DIR = os.getenv("TRUSTFACE_DATA_DIR", "backend")
+UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+KNOWN_FACES_DIR = os.path.join(DATA_DIR, "known_faces")
+GALLERY_DIR = os.path.join(DATA_DIR, "gallery")
+
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# Security - every worker must sign tokens with the same key, so it comes
+# from the environment or from a key file shared by all workers
+SECRET_KEY = os.getenv("TRUSTFACE_SECRET_KEY") or load_secret_key(
+    os.getenv("TRUSTFACE_SECRET_KEY_FILE", os.path.join(DATA_DIR, "secret.key"))
+)
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = env_int("TRUSTFACE_TOKEN_EXPIRE_MINUTES", 30)
+
+# Server
+HOST = os.getenv("TRUSTFACE_HOST", "0.0.0.0")
+PORT = env_int("TRUSTFACE_PORT", 8000)
+WORKERS = env_int("TRUSTFACE_WORKERS", 1)
+
+# Face gallery snapshots
+GALLERY_SNAPSHOT_INTERVAL = env_int("TRUSTFACE_GALLERY_SNAPSHOT_INTERVAL", 300)  # seconds
+GALLERY_SNAPSHOT_MAX_DELTA = env_int("TRUSTFACE_GALLERY_SNAPSHOT_MAX_DELTA", 1000)  # changes
+
+# Face gallery search - "exact" scans float64 encodings, "int8" or "float16"
+# scan a compact copy and re-rank the closest GALLERY_RERANK_K exactly.
+# int8 is scanned from the shared snapshot file; float16 is faster
+# but each worker keeps a float32 copy of it (512 bytes per face)
+GALLERY_SEARCH_MODE = os.getenv("TRUSTFACE_GALLERY_SEARCH_MODE", "exact")
+GALLERY_RERANK_K = env_int("TRUSTFACE_GALLERY_RERANK_K", 32)
+
+# Gallery shards - comma-separated Unix socket paths or host:port addresses
+# of shard processes started with shards.py. When set, searches of whole
+# galleries are split across them and run on the local gallery only while
+# a shard is down or being loaded. Every worker must list the same shards
+GALLERY_SHARDS = [address.strip() for address in os.getenv("TRUSTFACE_GALLERY_SHARDS", "").split(",") if address.strip()]
+GALLERY_SHARD_TIMEOUT = env_float("TRUSTFACE_GALLERY_SHARD_TIMEOUT", 2.0)  # seconds per search
+GALLERY_SHARD_CHECK_INTERVAL = env_float("TRUSTFACE_GALLERY_SHARD_CHECK_INTERVAL", 5.0)  # seconds
+
+# Tenants - institutions sharing the deployment. Requests that name no
+# tenant belong to DEFAULT_TENANT. A worker opens a tenant's galleries on
+# its first face request and closes them after TENANT_GALLERY_IDLE seconds
+# without one (0 keeps them open)
+DEFAULT_TENANT = os.getenv("TRUSTFACE_DEFAULT_TENANT", "default")
+TENANT_GALLERY_IDLE = env_int("TRUSTFACE_TENANT_GALLERY_IDLE", 1800)  # seconds
+
+# Exam rosters - how long a worker trusts its cached copy of a roster
+ROSTER_CACHE_TTL = env_int("TRUSTFACE_ROSTER_CACHE_TTL", 60)  # seconds
+
+# Duplicate frame submissions - how long results are reused and how many are kept
+RESULT_CACHE_TTL = env_float("TRUSTFACE_RESULT_CACHE_TTL", 10.0)  # seconds
+RESULT_CACHE_SIZE = env_int("TRUSTFACE_RESULT_CACHE_SIZE", 1024)
+
+# Face matching - the largest encoding distance accepted as the same person.
+# Measure the trade-off between false accepts and false rejects on your own
+# photos with evaluate_pipeline.py
+MATCH_THRESHOLD = env_float("TRUSTFACE_MATCH_THRESHOLD", 0.6)
+
+# Face pipeline admission control - concurrent jobs and how long each class
+# of request may wait for a slot before it is shed with a 503
+FACE_MAX_IN_FLIGHT = env_int("TRUSTFACE_FACE_MAX_IN_FLIGHT", os.cpu_count() or 1)
+LATENCY_BUDGETS = {
+    "verification": env_float("TRUSTFACE_LATENCY_BUDGET_VERIFICATION", 10.0),  # seconds
+    "login": env_float("TRUSTFACE_LATENCY_BUDGET_LOGIN", 5.0),
+    "enrolment": env_float("TRUSTFACE_LATENCY_BUDGET_ENROLMENT", 5.0),
+}
+
+# Graceful degradation - while more face jobs than DEGRADE_QUEUE_HIGH are
+# waiting, or they wait DEGRADE_WAIT_HIGH seconds on average, the pipeline
+# steps down to cheaper settings, one level every DEGRADE_STEP_INTERVAL
+# seconds, and back up once the queue is down to the low marks.
+# DEGRADE_MAX_LEVEL of 0 disables it.
+DEGRADE_MAX_LEVEL = env_int("TRUSTFACE_DEGRADE_MAX_LEVEL", 4)
+DEGRADE_QUEUE_HIGH = env_int("TRUSTFACE_DEGRADE_QUEUE_HIGH", 2 * FACE_MAX_IN_FLIGHT)
+DEGRADE_QUEUE_LOW = env_int("TRUSTFACE_DEGRADE_QUEUE_LOW", 0)
+DEGRADE_WAIT_HIGH = env_float("TRUSTFACE_DEGRADE_WAIT_HIGH", 1.0)  # seconds
+DEGRADE_WAIT_LOW = env_float("TRUSTFACE_DEGRADE_WAIT_LOW", 0.2)
+DEGRADE_STEP_INTERVAL = env_float("TRUSTFACE_DEGRADE_STEP_INTERVAL", 5.0)
+DEGRADE_DETECT_SIDE = env_int("TRUSTFACE_DEGRADE_DETECT_SIDE", 480)  # pixels
+
+# Image decoding - uploads are decoded at most this large (longest side), and
+# images with more pixels than the budget are rejected before decoding
+IMAGE_TARGET_SIDE = env_int("TRUSTFACE_IMAGE_TARGET_SIDE", 1024)  # pixels
+IMAGE_MAX_PIXELS = env_int("TRUSTFACE_IMAGE_MAX_PIXELS", 50_000_000)
+MONITOR_IMAGE_TARGET_SIDE = env_int("TRUSTFACE_MONITOR_IMAGE_TARGET_SIDE", 2048)  # room cameras, smaller faces
+
+# Face pipeline worker processes, forked after the face models are loaded so
+# they share one copy. 0 runs the pipeline in threads of the app process
+# (always the case on platforms without fork). A worker is replaced after
+# the given number of jobs or once its resident memory passes the limit.
+FACE_WORKERS = env_int("TRUSTFACE_FACE_WORKERS", 0)
+FACE_WORKER_MAX_TASKS = env_int("TRUSTFACE_FACE_WORKER_MAX_TASKS", 1000)
+FACE_WORKER_MAX_RSS_MB = env_int("TRUSTFACE_FACE_WORKER_MAX_RSS_MB", 1024)  # 0 = no limit
+
+# Face encoder profile used for new encodings (see ENCODING_PROFILES in
+# face_pipeline.py). Stored encodings of other versions keep matching until
+# reencode.py has migrated them.
+ENCODING_VERSION = os.getenv("TRUSTFACE_ENCODING_VERSION", "v1")
+
+# Background sweeper - closes exam sessions left open longer than
+# SESSION_MAX_DURATION and deletes uploads older than UPLOAD_RETENTION
+# (0 disables either), at most UPLOAD_DELETE_RATE files per second
+SWEEP_INTERVAL = env_int("TRUSTFACE_SWEEP_INTERVAL", 600)  # seconds
+SWEEP_BATCH_SIZE = env_int("TRUSTFACE_SWEEP_BATCH_SIZE", 500)  # rows or files per batch
+SESSION_MAX_DURATION = env_int("TRUSTFACE_SESSION_MAX_DURATION", 6 * 3600)  # seconds
+UPLOAD_RETENTION = env_int("TRUSTFACE_UPLOAD_RETENTION", 30 * 86400)  # seconds
+UPLOAD_DELETE_RATE = env_float("TRUSTFACE_UPLOAD_DELETE_RATE", 200.0)  # files per second
+
+# Image store - enrolment face crops and verification frames are re-encoded
+# as JPEG off the request path and stored by content hash under
+# IMAGE_STORE_DIR; frames are kept for UPLOAD_RETENTION
+IMAGE_STORE_DIR = os.getenv("TRUSTFACE_IMAGE_STORE_DIR", os.path.join(DATA_DIR, "images"))
+FACE_IMAGE_QUALITY = env_int("TRUSTFACE_FACE_IMAGE_QUALITY", 90)  # JPEG quality
+FACE_IMAGE_MAX_SIDE = env_int("TRUSTFACE_FACE_IMAGE_MAX_SIDE", 0)  # pixels, 0 keeps the crop size
+FRAME_IMAGE_QUALITY = env_int("TRUSTFACE_FRAME_IMAGE_QUALITY", 75)
+FRAME_IMAGE_MAX_SIDE = env_int("TRUSTFACE_FRAME_IMAGE_MAX_SIDE", 640)
+IMAGE_WRITE_QUEUE = env_int("TRUSTFACE_IMAGE_WRITE_QUEUE", 1000)  # images waiting per store
+
+# Continuous verification - a frame that differs from the session's last
+# verified frame by at most VERIFY_GATE_MAX_DIFF grey levels (mean absolute
+# difference of 32x32 thumbnails) reuses its result for up to
+# VERIFY_GATE_MAX_AGE seconds; 0 always runs the full pipeline
+VERIFY_GATE_MAX_DIFF = env_float("TRUSTFACE_VERIFY_GATE_MAX_DIFF", 4.0)
+VERIFY_GATE_MAX_AGE = env_float("TRUSTFACE_VERIFY_GATE_MAX_AGE", 30.0)  # seconds
+VERIFY_GATE_SESSIONS = env_int("TRUSTFACE_VERIFY_GATE_SESSIONS", 10000)
+
+# Request tracing - fraction of requests traced (0 disables), written as
+# OpenTelemetry JSON lines to rotating files in TRACE_DIR
+TRACE_SAMPLE_RATE = env_float("TRUSTFACE_TRACE_SAMPLE_RATE", 0.0)
+TRACE_DIR = os.getenv("TRUSTFACE_TRACE_DIR", os.path.join(DATA_DIR, "traces"))
+TRACE_MAX_BYTES = env_int("TRUSTFACE_TRACE_MAX_BYTES", 10_000_000)  # per file
+TRACE_BACKUPS = env_int("TRUSTFACE_TRACE_BACKUPS", 5)
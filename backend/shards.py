@@ -0,0 +1,586 @@
+
+import os
+import stat
+import time
+import zlib
+import socket
+import hashlib
+import argparse
+import threading
+import numpy as np
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Connection, AuthenticationError, answer_challenge, deliver_challenge
+from gallery import ENCODING_SIZE, GallerySnapshot, GalleryState, nearest_candidates
+from tracing import traced
+
+# Users hash to one of BUCKETS buckets, and buckets are what move between shards
+BUCKETS = 4096
+LOAD_CHUNK_ROWS = 20000
+LOAD_TIMEOUT = 300  # seconds per request while a slice is loaded or rebalanced
+
+def parse_address(address):
+    """Return ``(address, family)`` for multiprocessing.connection: ``host:port``
+    is TCP, anything else a Unix socket path"""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return (host, int(port)), "AF_INET"
+    return address, "AF_UNIX"
+
+class ShardLayout:
+    """Which shard owns each user.
+
+    Every bucket goes to the shard with the highest rendezvous hash of
+    (shard address, bucket). Adding a shard therefore only moves the
+    buckets the new shard wins, about 1/N of the users, all of them to the
+    new shard; removing one only moves that shard's buckets.
+    """
+
+    def __init__(self, addresses):
+        self.addresses = tuple(addresses)
+        scores = np.array([
+            [
+                int.from_bytes(hashlib.blake2b(f"{address}/{bucket}".encode(), digest_size=8).digest(), "big")
+                for bucket in range(BUCKETS)
+            ]
+            for address in self.addresses
+        ], dtype=np.uint64).reshape(len(self.addresses), BUCKETS)
+        self.bucket_owners = np.argmax(scores, axis=0) if self.addresses else np.zeros(BUCKETS, dtype=int)
+
+    def owners(self, user_ids):
+        """Return the index of the owning shard of each user id"""
+        buckets = np.fromiter(
+            (zlib.crc32(str(user_id).encode()) % BUCKETS for user_id in user_ids), dtype=np.int64, count=len(user_ids),
+        )
+        return self.bucket_owners[buckets]
+
+def sorted_snapshot(seq, user_ids, encodings):
+    """In-memory GallerySnapshot, rows sorted by user id like the ones on disk"""
+    order = np.argsort(user_ids, kind="stable")
+    return GallerySnapshot(seq, np.ascontiguousarray(encodings[order]), user_ids[order])
+
+class ShardSlice:
+    """The users of one gallery a shard owns under ``layout``, an
+    ``(addresses, own index)`` pair. Replaced whole on every change, so a
+    search holding one sees a consistent state."""
+
+    __slots__ = ("state", "layout")
+
+    def __init__(self, state, layout):
+        self.state = state
+        self.layout = layout
+
+class ShardServer:
+    """Gallery slices held by one shard process, keyed by gallery name.
+
+    A slice starts from a full load sent by an API worker and then takes
+    the changes workers apply on top of it as a GalleryState delta, folded
+    into a new in-memory snapshot once it holds more than ``max_delta``
+    users. Every change carries its gallery sequence number and only
+    replaces an older one, so workers may send the same changes in any
+    order. Searches run in the connection threads without locking.
+    """
+
+    OPERATIONS = ("ping", "state", "match", "nearest", "load", "apply", "retain")
+
+    def __init__(self, max_delta=1000):
+        self.max_delta = max_delta
+        self._lock = threading.Lock()
+        self.slices = {}
+        # load id -> (started, name, user id chunks, encoding chunks)
+        self._loads = {}
+        self._layouts = {}
+
+    def handle(self, message):
+        operation, *args = message
+        if operation not in self.OPERATIONS:
+            raise ValueError(f"Unknown shard operation {operation!r}")
+        return getattr(self, operation)(*args)
+
+    def _layout(self, addresses):
+        layout = self._layouts.get(addresses)
+        if layout is None:
+            layout = self._layouts[addresses] = ShardLayout(addresses)
+        return layout
+
+    def _current(self, name, seq, layout):
+        """Return the slice of a gallery if it has every change up to ``seq``
+        and the given layout, else None"""
+        piece = self.slices.get(name)
+        if piece is None or piece.state.applied < seq or piece.layout != layout:
+            return None
+        return piece
+
+    def ping(self):
+        return ("ok", {name: (piece.state.applied, len(piece.state)) for name, piece in list(self.slices.items())})
+
+    def state(self, name):
+        piece = self.slices.get(name)
+        return ("ok", -1, None) if piece is None else ("ok", piece.state.applied, piece.layout)
+
+    def match(self, name, seq, layout, probes):
+        piece = self._current(name, seq, layout)
+        if piece is None:
+            return ("stale",)
+        return ("ok", piece.state.match_many(np.atleast_2d(probes)))
+
+    def nearest(self, name, seq, layout, probe, k):
+        piece = self._current(name, seq, layout)
+        if piece is None:
+            return ("stale",)
+        return ("ok", piece.state.nearest(probe, k))
+
+    def load(self, name, load_id, seq, layout, user_ids, encodings, final):
+        """Collect one chunk of a full load; the last one replaces the slice"""
+        with self._lock:
+            now = time.monotonic()
+            # Loads abandoned by a worker that went away
+            for stale_id in [key for key, (started, *_) in self._loads.items() if now - started > LOAD_TIMEOUT * 2]:
+                del self._loads[stale_id]
+            _, _, id_chunks, encoding_chunks = self._loads.setdefault(load_id, (now, name, [], []))
+            id_chunks.append(np.asarray(user_ids, dtype=str))
+            encoding_chunks.append(np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE))
+            if not final:
+                return ("ok",)
+            del self._loads[load_id]
+
+        snapshot = sorted_snapshot(seq, np.concatenate(id_chunks), np.concatenate(encoding_chunks))
+        with self._lock:
+            changes = {}
+            old = self.slices.get(name)
+            if old is not None and old.state.changes:
+                # Changes newer than the load, sent by workers further ahead
+                newer = {user_id: change for user_id, change in old.state.changes.items() if change[0] > seq}
+                owners = self._layout(layout[0]).owners(list(newer))
+                changes = {user_id: newer[user_id] for user_id, owner in zip(newer, owners) if owner == layout[1]}
+            self.slices[name] = ShardSlice(GalleryState(snapshot, changes, seq), layout)
+        return ("ok",)
+
+    def apply(self, name, from_seq, seq, layout, changes):
+        """Apply ``(user_id, seq, encoding or None)`` changes made after
+        ``from_seq``; refused if the slice has not seen every change up to it"""
+        with self._lock:
+            piece = self.slices.get(name)
+            if piece is None or piece.state.applied < from_seq or piece.layout != layout:
+                return ("stale",)
+            state = piece.state
+            merged = dict(state.changes)
+            for user_id, change_seq, encoding in changes:
+                current = merged[user_id][0] if user_id in merged else state.snapshot.hwm
+                if change_seq > current:
+                    merged[user_id] = (change_seq, encoding)
+            state = GalleryState(state.snapshot, merged, max(state.applied, seq))
+            # Folding changes newer than ``applied`` would hide the older
+            # changes of other users still to come
+            if len(merged) > self.max_delta and max(change[0] for change in merged.values()) <= state.applied:
+                state = GalleryState(sorted_snapshot(state.applied, *state.merged()), {}, state.applied)
+            self.slices[name] = ShardSlice(state, layout)
+        return ("ok",)
+
+    def retain(self, name, layout):
+        """Drop the users this shard no longer owns under a new layout"""
+        with self._lock:
+            piece = self.slices.get(name)
+            if piece is None:
+                return ("ok", -1, None)
+            owners = self._layout(layout[0])
+            state = piece.state
+            keep = owners.owners(state.snapshot.user_ids) == layout[1]
+            snapshot = GallerySnapshot(state.snapshot.hwm, state.snapshot.encodings[keep], state.snapshot.user_ids[keep])
+            changed = list(state.changes)
+            changes = {
+                user_id: state.changes[user_id]
+                for user_id, owner in zip(changed, owners.owners(changed)) if owner == layout[1]
+            }
+            self.slices[name] = ShardSlice(GalleryState(snapshot, changes, state.applied), layout)
+            print(f"Shard {layout[1]} of {len(layout[0])} keeps {int(keep.sum())} of {len(keep)} faces of {name}")
+            return ("ok", state.applied, layout)
+
+    def serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = self.handle(message)
+                except Exception as e:
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                try:
+                    conn.send(reply)
+                except OSError:
+                    # The worker gave up on this reply and closed the connection
+                    return
+
+def serve(address, authkey, max_delta=1000):
+    """Run one shard, listening on ``address`` until the process is stopped"""
+    location, family = parse_address(address)
+    if family == "AF_UNIX":
+        os.makedirs(os.path.dirname(os.path.abspath(location)), exist_ok=True)
+        # Socket left behind by a shard that did not shut down cleanly
+        if os.path.exists(location) and stat.S_ISSOCK(os.stat(location).st_mode):
+            os.remove(location)
+    listener = Listener(location, family, authkey=authkey)
+    server = ShardServer(max_delta)
+    print(f"Gallery shard listening on {address}")
+    while True:
+        try:
+            conn = listener.accept()
+        except (AuthenticationError, OSError, EOFError) as e:
+            print(f"Rejected a connection to gallery shard {address}: {e}")
+            continue
+        threading.Thread(target=server.serve_connection, args=(conn,), name="gallery-shard-connection", daemon=True).start()
+
+class ShardUnavailable(Exception):
+    """Raised when a shard cannot be reached, does not answer in time or fails"""
+
+class ShardClient:
+    """One worker's connections to one shard, kept open between requests.
+
+    A connection with a request in flight is only reused once its reply has
+    been read; one that fails or times out is closed and the shard marked
+    down until the next health check reaches it.
+    """
+
+    def __init__(self, address, authkey, timeout):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.healthy = False
+        self.faces = 0
+        self.requests = {"ok": 0, "stale": 0, "failed": 0}
+        self.loads = 0
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _connect(self):
+        location, family = parse_address(self.address)
+        sock = socket.socket(getattr(socket, family))
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(location)
+            sock.settimeout(None)
+        except OSError:
+            sock.close()
+            raise
+        conn = Connection(sock.detach())
+        try:
+            # The same handshake multiprocessing.connection.Client performs
+            answer_challenge(conn, self.authkey)
+            deliver_challenge(conn, self.authkey)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def send(self, message):
+        """Send a request and return the connection its reply will arrive on"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        try:
+            if conn is None:
+                conn = self._connect()
+            conn.send(message)
+        except Exception as e:
+            if conn is not None:
+                conn.close()
+            raise self._failed(e)
+        return conn
+
+    def receive(self, conn, timeout=None):
+        """Read the reply to a request sent with ``send``"""
+        timeout = timeout or self.timeout
+        try:
+            if not conn.poll(timeout):
+                raise TimeoutError(f"no answer within {timeout}s")
+            reply = conn.recv()
+        except Exception as e:
+            conn.close()
+            raise self._failed(e)
+        with self._lock:
+            self._idle.append(conn)
+        if reply[0] == "error":
+            self.requests["failed"] += 1
+            raise ShardUnavailable(f"Gallery shard {self.address} failed: {reply[1]}")
+        self.requests["stale" if reply[0] == "stale" else "ok"] += 1
+        return reply
+
+    def request(self, message, timeout=None):
+        return self.receive(self.send(message), timeout)
+
+    def _failed(self, error):
+        self.requests["failed"] += 1
+        if self.healthy:
+            self.healthy = False
+            print(f"Gallery shard {self.address} is down: {error}")
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        return ShardUnavailable(f"Gallery shard {self.address} is unavailable: {error}")
+
+    def check(self):
+        """Ping the shard and record whether it is up and how many faces it holds"""
+        try:
+            galleries = self.request(("ping",))[1]
+        except ShardUnavailable:
+            return False
+        self.faces = sum(faces for _, faces in galleries.values())
+        if not self.healthy:
+            self.healthy = True
+            print(f"Gallery shard {self.address} is up, holding {self.faces} faces")
+        return True
+
+class ShardedGallery:
+    """Searches of one FaceGallery, scattered over the shards holding its
+    slices and gathered into the same results the gallery would return.
+
+    A shard that is behind the local gallery is sent the changes it lacks
+    before it answers. One that needs a full load, because it restarted,
+    fell behind a snapshot or belongs to another layout, is loaded by the
+    background check; until then, and whenever any shard is down, searches
+    run on the local gallery, so results are never missing faces.
+    """
+
+    def __init__(self, shards, name, gallery):
+        self.shards = shards
+        self.name = name
+        self.gallery = gallery
+        self._sync_locks = [threading.Lock() for _ in shards.clients]
+
+    def __len__(self):
+        return len(self.gallery)
+
+    def match(self, encoding):
+        return self.match_many(np.atleast_2d(encoding))[0]
+
+    @traced("gallery.match")
+    def match_many(self, encodings):
+        probes = np.atleast_2d(np.asarray(encodings, dtype=np.float64))
+        replies = self._scatter("match", probes)
+        if replies is None:
+            return self.gallery.match_many(probes)
+
+        matches = [(None, None)] * len(probes)
+        for shard_matches in replies:
+            for probe, (user_id, distance) in enumerate(shard_matches):
+                if user_id is not None and (matches[probe][0] is None or distance < matches[probe][1]):
+                    matches[probe] = (user_id, distance)
+        return matches
+
+    @traced("gallery.nearest")
+    def nearest(self, encoding, k):
+        probe = np.asarray(encoding, dtype=np.float64).ravel()
+        replies = self._scatter("nearest", probe, k)
+        if replies is None:
+            return self.gallery.nearest(probe, k)
+
+        # A user can briefly be on two shards while they rebalance
+        best = {}
+        for candidates in replies:
+            for user_id, distance in candidates:
+                if user_id not in best or distance < best[user_id]:
+                    best[user_id] = distance
+        return nearest_candidates(best.items(), k)
+
+    def _scatter(self, operation, *args):
+        """Send a search to every shard at once and gather the answers, or
+        return None if they cannot all answer"""
+        shards = self.shards
+        if not all(client.healthy for client in shards.clients):
+            shards.fallbacks += 1
+            return None
+
+        seq = self.gallery.latest_seq
+        addresses = shards.layout.addresses
+        unread = []
+        replies = []
+        try:
+            for index, client in enumerate(shards.clients):
+                unread.append(client.send((operation, self.name, seq, (addresses, index), *args)))
+            for index, client in enumerate(shards.clients):
+                reply = client.receive(unread[index])
+                unread[index] = None
+                if reply[0] == "stale":
+                    if not self._sync(index, client, allow_load=False):
+                        shards.wake()
+                        raise ShardUnavailable(f"Gallery shard {client.address} is waiting for {self.name} to be loaded")
+                    reply = client.request((operation, self.name, seq, (addresses, index), *args))
+                    if reply[0] == "stale":
+                        raise ShardUnavailable(f"Gallery shard {client.address} could not catch up with {self.name}")
+                replies.append(reply[1])
+        except ShardUnavailable:
+            # Replies still on their way would be read by the next request
+            for conn in unread:
+                if conn is not None:
+                    conn.close()
+            shards.fallbacks += 1
+            return None
+        return replies
+
+    def sync(self):
+        """Bring every reachable shard up to date, loading it if needed"""
+        for index, client in enumerate(self.shards.clients):
+            if client.healthy:
+                self._sync(index, client)
+
+    def _sync(self, index, client, allow_load=True):
+        """Bring one shard's slice up to date with the local gallery.
+
+        Returns False if that needs a full load and ``allow_load`` is False.
+        """
+        layout = (self.shards.layout.addresses, index)
+        with self._sync_locks[index]:
+            _, applied, shard_layout = client.request(("state", self.name))
+            if shard_layout is not None and shard_layout != layout and set(shard_layout[0]) <= set(layout[0]):
+                # Shards were only added, so this one keeps what it still owns
+                _, applied, shard_layout = client.request(("retain", self.name, layout), LOAD_TIMEOUT)
+
+            if shard_layout == layout:
+                seq, changes = self.gallery.changes_after(applied)
+                if changes is not None:
+                    if seq > applied:
+                        owners = self.shards.layout.owners([change[0] for change in changes])
+                        owned = [change for change, owner in zip(changes, owners) if owner == index]
+                        client.request(("apply", self.name, applied, seq, layout, owned))
+                    return True
+
+            if not allow_load:
+                return False
+            self._load(index, client, layout)
+            return True
+
+    def _load(self, index, client, layout):
+        started = time.monotonic()
+        load_id = os.urandom(8).hex()
+        seq, chunks = self.gallery.entries(LOAD_CHUNK_ROWS)
+        loaded = 0
+        pending = (np.empty(0, dtype="U1"), np.empty((0, ENCODING_SIZE)))
+        for number, (user_ids, encodings) in enumerate(chunks):
+            if number:
+                client.request(("load", self.name, load_id, seq, layout, *pending, False), LOAD_TIMEOUT)
+            owned = self.shards.layout.owners(user_ids) == index
+            pending = (user_ids[owned], encodings[owned])
+            loaded += int(owned.sum())
+        client.request(("load", self.name, load_id, seq, layout, *pending, True), LOAD_TIMEOUT)
+        client.loads += 1
+        print(f"Loaded {loaded} faces of {self.name} into gallery shard {client.address} in {time.monotonic() - started:.1f}s")
+
+    def close(self):
+        self.shards.release(self)
+
+class GalleryShards:
+    """Scatter-gather face search over shard processes, each holding the
+    slice of every gallery that ``ShardLayout`` assigns to it, so no single
+    process has to hold or scan a whole gallery.
+
+    Shards are addressed by Unix socket path or ``host:port`` and
+    authenticated with ``authkey``. A background thread pings them every
+    ``check_interval`` seconds and brings the slices of the galleries open
+    in this worker up to date, loading or rebalancing them when the layout
+    has changed.
+    """
+
+    def __init__(self, addresses, authkey, timeout=2.0, check_interval=5.0):
+        self.layout = ShardLayout(addresses)
+        self.clients = [ShardClient(address, authkey, timeout) for address in self.layout.addresses]
+        self.check_interval = check_interval
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self._galleries = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def gallery(self, name, gallery):
+        """Return a ShardedGallery for searching ``gallery``, kept in sync until closed"""
+        sharded = ShardedGallery(self, name, gallery)
+        with self._lock:
+            self._galleries[name] = sharded
+        self.wake()
+        return sharded
+
+    def release(self, sharded):
+        with self._lock:
+            if self._galleries.get(sharded.name) is sharded:
+                del self._galleries[sharded.name]
+
+    def check(self):
+        for client in self.clients:
+            client.check()
+        with self._lock:
+            galleries = list(self._galleries.values())
+        for sharded in galleries:
+            try:
+                sharded.sync()
+            except ShardUnavailable as e:
+                print(f"Error syncing {sharded.name} to the gallery shards: {e}")
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"Error checking the gallery shards: {e}")
+                self._wake.wait(self.check_interval)
+                self._wake.clear()
+
+        self._thread = threading.Thread(target=run, name="gallery-shard-check", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+
+    def metrics(self):
+        def per_shard(value):
+            return [({"shard": client.address}, value(client)) for client in self.clients]
+
+        return [
+            ("trustface_gallery_shard_up", "gauge", "Whether each gallery shard answered its last health check",
+             per_shard(lambda client: int(client.healthy))),
+            ("trustface_gallery_shard_faces", "gauge", "Faces held by each gallery shard at its last health check",
+             per_shard(lambda client: client.faces)),
+            ("trustface_gallery_shard_requests_total", "counter", "Requests to each gallery shard, by result",
+             [({"shard": client.address, "result": result}, count) for client in self.clients for result, count in client.requests.items()]),
+            ("trustface_gallery_shard_loads_total", "counter", "Full gallery slice loads sent to each shard",
+             per_shard(lambda client: client.loads)),
+            ("trustface_gallery_shard_fallbacks_total", "counter", "Searches run on the local gallery because a shard could not answer",
+             [({}, self.fallbacks)]),
+        ]
+
+def main():
+    from settings import SECRET_KEY, GALLERY_SNAPSHOT_MAX_DELTA
+
+    parser = argparse.ArgumentParser(description="Run TrustFace gallery shards, one process per address")
+    parser.add_argument("addresses", nargs="+", help="Unix socket path or host:port to listen on, as listed in TRUSTFACE_GALLERY_SHARDS")
+    parser.add_argument("--max-delta", type=int, default=GALLERY_SNAPSHOT_MAX_DELTA,
+                        help="changed faces a shard keeps apart before folding them into its slice")
+    args = parser.parse_args()
+
+    authkey = SECRET_KEY.encode()
+    if len(args.addresses) == 1:
+        serve(args.addresses[0], authkey, args.max_delta)
+        return
+
+    processes = [
+        Process(target=serve, args=(address, authkey, args.max_delta), name=f"gallery-shard-{index}")
+        for index, address in enumerate(args.addresses)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+def content_key(data, *scope):
+    """Build a cache key from the hash of a payload and the scope it belongs to.
+
+    The scope must include everything the result depends on besides the
+    payload itself (user, session, exam...) so that results never leak from
+    one scope to another.
+    """
+    return (hashlib.sha256(data).hexdigest(),) + scope
+
+class SingleFlight:
+    """Coalesces identical concurrent computations and remembers recent results.
+
+    The first caller for a key starts the computation as its own task;
+    callers arriving while it runs await the same task instead of starting
+    another. Successful results are kept for ``ttl`` seconds in a cache
+    bounded to ``max_entries`` keys (least recently used evicted first).
+    """
+
+    def __init__(self, ttl=10.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inflight = {}
+        self._results = OrderedDict()
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    async def run(self, key, compute):
+        """Return the result of ``await compute()`` for ``key``"""
+        cached = self._results.get(key)
+        if cached is not None:
+            expires, result = cached
+            if expires > time.monotonic():
+                self._results.move_to_end(key)
+                self.hits += 1
+                return result
+            del self._results[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            # A separate task, so that a client disconnecting does not cancel
+            # the computation for the other callers waiting on it
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._results[key] = (time.monotonic() + self.ttl, task.result())
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def metrics(self):
+        return [
+            ("trustface_result_cache_hits_total", "counter", "Frames answered from the result cache", [({}, self.hits)]),
+            ("trustface_result_coalesced_total", "counter", "Frames that joined an identical in-flight computation", [({}, self.coalesced)]),
+            ("trustface_result_misses_total", "counter", "Frames that started a computation", [({}, self.misses)]),
+            ("trustface_result_cache_entries", "gauge", "Results held in the cache", [({}, len(self._results))]),
+        ]
@@ -0,0 +1,112 @@
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+def scan_files(directory, recursive=False):
+    """Yield the file entries of a directory as a stream, and of its
+    subdirectories too if ``recursive``"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    yield entry
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    yield from scan_files(entry.path, recursive)
+            except FileNotFoundError:
+                continue
+
+def delete_old_files(directory, max_age, batch_size=500, rate=200, now=None, recursive=False):
+    """Delete files in ``directory`` not modified for ``max_age`` seconds.
+
+    The directory is scanned as a stream rather than listed up front, and
+    deletions are paced to at most ``rate`` files per second, a batch at a
+    time, so a large backlog does not saturate the disk. Returns
+    ``(files deleted, bytes reclaimed)``.
+    """
+    if not os.path.isdir(directory):
+        return 0, 0
+
+    cutoff = (now or time.time()) - max_age
+    files = reclaimed = 0
+    batch_started = time.monotonic()
+    in_batch = 0
+    for entry in scan_files(directory, recursive):
+        try:
+            info = entry.stat()
+            if info.st_mtime >= cutoff:
+                continue
+            os.remove(entry.path)
+        except FileNotFoundError:
+            # Removed by another worker's sweep
+            continue
+        files += 1
+        reclaimed += info.st_size
+        in_batch += 1
+
+        if in_batch >= batch_size:
+            if rate:
+                time.sleep(max(0, in_batch / rate - (time.monotonic() - batch_started)))
+            batch_started = time.monotonic()
+            in_batch = 0
+    return files, reclaimed
+
+class Sweeper:
+    """Runs cleanup tasks in a background thread every ``interval`` seconds.
+
+    Each task is a callable returning a dict of counters (rows, files,
+    bytes...) which are logged and added to running totals.
+    """
+
+    def __init__(self, tasks, interval, lock=None):
+        self.tasks = tasks
+        self.interval = interval
+        # Shared between worker processes so that only one sweeps at a time
+        self._lock = lock or nullcontext()
+        self.totals = {}
+        self.runs = 0
+        self.last_run = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Run every task now and return what each one reclaimed"""
+        report = {}
+        with self._lock:
+            for name, task in self.tasks:
+                try:
+                    report[name] = task()
+                except Exception as e:
+                    print(f"Error in sweeper task {name}: {e}")
+                    continue
+                for counter, value in report[name].items():
+                    self.totals[(name, counter)] = self.totals.get((name, counter), 0) + value
+
+        self.runs += 1
+        self.last_run = time.time()
+        reclaimed = {name: counters for name, counters in report.items() if any(counters.values())}
+        if reclaimed:
+            print(f"Sweeper reclaimed: {reclaimed}")
+        return report
+
+    def start(self):
+        def run():
+            while not self._stop.wait(self.interval):
+                self.run_once()
+
+        self._thread = threading.Thread(target=run, name="sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def metrics(self):
+        return [
+            ("trustface_sweeper_reclaimed_total", "counter", "Rows, files and bytes reclaimed by the sweeper",
+             [({"task": name, "unit": counter}, value) for (name, counter), value in sorted(self.totals.items())]),
+            ("trustface_sweeper_runs_total", "counter", "Sweeper runs", [({}, self.runs)]),
+            ("trustface_sweeper_last_run_timestamp_seconds", "gauge", "Time of the last sweeper run", [({}, self.last_run)]),
+        ]
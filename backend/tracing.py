@@ -0,0 +1,247 @@
+
+import os
+import json
+import time
+import random
+import threading
+import functools
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Span of the code currently running; asyncio tasks and copied contexts
+# (executor jobs, see FaceWorkScheduler.run) inherit it
+_current_span = contextvars.ContextVar("trustface_span", default=None)
+
+# OTLP JSON enums
+SPAN_KINDS = {"INTERNAL": 1, "SERVER": 2, "CLIENT": 3}
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+class NoopSpan:
+    """Stands in for a span when the trace is not sampled"""
+
+    recording = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+    def end(self):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+class Span:
+    recording = True
+
+    def __init__(self, tracer, name, trace_id, parent_id, kind, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.status = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exc):
+        self.status = (STATUS_ERROR, f"{type(exc).__name__}: {exc}")
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer.finish(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+            "status": {"code": self.status[0], "message": self.status[1]} if self.status else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+def otlp_attributes(attributes):
+    """Convert a dict to the OTLP JSON key/typed-value list"""
+    converted = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        converted.append({"key": key, "value": typed})
+    return converted
+
+class JsonlExporter:
+    """Appends spans to a local file, one OTLP JSON export request per line,
+    rotating it at ``max_bytes`` and keeping ``backups`` old files.
+
+    The lines can be read by the OpenTelemetry Collector's otlpjsonfile
+    receiver. Each process writes its own file, so rotation never races.
+    """
+
+    def __init__(self, directory, max_bytes=10_000_000, backups=5, service_name="trustface"):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"spans-{os.getpid()}.jsonl")
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.resource = {"attributes": otlp_attributes({"service.name": service_name, "process.pid": os.getpid()})}
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        line = json.dumps({
+            "resourceSpans": [{
+                "resource": self.resource,
+                "scopeSpans": [{"scope": {"name": "trustface"}, "spans": [span.to_otlp() for span in spans]}],
+            }]
+        }, separators=(",", ":")) + "\n"
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+class Tracer:
+    """Creates spans and hands each finished trace to the exporter.
+
+    Whether a trace is recorded is decided once, when its root span starts,
+    with probability ``sample_rate``. Spans of unsampled traces, and spans
+    started outside any trace, are a shared no-op object. A child that
+    ends after its root (a background task, an executor job that outlived
+    the request) is exported on its own; the collector joins it to the
+    rest of the trace by its trace id.
+    """
+
+    def __init__(self, exporter=None, sample_rate=0.0, remember_exported=10_000):
+        self.exporter = exporter
+        self.sample_rate = sample_rate if exporter else 0.0
+        self.remember_exported = remember_exported
+        self._lock = threading.Lock()
+        # trace_id -> finished spans waiting for their root
+        self._pending = {}
+        # trace ids whose root already ended, oldest first
+        self._exported = OrderedDict()
+
+    def start_root(self, name, kind="INTERNAL", **attributes):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return NOOP_SPAN
+        return Span(self, name, os.urandom(16).hex(), None, kind, attributes)
+
+    def start_span(self, name, kind="INTERNAL", **attributes):
+        """Start a child of the current span, without making it current"""
+        parent = _current_span.get()
+        if parent is None or not parent.recording:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, kind, attributes)
+
+    def finish(self, span):
+        with self._lock:
+            if span.trace_id in self._exported:
+                spans = [span]
+            else:
+                spans = self._pending.setdefault(span.trace_id, [])
+                spans.append(span)
+                if span.parent_id is not None:
+                    return
+                del self._pending[span.trace_id]
+                self._exported[span.trace_id] = None
+                if len(self._exported) > self.remember_exported:
+                    self._exported.popitem(last=False)
+        try:
+            self.exporter.export(spans)
+        except OSError as e:
+            print(f"Error exporting spans: {e}")
+
+tracer = Tracer()
+
+def configure(directory, sample_rate, max_bytes=10_000_000, backups=5):
+    """Record ``sample_rate`` of the traces to rotating files in ``directory``"""
+    global tracer
+    tracer = Tracer(JsonlExporter(directory, max_bytes, backups) if sample_rate else None, sample_rate)
+
+@contextmanager
+def _activate(span):
+    token = _current_span.set(span) if span.recording else None
+    try:
+        yield span
+    except BaseException as e:
+        span.record_exception(e)
+        raise
+    finally:
+        if token is not None:
+            _current_span.reset(token)
+        span.end()
+
+def root_span(name, kind="INTERNAL", **attributes):
+    """Start a new trace (if sampled) and make its root span current"""
+    return _activate(tracer.start_root(name, kind, **attributes))
+
+def span(name, kind="INTERNAL", **attributes):
+    """Make a child of the current span current for the ``with`` block"""
+    return _activate(tracer.start_span(name, kind, **attributes))
+
+def traced(name):
+    """Decorator running the function inside a child span"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            parent = _current_span.get()
+            if parent is None or not parent.recording:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def instrument_engine(engine):
+    """Record every SQL statement run through ``engine`` as a client span"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        query_span = tracer.start_span("db.query", "CLIENT", **{
+            "db.system": engine.dialect.name,
+            "db.statement": statement[:500],
+        })
+        conn.info.setdefault("trace_spans", []).append(query_span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            spans.pop().end()
+
+    @event.listens_for(engine, "handle_error")
+    def fail_query(exception_context):
+        spans = exception_context.connection.info.get("trace_spans") if exception_context.connection else None
+        if spans:
+            query_span = spans.pop()
+            query_span.record_exception(exception_context.original_exception)
+            query_span.end()
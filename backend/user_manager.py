@@ -1,38 +1,184 @@
 
 import os
 import sys
+import time
 import getpass
-from sqlalchemy import create_engine, or_
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+from sqlalchemy import create_engine, select, insert, delete, or_, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 
 # Add the parent directory to the path so we can import app modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import Base, User, FaceData, ExamSession, get_password_hash
+from app import (
+    Base, Tenant, TENANT_ID_PATTERN, User, FaceData, FaceDataTombstone, ExamSession, ExamSummary, ExamRoster, VerificationFrame,
+    ROLES, get_password_hash, next_gallery_seq, exam_session_aggregates, gallery_directory, face_images, frame_images,
+)
+from settings import SQLALCHEMY_DATABASE_URL, KNOWN_FACES_DIR, UPLOADS_DIR, DEFAULT_TENANT
+from gallery import notify_gallery
+
+# Columns written by export_users, also accepted by import_users
+EXPORT_COLUMNS = ["tenant_id", "username", "full_name", "role", "is_active", "face_registered", "created_at"]
 
 def list_users(db):
     """List all users in the database"""
-    users = db.query(User).all()
+    # Stream the rows in batches instead of loading the whole table
+    users = (
+        db.query(User.id, User.tenant_id, User.username, User.full_name, User.role)
+        .order_by(User.username)
+        .execution_options(stream_results=True)
+        .yield_per(1000)
+    )
 
-    if not users:
+    total = 0
+    for user in users:
+        if not total:
+            print("\nUsers in the database:")
+            print("-" * 86)
+            print(f"{'ID':<8} {'Tenant':<15} {'Username':<20} {'Full Name':<30} {'Role'}")
+            print("-" * 86)
+        print(f"{user.id[:8]:<8} {user.tenant_id or '':<15} {user.username:<20} {user.full_name or '':<30} {user.role}")
+        total += 1
+
+    if not total:
         print("No users found in the database.")
         return
 
-    print("\nUsers in the database:")
-    print("-" * 80)
-    print(f"{'ID':<8} {'Username':<20} {'Email':<30} {'Full Name':<20} {'Role'}")
-    print("-" * 80)
+    print("-" * 86)
+    print(f"Total users: {total}")
+
+def list_tenants(db):
+    """List every tenant with its number of users"""
+    counts = dict(db.query(User.tenant_id, func.count(User.id)).group_by(User.tenant_id).all())
+    print(f"{'Tenant':<20} {'Name':<40} {'Users'}")
+    print("-" * 70)
+    for tenant in db.query(Tenant).order_by(Tenant.id):
+        print(f"{tenant.id:<20} {tenant.name or '':<40} {counts.get(tenant.id, 0)}")
+
+def add_tenant(db, tenant_id, name=None):
+    """Create a tenant, an institution whose users and faces are kept apart
+    from every other tenant's"""
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        print("Error: tenant ids use lowercase letters, digits, '-' and '_', and start with a letter or digit.")
+        return False
+    if db.query(Tenant.id).filter(Tenant.id == tenant_id).first():
+        print(f"Error: tenant '{tenant_id}' already exists.")
+        return False
+    db.add(Tenant(id=tenant_id, name=name or tenant_id))
+    db.commit()
+    print(f"Tenant '{tenant_id}' has been created.")
+    return True
 
-    for user in users:
-        print(f"{user.id[:8]:<8} {user.username:<20} {user.email:<30} {user.full_name:<20} {user.role}")
+def index_uploads():
+    """Map each user id and session id to its files in the uploads directory,
+    in one pass over the directory"""
+    uploads = defaultdict(list)
+    if not os.path.isdir(UPLOADS_DIR):
+        return uploads
+    with os.scandir(UPLOADS_DIR) as entries:
+        for entry in entries:
+            # Enrolment photos are "<user id>_<name>", verification frames
+            # "verify_<session id>_<name>"
+            if entry.name.startswith("verify_"):
+                owner = entry.name.split("_", 2)[1]
+            else:
+                owner = entry.name.split("_", 1)[0]
+            uploads[owner].append(entry.path)
+    return uploads
 
-    print("-" * 80)
-    print(f"Total users: {len(users)}")
+def remove_file(path):
+    """Delete a file and return its size, or None if it was already gone"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return None
+
+def unreferenced_images(db, column, keys, *others, chunk_size=500):
+    """Return the image keys that no row matching ``others`` references
+    through ``column``"""
+    keys = [key for key in set(keys) if key]
+    referenced = set()
+    for start in range(0, len(keys), chunk_size):
+        referenced.update(db.scalars(select(column).where(column.in_(keys[start:start + chunk_size]), *others)))
+    return set(keys) - referenced
+
+def delete_stored_image(item):
+    store, key = item
+    return store.delete(key)
+
+def delete_users_batch(db, user_ids, uploads, pool):
+    """Delete a batch of users with their face data, exam sessions, roster
+    entries and files, using one DELETE per table.
+
+    Files go first and rows are committed in one transaction, so a batch
+    that is interrupted is found and finished by the next run. Deleted
+    faces are tombstoned and the galleries notified, which also drops them
+    from the servers' roster and result caches. Returns counters.
+    """
+    sessions = db.execute(select(ExamSession.id, ExamSession.exam_id).where(ExamSession.user_id.in_(user_ids))).all()
+    session_ids = select(ExamSession.id).where(ExamSession.user_id.in_(user_ids))
+    faces = db.execute(
+        select(FaceData.tenant_id, FaceData.user_id, FaceData.encoding_version, FaceData.image_key)
+        .where(FaceData.user_id.in_(user_ids))
+    ).all()
+
+    # Stored images are content-addressed, so only those no other user's
+    # rows point to are deleted
+    frame_keys = db.scalars(select(VerificationFrame.image_key).where(VerificationFrame.session_id.in_(session_ids)))
+    images = [(face_images.store, key) for key in unreferenced_images(
+        db, FaceData.image_key, [face.image_key for face in faces], FaceData.user_id.notin_(user_ids)
+    )]
+    images += [(frame_images.store, key) for key in unreferenced_images(
+        db, VerificationFrame.image_key, frame_keys, VerificationFrame.session_id.notin_(session_ids)
+    )]
+
+    # Files saved before the image store
+    paths = [os.path.join(KNOWN_FACES_DIR, f"{user_id}.jpg") for user_id in user_ids]
+    for owner in list(user_ids) + [session.id for session in sessions]:
+        paths.extend(uploads.pop(owner, []))
+
+    sizes = [size for size in pool.map(remove_file, paths) if size is not None]
+    sizes += [size for size in pool.map(delete_stored_image, images) if size is not None]
+    seq = None
+    if faces:
+        seq = next_gallery_seq(db)
+        db.execute(insert(FaceDataTombstone), [
+            {"tenant_id": face.tenant_id, "user_id": face.user_id, "encoding_version": face.encoding_version, "seq": seq}
+            for face in faces
+        ])
+        db.execute(delete(FaceData).where(FaceData.user_id.in_(user_ids)))
+
+    db.execute(delete(VerificationFrame).where(VerificationFrame.session_id.in_(session_ids)))
+    db.execute(delete(ExamSession).where(ExamSession.user_id.in_(user_ids)))
+    db.execute(delete(ExamRoster).where(ExamRoster.user_id.in_(user_ids)))
+
+    # Recount the summaries of the exams these sessions belonged to
+    exam_ids = {session.exam_id for session in sessions}
+    if exam_ids:
+        db.execute(delete(ExamSummary).where(ExamSummary.exam_id.in_(exam_ids)))
+        summaries = [dict(row._mapping) for row in exam_session_aggregates(db).filter(ExamSession.exam_id.in_(exam_ids))]
+        if summaries:
+            db.execute(insert(ExamSummary), summaries)
+
+    db.execute(delete(User).where(User.id.in_(user_ids)))
+    db.commit()
+
+    for tenant_id, version in {(face.tenant_id, face.encoding_version) for face in faces}:
+        notify_gallery(gallery_directory(version, tenant_id), seq)
+
+    return {"users": len(user_ids), "faces": len(faces), "sessions": len(sessions), "files": len(sizes), "bytes": sum(sizes)}
 
-def delete_user(db, user_id=None, username=None, email=None):
+def delete_user(db, user_id=None, username=None):
     """Delete a user from the database"""
-    if not any([user_id, username, email]):
-        print("Please provide either user_id, username, or email to delete a user.")
+    if not any([user_id, username]):
+        print("Please provide either user_id or username to delete a user.")
         return False
 
     # Build the query
@@ -41,8 +187,6 @@ def delete_user(db, user_id=None, username=None, email=None):
         query = query.filter(User.id == user_id)
     elif username:
         query = query.filter(User.username == username)
-    elif email:
-        query = query.filter(User.email == email)
 
     user = query.first()
 
@@ -50,51 +194,89 @@ def delete_user(db, user_id=None, username=None, email=None):
         print("User not found.")
         return False
 
-    print(f"Found user: {user.username} ({user.email})")
-
-    # Delete associated face data
-    face_data = db.query(FaceData).filter(FaceData.user_id == user.id).all()
-    if face_data:
-        print(f"Deleting {len(face_data)} face data records...")
-        for data in face_data:
-            db.delete(data)
-
-    # Delete associated exam sessions
-    exam_sessions = db.query(ExamSession).filter(ExamSession.user_id == user.id).all()
-    if exam_sessions:
-        print(f"Deleting {len(exam_sessions)} exam session records...")
-        for session in exam_sessions:
-            db.delete(session)
-
-    # Delete face image file if it exists
-    face_image_path = f"known_faces/{user.id}.jpg"
-    if os.path.exists(face_image_path):
-        print(f"Deleting face image file: {face_image_path}")
-        os.remove(face_image_path)
-
-    # Delete the user
-    db.delete(user)
-    db.commit()
+    print(f"Found user: {user.username} ({user.full_name})")
+    username = user.username
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        counts = delete_users_batch(db, [user.id], index_uploads(), pool)
 
-    print(f"User {user.username} has been deleted successfully.")
+    print(f"Deleted {counts['faces']} face data records, {counts['sessions']} exam sessions and {counts['files']} files.")
+    print(f"User {username} has been deleted successfully.")
     return True
 
+def bulk_delete_users(db, role=None, created_before=None, exam_id=None, batch_size=500, workers=8, confirm=True, tenant_id=None):
+    """Delete every user matching all of the given filters: a role, created
+    before a date, registered for or having sat an exam, or in a tenant.
+
+    Users are deleted ``batch_size`` at a time, in user id order, while
+    ``workers`` threads remove their files. Deleted users no longer match,
+    so an interrupted run is resumed by running it again. Returns the
+    number of users deleted.
+    """
+    filters = []
+    if role:
+        filters.append(User.role == role)
+    if created_before:
+        filters.append(User.created_at < created_before)
+    if tenant_id:
+        filters.append(User.tenant_id == tenant_id)
+    if exam_id:
+        filters.append(or_(
+            User.id.in_(select(ExamRoster.user_id).where(ExamRoster.exam_id == exam_id)),
+            User.id.in_(select(ExamSession.user_id).where(ExamSession.exam_id == exam_id)),
+        ))
+    if not filters:
+        print("Please give a role, a creation date, an exam or a tenant to select the users to delete.")
+        return 0
+
+    matching = db.query(User.id).filter(*filters).count()
+    if not matching:
+        print("No users match.")
+        return 0
+    if confirm and input(f"Delete {matching} users with their face data, exam sessions and files? (yes/no): ").strip().lower() != "yes":
+        print("Operation cancelled.")
+        return 0
+
+    started = time.time()
+    uploads = index_uploads()
+    totals = defaultdict(int)
+    last_user_id = ""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            user_ids = list(db.scalars(
+                select(User.id).where(*filters, User.id > last_user_id).order_by(User.id).limit(batch_size)
+            ))
+            if not user_ids:
+                break
+            last_user_id = user_ids[-1]
+
+            for counter, value in delete_users_batch(db, user_ids, uploads, pool).items():
+                totals[counter] += value
+            print(f"Deleted {totals['users']}/{matching} users, {rate(totals['users'], time.time() - started)}")
+
+    print(
+        f"Deleted {totals['users']} users, {totals['faces']} face encodings, {totals['sessions']} exam sessions "
+        f"and {totals['files']} files ({totals['bytes'] / 1e6:.1f} MB) in {time.time() - started:.1f}s"
+    )
+    return totals["users"]
+
 def create_user(db):
     """Create a new user in the database"""
     print("\nCreate a new user:")
     print("-" * 30)
 
     username = input("Username: ")
-    email = input("Email: ")
     full_name = input("Full Name: ")
+    tenant_id = input(f"Tenant (blank for {DEFAULT_TENANT}): ").strip() or DEFAULT_TENANT
+    if not db.query(Tenant.id).filter(Tenant.id == tenant_id).first():
+        print(f"Error: tenant '{tenant_id}' does not exist.")
+        return False
 
     # Check if user already exists
-    existing_user = db.query(User).filter(
-        or_(User.username == username, User.email == email)
-    ).first()
+    existing_user = db.query(User).filter(User.username == username).first()
 
     if existing_user:
-        print(f"Error: User with username '{username}' or email '{email}' already exists.")
+        print(f"Error: User with username '{username}' already exists.")
         return False
 
     # Get password
@@ -118,8 +300,8 @@ def create_user(db):
     # Create the user
     hashed_password = get_password_hash(password)
     new_user = User(
+        tenant_id=tenant_id,
         username=username,
-        email=email,
         hashed_password=hashed_password,
         full_name=full_name,
         role=role
@@ -131,17 +313,218 @@ def create_user(db):
     print(f"\nUser '{username}' has been created successfully with role '{role}'.")
     return True
 
-def main():
-    print("TrustFace 2.0 User Manager")
-    print("=" * 30)
+def read_user_file(path):
+    """Read a CSV or Parquet file of users, every column as text"""
+    if path.lower().endswith(".parquet"):
+        try:
+            users = pd.read_parquet(path)
+        except ImportError:
+            raise ImportError("Parquet files need pyarrow, install it with: pip install pyarrow")
+    else:
+        users = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return users.fillna("").astype(str)
+
+def rate(count, seconds):
+    """Format a throughput"""
+    return f"{count / max(seconds, 1e-9):,.0f}/s"
+
+def existing_usernames(db, usernames, chunk_size=500):
+    """Return which of the given usernames are taken, looking up only those"""
+    taken = set()
+    for start in range(0, len(usernames), chunk_size):
+        taken.update(db.scalars(select(User.username).where(User.username.in_(usernames[start:start + chunk_size]))))
+    return taken
+
+def hash_passwords(passwords, workers):
+    """Hash passwords on every core; bcrypt is deliberately slow"""
+    if not passwords:
+        return []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(get_password_hash, passwords, chunksize=max(1, len(passwords) // (workers * 16))))
+
+def insert_users(db, rows, chunk_size):
+    """Insert one transaction's worth of users with multi-row INSERTs.
+
+    Users created by someone else since the duplicate check are dropped
+    and the batch is retried. Returns the number inserted.
+    """
+    try:
+        for start in range(0, len(rows), chunk_size):
+            db.execute(insert(User), rows[start:start + chunk_size])
+        db.commit()
+        return len(rows)
+    except IntegrityError:
+        db.rollback()
+        taken = set(db.scalars(select(User.username).where(User.username.in_([row["username"] for row in rows]))))
+        rows = [row for row in rows if row["username"] not in taken]
+        for start in range(0, len(rows), chunk_size):
+            db.execute(insert(User), rows[start:start + chunk_size])
+        db.commit()
+        return len(rows)
+
+def import_users(db, path, workers=None, batch_size=5000, chunk_size=500, tenant_id=DEFAULT_TENANT):
+    """Create users from a CSV or Parquet file.
+
+    The file needs a ``username`` column and either ``password`` (hashed
+    here) or ``hashed_password`` (as written by ``export_users`` with
+    hashes). ``full_name``, ``role`` and ``tenant_id`` are optional; rows
+    without a tenant go to ``tenant_id``. Rows with a username
+    that already exists, in the database or earlier in the file, are
+    skipped. Users are inserted ``chunk_size`` rows per statement and
+    committed every ``batch_size`` rows. Returns the number created.
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.time()
+    try:
+        users = read_user_file(path)
+    except (OSError, ValueError, ImportError) as e:
+        print(f"Error: could not read {path}: {e}")
+        return 0
+    print(f"Read {len(users)} rows in {time.time() - started:.2f}s")
+
+    if "username" not in users.columns or not {"password", "hashed_password"} & set(users.columns):
+        print("Error: the file needs a username column and a password or hashed_password column.")
+        return 0
+    for column in ("full_name", "password", "hashed_password"):
+        if column not in users.columns:
+            users[column] = ""
+    users["username"] = users["username"].str.strip()
+    users["role"] = users["role"].str.strip().str.lower().replace("", "student") if "role" in users.columns else "student"
+    users["tenant_id"] = users["tenant_id"].str.strip().replace("", tenant_id) if "tenant_id" in users.columns else tenant_id
+
+    # Validate and de-duplicate as whole columns: a few chunked queries for
+    # the file's usernames instead of one lookup per row
+    checked = time.time()
+    invalid = (
+        (users["username"] == "") | ~users["role"].isin(ROLES) | ~users["tenant_id"].isin(set(db.scalars(select(Tenant.id))))
+        | ((users["password"] == "") & (users["hashed_password"] == ""))
+    )
+    repeated = users["username"].duplicated()
+    existing = users["username"].isin(existing_usernames(db, users["username"].unique().tolist(), chunk_size))
+    users = users[~(invalid | repeated | existing)]
+    print(
+        f"Checked {len(invalid)} rows in {time.time() - checked:.2f}s: {len(users)} new, {int(existing.sum())} already exist, "
+        f"{int((repeated & ~existing).sum())} repeated in the file, {int(invalid.sum())} invalid"
+    )
 
-    # Database setup
-    SQLALCHEMY_DATABASE_URL = "sqlite:///./trustface.db"
+    hashed = time.time()
+    needs_hash = users["hashed_password"] == ""
+    hashes = users["hashed_password"].copy()
+    hashes[needs_hash] = pd.Series(hash_passwords(users.loc[needs_hash, "password"].tolist(), workers), index=hashes.index[needs_hash])
+    hash_count = int(needs_hash.sum())
+    if hash_count:
+        print(f"Hashed {hash_count} passwords with {workers} workers in {time.time() - hashed:.1f}s ({rate(hash_count, time.time() - hashed)})")
+
+    inserted = time.time()
+    rows = [
+        {"tenant_id": tenant, "username": username, "hashed_password": hashed_password, "full_name": full_name, "role": role}
+        for tenant, username, hashed_password, full_name, role in zip(
+            users["tenant_id"], users["username"], hashes, users["full_name"], users["role"]
+        )
+    ]
+    created = 0
+    for start in range(0, len(rows), batch_size):
+        created += insert_users(db, rows[start:start + batch_size], chunk_size)
+    elapsed = time.time() - started
+    print(f"Inserted {created} users in {time.time() - inserted:.2f}s ({rate(created, time.time() - inserted)})")
+    print(f"Imported {created} users in {elapsed:.1f}s ({rate(created, elapsed)} overall)")
+    return created
+
+def export_users(db, path, include_hashes=False, chunk_size=10000, tenant_id=None):
+    """Write every user, or every user of one tenant, to a CSV or Parquet
+    file, without face data.
+
+    ``include_hashes`` adds the password hashes, so that the file can be
+    imported into another deployment with the passwords unchanged.
+    Returns the number exported.
+    """
+    started = time.time()
+    columns = [getattr(User, name) for name in EXPORT_COLUMNS]
+    if include_hashes:
+        columns.append(User.hashed_password)
+    query = select(*columns).order_by(User.username)
+    if tenant_id:
+        query = query.where(User.tenant_id == tenant_id)
+
+    # Read in chunks so the export never holds the table twice
+    chunks = pd.read_sql(query, db.connection(), chunksize=chunk_size)
+    total = 0
+    try:
+        if path.lower().endswith(".parquet"):
+            parts = list(chunks)
+            users = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=[column.key for column in columns])
+            users.to_parquet(path, index=False)
+            total = len(users)
+        else:
+            for index, chunk in enumerate(chunks):
+                chunk.to_csv(path, mode="a" if index else "w", header=not index, index=False)
+                total += len(chunk)
+            if not total:
+                pd.DataFrame(columns=[column.key for column in columns]).to_csv(path, index=False)
+    except (OSError, ImportError) as e:
+        print(f"Error: could not write {path}: {e}")
+        return 0
+
+    elapsed = time.time() - started
+    print(f"Exported {total} users to {path} in {elapsed:.2f}s ({rate(total, elapsed)})")
+    return total
+
+def open_session():
+    # The same database the server uses
     engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return SessionLocal()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage TrustFace users; without a command, starts the interactive menu")
+    commands = parser.add_subparsers(dest="command")
+    import_parser = commands.add_parser("import", help="create users from a CSV or Parquet file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="password hashing processes (default: all cores)")
+    import_parser.add_argument("--batch-size", type=int, default=5000, help="users per transaction")
+    import_parser.add_argument("--tenant", default=DEFAULT_TENANT, help=f"tenant of rows without a tenant_id (default: {DEFAULT_TENANT})")
+    export_parser = commands.add_parser("export", help="write all users to a CSV or Parquet file")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--with-password-hashes", action="store_true", help="include password hashes, for moving users between deployments")
+    export_parser.add_argument("--tenant", help="only export the users of this tenant")
+    delete_parser = commands.add_parser("delete", help="delete all users matching every given filter")
+    delete_parser.add_argument("--role", choices=ROLES)
+    delete_parser.add_argument("--created-before", type=datetime.fromisoformat, help="creation date, e.g. 2025-09-01")
+    delete_parser.add_argument("--exam", help="exam id the users are registered for or have sat")
+    delete_parser.add_argument("--tenant", help="tenant the users belong to")
+    delete_parser.add_argument("--batch-size", type=int, default=500, help="users per transaction")
+    delete_parser.add_argument("--workers", type=int, default=8, help="threads deleting files")
+    delete_parser.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    commands.add_parser("tenants", help="list the tenants")
+    tenant_parser = commands.add_parser("add-tenant", help="create a tenant, an institution with its own users and faces")
+    tenant_parser.add_argument("tenant_id", help="lowercase letters, digits, '-' and '_'")
+    tenant_parser.add_argument("--name", help="display name")
+    args = parser.parse_args()
+
+    if args.command:
+        db = open_session()
+        try:
+            if args.command == "import":
+                import_users(db, args.path, args.workers, args.batch_size, tenant_id=args.tenant)
+            elif args.command == "export":
+                export_users(db, args.path, args.with_password_hashes, tenant_id=args.tenant)
+            elif args.command == "tenants":
+                list_tenants(db)
+            elif args.command == "add-tenant":
+                add_tenant(db, args.tenant_id, args.name)
+            else:
+                bulk_delete_users(
+                    db, args.role, args.created_before, args.exam, args.batch_size, args.workers, not args.yes, args.tenant
+                )
+        finally:
+            db.close()
+        return
+
+    print("TrustFace 2.0 User Manager")
+    print("=" * 30)
 
     # Create a session
-    db = SessionLocal()
+    db = open_session()
 
     try:
         while True:
@@ -149,9 +532,11 @@ def main():
             print("1. List all users")
             print("2. Delete a user")
             print("3. Create a new user")
-            print("4. Exit")
+            print("4. Import users from a CSV or Parquet file")
+            print("5. Export users to a CSV or Parquet file")
+            print("6. Exit")
 
-            choice = input("\nEnter your choice (1-4): ")
+            choice = input("\nEnter your choice (1-6): ")
 
             if choice == "1":
                 list_users(db)
@@ -159,7 +544,7 @@ def main():
                 print("\nDelete a user:")
                 print("1. By ID")
                 print("2. By username")
-                print("3. By email")
+                print("3. In bulk, by role, creation date, exam or tenant")
                 print("4. Cancel")
 
                 delete_choice = input("Select option (1-4): ")
@@ -171,8 +556,16 @@ def main():
                     username = input("Enter username: ")
                     delete_user(db, username=username)
                 elif delete_choice == "3":
-                    email = input("Enter email: ")
-                    delete_user(db, email=email)
+                    role = input("Role (blank for any): ").strip() or None
+                    created_before = input("Created before, YYYY-MM-DD (blank for any): ").strip()
+                    exam_id = input("Exam ID (blank for any): ").strip() or None
+                    tenant_id = input("Tenant (blank for any): ").strip() or None
+                    try:
+                        created_before = datetime.fromisoformat(created_before) if created_before else None
+                    except ValueError:
+                        print("Invalid date.")
+                        continue
+                    bulk_delete_users(db, role, created_before, exam_id, tenant_id=tenant_id)
                 elif delete_choice == "4":
                     print("Operation cancelled.")
                 else:
@@ -181,6 +574,10 @@ def main():
             elif choice == "3":
                 create_user(db)
             elif choice == "4":
+                import_users(db, input("File to import: ").strip())
+            elif choice == "5":
+                export_users(db, input("File to write: ").strip())
+            elif choice == "6":
                 print("Exiting...")
                 break
             else:
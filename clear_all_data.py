@@ -1,21 +1,25 @@
 
 import os
 import sys
-import shutil
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-# Add the parent directory to the path so we can import app modules
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Add the backend directory to the path so we can import app modules
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+sys.path.append(BACKEND_DIR)
 
-from app import Base, User, FaceData, ExamSession
+# The server runs from the backend directory, so relative database and
+# data paths in the settings must be resolved from there too
+os.chdir(BACKEND_DIR)
+
+from settings import SQLALCHEMY_DATABASE_URL
+from reset_database import delete_all_records, remove_data_directories
 
 def clear_all_data():
     """Clear all data from the database and remove all uploaded files"""
     print("Clearing all data from TrustFace 2.0 database...")
 
     # Database setup (same as in app.py)
-    SQLALCHEMY_DATABASE_URL = "sqlite:///./backend/trustface.db"
     engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -24,14 +28,7 @@ def clear_all_data():
 
     try:
         # Delete all records from each table
-        print("Deleting all user records...")
-        db.query(User).delete()
-
-        print("Deleting all face data records...")
-        db.query(FaceData).delete()
-
-        print("Deleting all exam session records...")
-        db.query(ExamSession).delete()
+        delete_all_records(db)
 
         # Commit the changes
         db.commit()
@@ -43,21 +40,8 @@ def clear_all_data():
     finally:
         db.close()
 
-    # Remove uploaded files
-    uploads_dir = "backend/uploads"
-    if os.path.exists(uploads_dir):
-        print(f"Removing {uploads_dir} directory...")
-        shutil.rmtree(uploads_dir)
-        os.makedirs(uploads_dir)
-        print(f"Recreated {uploads_dir} directory.")
-
-    # Remove known faces
-    known_faces_dir = "backend/known_faces"
-    if os.path.exists(known_faces_dir):
-        print(f"Removing {known_faces_dir} directory...")
-        shutil.rmtree(known_faces_dir)
-        os.makedirs(known_faces_dir)
-        print(f"Recreated {known_faces_dir} directory.")
+    # Remove uploaded files, stored images and the gallery snapshot
+    remove_data_directories()
 
     print("All data has been cleared successfully!")
     print("The application will start with a completely clean database.")
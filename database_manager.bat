@@ -43,8 +43,8 @@ if "%choice%"=="1" (
 
     echo.
     echo Removing uploaded files...
-    if exist "backend\uploads" (
-        rd /s /q "backend\uploads"
+    if exist "backend\backend\uploads" (
+        rd /s /q "backend\backend\uploads"
         echo Uploads directory removed.
     ) else (
         echo Uploads directory not found.
@@ -52,17 +52,35 @@ if "%choice%"=="1" (
 
     echo.
     echo Removing known faces...
-    if exist "backend\known_faces" (
-        rd /s /q "backend\known_faces"
+    if exist "backend\backend\known_faces" (
+        rd /s /q "backend\backend\known_faces"
         echo Known faces directory removed.
     ) else (
         echo Known faces directory not found.
     )
 
+    echo.
+    echo Removing stored face crops and frames...
+    if exist "backend\backend\images" (
+        rd /s /q "backend\backend\images"
+        echo Images directory removed.
+    ) else (
+        echo Images directory not found.
+    )
+
+    echo.
+    echo Removing the face gallery snapshot...
+    if exist "backend\backend\gallery" (
+        rd /s /q "backend\backend\gallery"
+        echo Gallery directory removed.
+    ) else (
+        echo Gallery directory not found.
+    )
+
     echo.
     echo Recreating directories...
-    mkdir "backend\uploads" 2>nul
-    mkdir "backend\known_faces" 2>nul
+    mkdir "backend\backend\uploads" 2>nul
+    mkdir "backend\backend\known_faces" 2>nul
     echo Directories recreated.
 
     echo.
@@ -102,27 +102,6 @@ const Input = styled.input`
   }
 `;
 
-const Select = styled.select`
-  background: rgba(30, 35, 65, 0.5);
-  border: 1px solid rgba(255, 255, 255, 0.1);
-  border-radius: ${props => props.theme.borderRadius};
-  padding: 12px 16px;
-  color: ${props => props.theme.colors.text};
-  font-size: 16px;
-  transition: ${props => props.theme.transitions.normal};
-  cursor: pointer;
-
-  &:focus {
-    outline: none;
-    border-color: ${props => props.theme.colors.primary};
-    box-shadow: 0 0 0 3px rgba(74, 158, 255, 0.2);
-  }
-
-  option {
-    background: ${props => props.theme.colors.surfaceLight};
-  }
-`;
-
 const Button = styled.button`
   background: linear-gradient(90deg, ${props => props.theme.colors.primary}, ${props => props.theme.colors.secondary});
   border: none;
@@ -205,8 +184,7 @@ const Register = () => {
     email: '',
     password: '',
     confirmPassword: '',
-    full_name: '',
-    role: 'student'
+    full_name: ''
   });
   const [error, setError] = useState('');
   const [success, setSuccess] = useState('');
@@ -239,8 +217,7 @@ const Register = () => {
       username: formData.username,
       email: formData.email,
       password: formData.password.length + ' characters',
-      full_name: formData.full_name,
-      role: formData.role
+      full_name: formData.full_name
     });
 
     try {
@@ -249,8 +226,7 @@ const Register = () => {
         username: formData.username,
         email: formData.email,
         password: formData.password,
-        full_name: formData.full_name,
-        role: formData.role
+        full_name: formData.full_name
       });
 
       console.log('Registration response:', response.data);
@@ -344,21 +320,6 @@ const Register = () => {
             />
           </FormGroup>
 
-          <FormGroup>
-            <Label htmlFor="role">Role</Label>
-            <Select
-              id="role"
-              name="role"
-              value={formData.role}
-              onChange={handleChange}
-              required
-            >
-              <option value="student">Student</option>
-              <option value="proctor">Proctor</option>
-              <option value="admin">Admin</option>
-            </Select>
-          </FormGroup>
-
           <FormGroup>
             <Label htmlFor="password">Password</Label>
             <Input